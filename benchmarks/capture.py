@@ -0,0 +1,279 @@
+"""Replay key events through track()'s keyboard callbacks and time the capture path
+
+Usage: python benchmarks/capture.py [-n N] [--file key_presses.csv]
+           [--format csv binary partitioned] [--buffered | --unbuffered]
+           [--fsync commit exit never] [--capacity N]
+
+Events come from synthetic keystrokes, or a recorded key_presses.csv with
+--file, and are sent straight to on_press and on_release through a listener
+that stands in for pynput's, with keys standing in for its Key and KeyCode,
+so neither a keyboard nor pynput is needed. For each format and mode, and
+fsync policy, this prints:
+
+    events/s      key events captured per second, writes included
+    p50/p99/max   latency of single on_press and on_release calls
+    flush         seconds to write and fsync what was still held after the
+                  replay
+    syncs         fsync calls
+    dropped       keystrokes lost because the ring buffer was full
+    KiB peak      peak memory allocated during the replay, from tracemalloc
+    blocks/key    memory blocks still allocated afterwards, per keystroke
+    write amp     bytes written by the process per byte of packed keystroke
+                  (binary.RECORD), from /proc/self/io where available,
+                  otherwise bytes on disk
+
+Replay is far faster than typing, so by default buffered runs get a ring
+buffer holding every keystroke of the run, and none are dropped. With a
+smaller --capacity, e.g. the default BUFFER_CAPACITY, some may be, and
+events/s, blocks/key and write amp then only count keystrokes captured.
+"""
+import argparse
+import contextlib
+import enum
+import gc
+import io
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from taptracker import _taptracker, binary, storage
+from taptracker.keylog import FSYNC_POLICIES
+
+from synthetic import keystrokes
+
+FILE_NAMES = {
+    "csv": "key_presses.csv",
+    "binary": f"key_presses{binary.SUFFIX}",
+    "partitioned": f"key_presses{storage.SUFFIX}",
+}
+
+
+# Stand in for pynput's Key, named keys, as track() only uses their name
+Key = enum.Enum("Key", binary.NAMED_KEYS)
+
+
+class KeyCode:
+    """Stands in for pynput's KeyCode, a key typing char"""
+
+    __slots__ = ("char",)
+
+    def __init__(self, char: str):
+        self.char = char
+
+    @classmethod
+    def from_char(cls, char: str) -> "KeyCode":
+        return cls(char)
+
+
+class ReplayListener:
+    """Stands in for pynput's Listener, replay() calls the callbacks directly"""
+
+    def __init__(self, on_press, on_release):
+        self.on_press = on_press
+        self.on_release = on_release
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def canonical(self, key):
+        return key
+
+    def replay(self, events) -> tuple[np.ndarray, np.ndarray]:
+        """Send each (is_press, key) event, returning ns per press and release"""
+        clock = time.perf_counter_ns
+        on_press, on_release = self.on_press, self.on_release
+        press, release = [], []
+        for is_press, key in events:
+            start = clock()
+            if is_press:
+                on_press(key)
+                press.append(clock() - start)
+            else:
+                on_release(key)
+                release.append(clock() - start)
+        return np.array(press), np.array(release)
+
+
+def key_object(name: str) -> Key | KeyCode:
+    if name in Key.__members__:
+        return Key[name]
+    return KeyCode.from_char(name)
+
+
+def events(df: pd.DataFrame) -> list[tuple[bool, Key | KeyCode]]:
+    """Press and release events of keystrokes in the key_presses.csv layout
+
+    Events are in time order, keys that would stop tracking (esc) or have no
+    name are left out.
+    """
+    df = df[df["key"].notna() & (df["key"] != "esc") & (df["key"] != "")]
+    keys = [key_object(str(name)) for name in df["key"]]
+    times = np.concatenate((df["press_ts"].to_numpy(), df["release_ts"].to_numpy()))
+    is_press = np.arange(len(times)) < len(keys)
+    order = np.argsort(times, kind="stable")
+    return [(bool(is_press[i]), keys[i % len(keys)]) for i in order]
+
+
+def written_bytes() -> int | None:
+    """Bytes this process has passed to write calls, if the OS reports it"""
+    try:
+        with open("/proc/self/io") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except OSError:
+        return None
+    return int(counters["wchar"])
+
+
+def disk_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size if path.exists() else 0
+
+
+def run(
+    replay,
+    key_file: Path,
+    buffered: bool,
+    fsync: str = "exit",
+    trace: bool = False,
+    capacity: int | None = None,
+) -> dict:
+    """Track to key_file while replaying events, then stop and flush
+
+    capacity is that of the ring buffer, by default one keystroke per press
+    """
+    excepthook = sys.excepthook
+    if capacity is None:
+        capacity = max(1, sum(is_press for is_press, _ in replay))
+    with contextlib.redirect_stdout(io.StringIO()):
+        listener = _taptracker.track(
+            key_file,
+            buffered,
+            ReplayListener,
+            fsync=fsync,
+            serve=False,
+            buffer_capacity=capacity,
+        )
+
+    if trace:
+        tracemalloc.start()
+    # Collected first, so garbage freed during the replay is not counted
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    start = time.perf_counter()
+    press, release = listener.replay(replay)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    result = {"blocks": sys.getallocatedblocks() - blocks}
+    if trace:
+        result["peak"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    dropped = _taptracker.writer_stats().get("dropped", 0)
+    log = _taptracker._log
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        _taptracker.stop_tracking()
+    flush = time.perf_counter() - start
+    sys.excepthook = excepthook
+    return {
+        **result,
+        "elapsed": elapsed,
+        "flush": flush,
+        "dropped": dropped,
+        "syncs": log.syncs,
+        "press": press,
+        "release": release,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=100_000, help="Synthetic keystrokes")
+    parser.add_argument("--file", type=Path, help="Recorded key_presses.csv")
+    parser.add_argument(
+        "--format", nargs="+", choices=FILE_NAMES, default=list(FILE_NAMES)
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--buffered", action="store_true", help="Only buffered tracking")
+    mode.add_argument("--unbuffered", action="store_true", help="Only unbuffered")
+    parser.add_argument(
+        "--fsync", nargs="+", choices=FSYNC_POLICIES, default=["exit"]
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        help="Ring buffer capacity of buffered runs, by default every keystroke",
+    )
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.file) if args.file else keystrokes(args.n)
+    replay = events(df)
+    n_keys = len(replay) // 2
+    modes = [False, True]
+    if args.buffered or args.unbuffered:
+        modes = [args.buffered]
+    print(f"{len(replay)} events, {n_keys} keystrokes")
+    print(
+        f"{'format':<12}{'buffered':<10}{'fsync':<8}{'events/s':>10}"
+        f"{'press p50/p99/max us':>24}{'release p50/p99/max us':>26}"
+        f"{'flush s':>9}{'syncs':>7}{'dropped':>9}{'KiB peak':>10}{'blocks/key':>12}"
+        f"{'write amp':>11}"
+    )
+
+    cases = [
+        (format, buffered, fsync)
+        for format in args.format
+        for buffered in modes
+        for fsync in args.fsync
+    ]
+    for format, buffered, fsync in cases:
+        with tempfile.TemporaryDirectory() as tmp:
+            key_file = Path(tmp) / FILE_NAMES[format]
+            before = written_bytes()
+            result = run(replay, key_file, buffered, fsync, capacity=args.capacity)
+            after = written_bytes()
+            written = disk_bytes(key_file) if before is None else after - before
+        with tempfile.TemporaryDirectory() as tmp:
+            traced = run(
+                replay,
+                Path(tmp) / FILE_NAMES[format],
+                buffered,
+                fsync,
+                True,
+                args.capacity,
+            )
+        # Rates are of what was captured, so runs that dropped keystrokes do
+        # not look faster for it
+        captured = n_keys - result["dropped"]
+        if captured == 0:
+            print(f"{format:<12}{str(buffered):<10}{fsync:<8}every keystroke dropped")
+            continue
+
+        latency = {}
+        for name in ("press", "release"):
+            ns = (*np.percentile(result[name], [50, 99]), result[name].max())
+            latency[name] = "/".join(f"{v / 1000:.1f}" for v in ns)
+        print(
+            f"{format:<12}{str(buffered):<10}{fsync:<8}"
+            f"{2 * captured / result['elapsed']:>10.0f}"
+            f"{latency['press']:>24}{latency['release']:>26}"
+            f"{result['flush']:>9.3f}{result['syncs']:>7}{result['dropped']:>9}"
+            f"{traced['peak'] / 1024:>10.0f}"
+            f"{result['blocks'] / captured:>12.2f}"
+            f"{written / (captured * binary.RECORD.size):>11.2f}"
+        )
+        if result["dropped"]:
+            print(f"  {result['dropped']} keystrokes dropped, rates are of the rest")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Time and peak memory of reading a CSV key file for the features
+
+Usage: python benchmarks/ingest.py [n_keystrokes] [n_ids] [chunk_rows]
+
+Writes a key_presses.csv of n_keystrokes, by default 10 million, then reads
+the columns the features need from it, dropping unknown hands, each way in a
+fresh process:
+
+    read_csv    pd.read_csv of every column with inferred types, then
+                .query("hand != 'U'"), as processing.process used to
+    c           ingest.read_csv with pandas' C parser, chunk_rows at a time
+    pyarrow     ingest.read_csv streaming with pyarrow.csv, if installed
+
+    peak MB     growth of the process's peak resident memory while reading
+    result MB   memory held by the resulting frame
+"""
+import importlib.util
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from taptracker import ingest
+from taptracker.params import CSV_CHUNK_ROWS
+
+from synthetic import keystrokes
+
+WRITE_ROWS = 1_000_000
+# ru_maxrss is in KiB on Linux, bytes on macOS
+MAXRSS_BYTES = 1 if sys.platform == "darwin" else 1024
+
+
+def write_key_file(path: Path, n: int, ids: int) -> Path:
+    """n keystrokes written a part at a time, so writing stays within memory"""
+    for part, start in enumerate(range(0, n, WRITE_ROWS)):
+        df = keystrokes(min(WRITE_ROWS, n - start), ids, seed=part)
+        df.to_csv(path, mode="a", header=part == 0, index=False)
+    return path
+
+
+def peak_bytes() -> int:
+    """Peak resident memory of this process"""
+    # ru_maxrss carries over the parent's peak on Linux, VmHWM does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_BYTES
+
+
+def read(method: str, key_file: Path, chunk_rows: int) -> pd.DataFrame:
+    if method == "read_csv":
+        return pd.read_csv(key_file).query("hand != 'U'")
+    return ingest.read_csv(key_file, engine=method, chunk_rows=chunk_rows)
+
+
+def run(method: str, key_file: Path, chunk_rows: int):
+    """Read key_file one way in this process, printing the result as JSON"""
+    before = peak_bytes()
+    start = time.perf_counter()
+    df = read(method, key_file, chunk_rows)
+    seconds = time.perf_counter() - start
+    print(
+        json.dumps(
+            {
+                "seconds": seconds,
+                "peak MB": (peak_bytes() - before) / 2**20,
+                "result MB": df.memory_usage(deep=True).sum() / 2**20,
+                "rows": len(df),
+            }
+        )
+    )
+
+
+def measure(method: str, key_file: Path, chunk_rows: int) -> dict | None:
+    proc = subprocess.run(
+        [sys.executable, __file__, "--run", method, str(key_file), str(chunk_rows)],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.strip().splitlines()[-1], file=sys.stderr)
+        return None
+    return json.loads(proc.stdout)
+
+
+def main(n: int = 10_000_000, ids: int = 1, chunk_rows: int = CSV_CHUNK_ROWS):
+    methods = ["read_csv", "c"]
+    if importlib.util.find_spec("pyarrow"):
+        methods.append("pyarrow")
+    with tempfile.TemporaryDirectory() as tmp:
+        key_file = write_key_file(Path(tmp) / "key_presses.csv", n, ids)
+        size = key_file.stat().st_size / 2**20
+        print(f"{n} keystrokes, {ids} IDs, {size:.0f} MB, chunks of {chunk_rows}")
+        print(f"{'':<10}{'seconds':>9}{'peak MB':>10}{'result MB':>11}{'rows':>11}")
+        for method in methods:
+            result = measure(method, key_file, chunk_rows)
+            if result is None:
+                print(f"{method:<10}{'failed':>9}")
+                continue
+            print(
+                f"{method:<10}{result['seconds']:>9.2f}{result['peak MB']:>10.0f}"
+                f"{result['result MB']:>11.0f}{result['rows']:>11}"
+            )
+        if "pyarrow" not in methods:
+            print("pyarrow is not installed")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--run"]:
+        run(sys.argv[2], Path(sys.argv[3]), int(sys.argv[4]))
+    else:
+        main(*map(int, sys.argv[1:]))
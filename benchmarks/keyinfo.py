@@ -0,0 +1,140 @@
+"""Memory and serialization cost per keystroke of KeyInfo records
+
+Usage: python benchmarks/keyinfo.py [n_keystrokes]
+
+Compares the slotted KeyInfo the keyboard hook creates, holding key and hand
+codes, with the dataclass it replaced, which held key and hand names and a
+datetime and was written through astuple():
+
+    bytes/key     memory still allocated per held record, from tracemalloc
+    create us     time to create and release one record, as the hook does
+    csv us        time per record to write a batch of them as CSV
+    binary us     time per record to pack a batch of them for a .tap file
+"""
+import csv
+import io
+import sys
+import time
+import tracemalloc
+from dataclasses import astuple, dataclass
+from datetime import datetime
+
+from taptracker import binary
+from taptracker._taptracker import KeyInfo
+from taptracker.params import UUID
+
+KEYS = "etaoinshrdlu"
+BATCH = 26
+
+
+@dataclass
+class LegacyKeyInfo:
+    id: str = UUID
+    timestamp: datetime = datetime.now()
+    press_ts: float = -1
+    release_ts: float = -1
+    key: str = ""
+    hand: str = "U"
+    hold_time: float = -1
+
+    def __iter__(self):
+        return iter(astuple(self))
+
+
+def make_legacy(i: int) -> LegacyKeyInfo:
+    info = LegacyKeyInfo(
+        timestamp=datetime.now(),
+        press_ts=time.perf_counter(),
+        key=KEYS[i % len(KEYS)],
+        hand="L",
+    )
+    info.release_ts = time.perf_counter()
+    info.hold_time = info.release_ts - info.press_ts
+    return info
+
+
+def make_slotted(i: int) -> KeyInfo:
+    info = KeyInfo(ord(KEYS[i % len(KEYS)]), 1, time.perf_counter_ns())
+    info.release_ns = time.perf_counter_ns()
+    return info
+
+
+def write_legacy_csv(info: list, f):
+    csv.writer(f).writerows(info)
+
+
+def write_slotted_csv(info: list, f):
+    csv.writer(f).writerows(
+        (
+            UUID,
+            datetime.fromtimestamp(t),
+            p,
+            r,
+            binary.key_name(key),
+            binary.HANDS[hand],
+            r - p,
+        )
+        for key, hand, t, p, r in binary.keystroke_rows(info)
+    )
+
+
+def pack_legacy(info: list) -> bytes:
+    return binary.pack_rows(
+        (k.key, k.hand, k.timestamp, k.press_ts, k.release_ts) for k in info
+    )
+
+
+def pack_slotted(info: list) -> bytes:
+    return binary.pack_records(binary.keystroke_rows(info))
+
+
+def bytes_per_record(make, n: int) -> float:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [make(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    # Less the list holding them
+    return (after - before - sys.getsizeof(held)) / len(held)
+
+
+def per_record_us(fn, n: int) -> float:
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main(n: int = 200_000):
+    print(f"{n} keystrokes, written in batches of {BATCH}")
+    print(
+        f"{'record':<10}{'bytes/key':>11}{'create us':>11}{'csv us':>9}"
+        f"{'binary us':>11}"
+    )
+    cases = {
+        "dataclass": (make_legacy, write_legacy_csv, pack_legacy),
+        "slotted": (make_slotted, write_slotted_csv, pack_slotted),
+    }
+    for name, (make, write_csv, pack) in cases.items():
+        size = bytes_per_record(make, n)
+        create = per_record_us(lambda: [make(i) for i in range(n)], n)
+        info = [make(i) for i in range(n)]
+        batches = [info[i : i + BATCH] for i in range(0, n, BATCH)]
+
+        def csv_batches():
+            f = io.StringIO()
+            for batch in batches:
+                write_csv(batch, f)
+
+        def pack_batches():
+            for batch in batches:
+                pack(batch)
+
+        print(
+            f"{name:<10}{size:>11.0f}{create:>11.2f}"
+            f"{per_record_us(csv_batches, n):>9.2f}"
+            f"{per_record_us(pack_batches, n):>11.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
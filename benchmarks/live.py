@@ -0,0 +1,97 @@
+"""Report feature latency from the running tracker against history size
+
+Usage: python benchmarks/live.py [n_session_keystrokes] [history sizes...]
+
+For each history size a key_presses.csv of that many keystrokes is written,
+tracking is started on it with replayed key events and the control API on a
+temporary socket, and once the history has been read:
+
+    seed s        seconds the background thread took to read the history
+    fold us/key   time to fold one keystroke into the live statistics
+    numpy ms      processing.process with the numpy backend, reading the file
+    incr ms       the incremental backend, reading what was added since seeding
+    live ms       the live backend, asking the tracker over the control API
+
+Only live should stay flat as the history grows.
+"""
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from taptracker import _taptracker, control, live, processing
+from taptracker.features import FEATURE_NAMES
+from taptracker.params import UUID
+
+from capture import ReplayListener, events
+from synthetic import keystrokes
+
+REPEAT = 5
+
+
+def median_ms(fn, *args) -> float:
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def fold_us(n: int = 20_000) -> float:
+    """Microseconds per keystroke for LiveFeatures.add_many in batches of 26"""
+    feats = live.LiveFeatures()
+    feats.seed({}, None)
+    info = [
+        _taptracker.KeyInfo(ord("a"), 1 + i % 2, i * 10**8, i * 10**8 + 5 * 10**7)
+        for i in range(n)
+    ]
+    start = time.perf_counter()
+    for i in range(0, n, 26):
+        feats.add_many(info[i : i + 26])
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def run(root: Path, history: int, session: int) -> dict:
+    key_file = root / f"history{history}.csv"
+    df = keystrokes(history)
+    df["id"] = UUID
+    df.to_csv(key_file, index=False)
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        listener = _taptracker.track(key_file, listener_cls=ReplayListener)
+    _taptracker._live.seeded.wait()
+    seed = time.perf_counter() - start
+    listener.replay(events(keystrokes(session, seed=1)))
+
+    columns = ["id", *FEATURE_NAMES]
+    result = {"seed s": seed, "fold us/key": fold_us()}
+    backends = {"numpy": "numpy", "incr": "incremental", "live": "live"}
+    for name, backend in backends.items():
+        result[f"{name} ms"] = median_ms(processing.process, key_file, backend, columns)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _taptracker.shutdown()
+    return result
+
+
+def main(session: int = 2000, *histories: int):
+    histories = histories or (10_000, 100_000, 1_000_000)
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        control.CONTROL_SOCKET = root / "taptracker.sock"
+        control.CONTROL_TOKEN_FILE = root / "taptracker.token"
+        print(f"{session} keystrokes tracked on top of the history, median of {REPEAT}")
+        header = None
+        for history in histories:
+            result = run(root, history, session)
+            if header is None:
+                header = f"{'history':>10}" + "".join(f"{k:>13}" for k in result)
+                print(header)
+            print(f"{history:>10}" + "".join(f"{v:>13.2f}" for v in result.values()))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
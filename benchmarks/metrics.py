@@ -0,0 +1,70 @@
+"""Overhead of taptracker.metrics, disabled and enabled
+
+Usage: python benchmarks/metrics.py [n_calls] [n_keystrokes]
+
+Times a call of an empty function bare, through metrics.timed and inside
+metrics.timer, with metrics disabled and enabled, in ns per call. Then replays
+n_keystrokes through track()'s keyboard hook with metrics disabled and
+enabled, where enabling also times on_press and on_release, in us per event.
+"""
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from taptracker import _taptracker, metrics
+
+from capture import ReplayListener, events
+from synthetic import keystrokes
+
+
+def noop():
+    pass
+
+
+timed_noop = metrics.timed("benchmark.noop")(noop)
+
+
+def in_timer():
+    with metrics.timer("benchmark.noop"):
+        pass
+
+
+def per_call_ns(fn, n: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter_ns() - start) / n
+
+
+def hook_us(key_file: Path, n: int) -> float:
+    """Mean us per key event in track()'s keyboard hook, on_press and on_release"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        listener = _taptracker.track(
+            key_file, listener_cls=ReplayListener, serve=False
+        )
+    try:
+        press, release = listener.replay(events(keystrokes(n)))
+    finally:
+        with contextlib.redirect_stdout(io.StringIO()):
+            _taptracker.stop_tracking()
+    return (press.sum() + release.sum()) / (len(press) + len(release)) / 1000
+
+
+def main(n: int = 1_000_000, keys: int = 20_000):
+    print(f"{'':<12}{'bare ns':>10}{'timed ns':>10}{'timer ns':>10}{'hook us':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for state in ("disabled", "enabled"):
+            if state == "enabled":
+                metrics.enable()
+            calls = [per_call_ns(fn, n) for fn in (noop, timed_noop, in_timer)]
+            hook = hook_us(Path(tmp) / f"{state}.csv", keys)
+            print(f"{state:<12}" + "".join(f"{v:>10.1f}" for v in (*calls, hook)))
+    print()
+    print(metrics.format_stats(metrics.snapshot()))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,64 @@
+"""Scaling of parallel.corpus_features with the number of worker processes
+
+Usage: python benchmarks/parallel.py [n_keystrokes] [n_files] [format]
+
+Writes a corpus of n_files key files, csv or binary, one ID each, holding
+n_keystrokes between them, then computes every ID's features with 1, 2, 4 and
+8 workers, up to the number of CPUs, checking each result against 1 worker.
+Speedup is against the single process run.
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from taptracker import binary
+from taptracker.features import FEATURE_NAMES
+from taptracker.parallel import corpus_features
+
+from synthetic import write_csv
+
+
+def write_corpus(root: Path, n: int, files: int, format: str) -> Path:
+    for i in range(files):
+        csv_file = write_csv(root / f"user{i:05d}.csv", n // files, 1, i, first_id=i)
+        if format == "binary":
+            binary.convert_csv(csv_file, csv_file.with_suffix(binary.SUFFIX))
+            csv_file.unlink()
+    return root
+
+
+def main(n: int = 4_000_000, files: int = 64, format: str = "csv"):
+    columns = ["id", *FEATURE_NAMES]
+    cpus = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = write_corpus(Path(tmp), n, files, format)
+        print(f"{n} keystrokes in {files} {format} files, {cpus} CPUs")
+        print(f"{'workers':>7}{'seconds':>10}{'keys/s':>12}{'speedup':>9}")
+
+        expected, single = None, None
+        for workers in (1, 2, 4, 8):
+            if workers > cpus and workers > 1:
+                break
+            start = time.perf_counter()
+            result = corpus_features(corpus, columns, max_workers=workers)
+            elapsed = time.perf_counter() - start
+            if expected is None:
+                expected, single = result, elapsed
+            else:
+                np.testing.assert_array_equal(
+                    result[list(FEATURE_NAMES)].to_numpy(),
+                    expected[list(FEATURE_NAMES)].to_numpy(),
+                )
+            print(
+                f"{workers:>7}{elapsed:>10.3f}{n / elapsed:>12,.0f}"
+                f"{single / elapsed:>9.2f}"
+            )
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(*map(int, args[:2]), *args[2:])
@@ -0,0 +1,63 @@
+"""Check the NumPy feature engine against keysprep and compare their speed
+
+Usage: python benchmarks/processing.py [n_keystrokes] [n_ids]
+"""
+import sys
+import time
+import warnings
+
+import numpy as np
+from scipy import stats
+
+from taptracker.features import FEATURE_NAMES, FeatureEngine
+from taptracker.processing import keysprep
+
+from synthetic import keystrokes
+
+
+def pandas_features(df, columns):
+    def percentn(n):
+        return lambda x: np.percentile(x, n)
+
+    return keysprep(
+        df.query("hand != 'U'"),
+        ["FlightTime", "HoldTime"],
+        [
+            np.mean,
+            np.std,
+            stats.kurtosis,
+            stats.skew,
+            *[percentn(n) for n in range(10, 100, 10)],
+        ],
+        columns,
+    )
+
+
+def main(n: int = 1_000_000, ids: int = 1):
+    warnings.simplefilter("ignore")
+    df = keystrokes(n, ids)
+    columns = ["id", *FEATURE_NAMES]
+
+    start = time.perf_counter()
+    expected = pandas_features(df.copy(), columns)
+    pandas_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = FeatureEngine(columns).compute_frame(df)
+    numpy_time = time.perf_counter() - start
+
+    assert list(result["id"]) == list(expected["id"])
+    np.testing.assert_allclose(
+        result[list(FEATURE_NAMES)].to_numpy(),
+        expected[list(FEATURE_NAMES)].to_numpy(dtype=float),
+        rtol=1e-9,
+        atol=1e-12,
+    )
+
+    print(f"{n} keystrokes, {ids} ids: outputs match")
+    print(f"pandas keysprep: {pandas_time:.3f}s")
+    print(f"numpy engine:    {numpy_time:.3f}s ({pandas_time / numpy_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
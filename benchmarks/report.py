@@ -0,0 +1,149 @@
+"""Time each stage of report() end to end against the local mock Viya server
+
+Usage: python benchmarks/report.py [-n N] [--latency S] [--jitter F] [--repeat R]
+
+The mock server is started on a free port and taptracker is pointed at it
+through TAPTRACKER_BASE_URL, the same way a command line run would be, with
+latency injected before every reply. Stages are timed separately, then
+report() as a whole, with the schema cache cold and warm:
+
+    token         SASLogon refresh token exchange
+    schema cold   model inputs from MAS with no cached copy
+    schema 304    revalidating the cached copy with its ETag
+    schema cached model_get_inputs from the local cache
+    csv load      load_keystrokes, reading what the features need from
+                  key_presses.csv
+    keysprep      pandas statistics of hold and flight times, as report() does
+    numpy         the same statistics with the numpy backend, for comparison
+    scoring       one MAS score request
+"""
+import argparse
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import stats
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Must be set before taptracker is imported, as params reads it once
+PORT = free_port()
+os.environ["TAPTRACKER_BASE_URL"] = f"http://127.0.0.1:{PORT}/"
+
+from taptracker import _taptracker, connections, ingest, processing  # noqa: E402
+from taptracker.mockserver import MockViyaServer  # noqa: E402
+
+from synthetic import write_csv  # noqa: E402
+
+
+def timed(fn, *args, repeat: int = 1, setup=None) -> tuple[float, object]:
+    """Median seconds of fn(*args) over repeat calls, and its last result"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn(*args)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def pandas_keysprep(df, input_cols):
+    """The pandas statistics exactly as processing.process calls keysprep"""
+    df = df.astype({"id": str, "hand": str})
+    percent_funcs = [
+        (lambda n: lambda x: np.percentile(x, n))(n) for n in range(10, 100, 10)
+    ]
+    return processing.keysprep(
+        df,
+        ["FlightTime", "HoldTime"],
+        [np.mean, np.std, stats.kurtosis, stats.skew, *percent_funcs],
+        input_cols,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=200_000, help="Synthetic keystrokes")
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds before every reply"
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    repeat = args.repeat
+
+    assert connections.BASE_URL == os.environ["TAPTRACKER_BASE_URL"]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        connections.CREDENTIALS_FILE = tmp / "credentials.json"
+        connections.SCHEMA_CACHE_FILE = tmp / "schema_cache.json"
+        connections.REFRESH_TOKEN_FILE = tmp / "refresh_token.txt"
+        connections.REFRESH_TOKEN_FILE.write_text("mock")
+        key_file = write_csv(tmp / "key_presses.csv", args.n)
+
+        def cold_cache():
+            connections.SCHEMA_CACHE_FILE.unlink(missing_ok=True)
+
+        mock = MockViyaServer(
+            port=PORT, latency=args.latency, jitter=args.jitter
+        )
+        with mock:
+            results = {}
+            results["token"], _ = timed(
+                connections.refresh_access_token, repeat=repeat
+            )
+            results["schema cold"], inputs = timed(
+                connections.fetch_model_inputs, repeat=repeat, setup=cold_cache
+            )
+            results["schema 304"], _ = timed(
+                connections.fetch_model_inputs, repeat=repeat
+            )
+            results["schema cached"], _ = timed(
+                connections.model_get_inputs, repeat=repeat
+            )
+            results["csv load"], df = timed(
+                processing.load_keystrokes,
+                key_file,
+                ingest.FEATURE_COLUMNS,
+                True,
+                repeat=repeat,
+            )
+            results["keysprep"], _ = timed(
+                pandas_keysprep, df, inputs, repeat=repeat
+            )
+            results["numpy"], payload = timed(
+                processing.process, key_file, "numpy", inputs, repeat=repeat
+            )
+            results["scoring"], _ = timed(
+                connections.model_score_presses, payload, repeat=repeat
+            )
+            results["report cold"], _ = timed(
+                _taptracker.report, key_file, repeat=repeat, setup=cold_cache
+            )
+            results["report warm"], _ = timed(
+                _taptracker.report, key_file, repeat=repeat
+            )
+            requests = dict(mock.requests)
+
+    print(
+        f"{args.n} keystrokes, {args.latency * 1000:.0f} ms injected latency, "
+        f"median of {repeat}"
+    )
+    for stage, seconds in results.items():
+        print(f"{stage:<15}{seconds * 1000:>10.1f} ms")
+    print(f"requests: {requests}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
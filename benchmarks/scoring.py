@@ -0,0 +1,62 @@
+"""Compare local tree scoring with MAS scoring through the mock server
+
+Usage: python benchmarks/scoring.py [n_keystrokes] [n_trees]
+"""
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from taptracker import connections, processing
+from taptracker.features import FEATURE_NAMES
+from taptracker.mockserver import MockViyaServer
+from taptracker.scoring import LocalTreeBackend, MASBackend
+
+from synthetic import tree_model, write_csv
+
+
+def timed(label: str, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    print(f"{label}: {time.perf_counter() - start:.4f}s")
+    return result
+
+
+def main(n: int = 200_000, n_trees: int = 200):
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        model_file = tmp / "model.json"
+        # Exported with the MAS inputs, which include id
+        features = ["id", *FEATURE_NAMES]
+        model_file.write_text(json.dumps(tree_model(features, n_trees)))
+        local = LocalTreeBackend(model_file)
+
+        key_file = write_csv(tmp / "key_presses.csv", n)
+        rows = processing.feature_rows(key_file, "1h", local.input_columns())
+        payload = processing.row_payload(rows.iloc[0])
+        print(f"{n} keystrokes, {len(rows)} hourly rows, {n_trees} trees")
+
+        with MockViyaServer(model=local) as server:
+            connections.BASE_URL = server.url
+            connections.CREDENTIALS_FILE = tmp / "credentials.json"
+            connections.SCHEMA_CACHE_FILE = tmp / "schema_cache.json"
+            connections.REFRESH_TOKEN_FILE = tmp / "refresh_token.txt"
+            connections.REFRESH_TOKEN_FILE.write_text("mock")
+            mas = MASBackend()
+            mas.connect()
+
+            local_one = timed("local, one payload ", local.score, payload)
+            mas_one = timed("mas, one payload   ", mas.score, payload)
+            local_rows = timed("local, all rows    ", local.score_rows, rows)
+            mas_rows = timed("mas, all rows      ", mas.score_rows, rows)
+
+        assert local_one == tuple(mas_one)
+        np.testing.assert_allclose(local_rows["probability"], mas_rows["probability"])
+        print("local and mas scores match")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
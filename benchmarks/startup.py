@@ -0,0 +1,109 @@
+"""Import time of each taptracker command, and a budget for --track
+
+Usage: python benchmarks/startup.py [budget_ms] [repeat]
+
+Runs python -X importtime in a fresh interpreter for the imports each
+command makes before doing any work, repeat times, and reports the median:
+
+    ms          cumulative import time of taptracker's own modules, as the
+                top level imports of the command
+    modules     number of modules imported, including the standard library
+    heavy       GUI, HTTP and data libraries among them
+
+Exits with status 1 if --track takes more than budget_ms, or imports any of
+the heavy libraries. pynput is imported by --track but not counted against
+the budget, its import time depends on the platform's keyboard backend.
+Where it cannot be imported, e.g. without a display, --track is skipped and
+the exit status is 2, so a limit of the machine does not read as a
+regression.
+"""
+import statistics
+import subprocess
+import sys
+
+# Imports made by each command before it starts work, see __main__.py
+COMMANDS = {
+    "--help": "import taptracker.__main__",
+    "--track": (
+        "import taptracker.__main__; from taptracker import keymap;"
+        " import pynput.keyboard"
+    ),
+    "--upload": "import taptracker.__main__; from taptracker import connections",
+    "--report": (
+        "import taptracker.__main__;"
+        " from taptracker import processing, reporting, scoring"
+    ),
+    "--gui": "import taptracker.__main__; from taptracker import gui",
+}
+HEAVY = ("tkinter", "customtkinter", "requests", "numpy", "pandas", "scipy")
+OVER_BUDGET = 1
+SKIPPED = 2
+
+
+def import_times(code: str) -> list[tuple[str, int, int]]:
+    """(module, self us, cumulative us) of each import
+
+    Raises
+    ------
+        ImportError: With the last line of the error, if an import failed
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        lines = proc.stderr.strip().splitlines()
+        # The exception line, hints may follow it
+        errors = [line for line in lines if "Error" in line]
+        raise ImportError((errors or lines)[-1])
+    times = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        # Nested imports are indented under the import making them
+        times.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return times
+
+
+def own_ms(times: list[tuple[str, int, int]]) -> float:
+    """Cumulative ms of the top level imports of taptracker modules"""
+    own = [cumulative for name, _, cumulative in times if name.startswith("taptracker")]
+    return sum(own) / 1000
+
+
+def heavy(times: list[tuple[str, int, int]]) -> list[str]:
+    names = {name.strip() for name, _, _ in times}
+    return [module for module in HEAVY if module in names]
+
+
+def main(budget_ms: float = 50, repeat: int = 5) -> int:
+    print(f"{'command':<10}{'ms':>8}{'modules':>9}  heavy")
+    status = 0
+    for command, code in COMMANDS.items():
+        try:
+            runs = [import_times(code) for _ in range(repeat)]
+        except ImportError as e:
+            print(f"{command:<10}{'unavailable here':>17}  {str(e)[:60]}")
+            if command == "--track":
+                status = SKIPPED
+            continue
+        ms = statistics.median(own_ms(times) for times in runs)
+        loaded = heavy(runs[0])
+        print(f"{command:<10}{ms:>8.1f}{len(runs[0]):>9}  {', '.join(loaded)}")
+        if command == "--track" and (ms > budget_ms or loaded):
+            status = OVER_BUDGET
+
+    if status == 0:
+        print(f"--track is within its budget of {budget_ms:g} ms")
+    elif status == SKIPPED:
+        print("--track could not be imported here, its budget was not checked")
+    else:
+        print(f"--track is over its budget of {budget_ms:g} ms, or imports heavy ones")
+    return status
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    raise SystemExit(main(*map(float, args[:1]), *map(int, args[1:2])))
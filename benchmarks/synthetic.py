@@ -0,0 +1,74 @@
+"""Synthetic key press data in the key_presses.csv layout for benchmarks"""
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from taptracker.keymap import load_layout
+
+KEY_HAND_MAP = load_layout("uk")
+KEYS = np.array([*KEY_HAND_MAP, "space"])
+
+
+def keystrokes(
+    n: int, ids: int = 1, seed: int = 0, first_id: int = 0
+) -> pd.DataFrame:
+    """n keystrokes typed by ids users, numbered from first_id, interleaved,
+    with plausible timings"""
+    rng = np.random.default_rng(seed)
+    key = rng.choice(KEYS, n)
+    press_ts = np.cumsum(rng.exponential(0.15, n))
+    hold_time = rng.gamma(4, 0.025, n)
+    start = datetime(2026, 1, 1)
+
+    return pd.DataFrame(
+        {
+            "id": [f"a{i:011d}" for i in rng.integers(first_id, first_id + ids, n)],
+            "timestamp": [
+                str(start + timedelta(seconds=float(t) * 60)) for t in press_ts
+            ],
+            "press_ts": press_ts,
+            "release_ts": press_ts + hold_time,
+            "key": key,
+            "hand": [KEY_HAND_MAP.get(k, "U") for k in key],
+            "hold_time": hold_time,
+        }
+    )
+
+
+def write_csv(
+    path: str | Path, n: int, ids: int = 1, seed: int = 0, first_id: int = 0
+) -> Path:
+    path = Path(path)
+    keystrokes(n, ids, seed, first_id).to_csv(path, index=False)
+    return path
+
+
+def tree_model(
+    features: list[str], n_trees: int = 100, depth: int = 4, seed: int = 0
+) -> dict:
+    """Random boosted tree model in the scoring.LocalTreeBackend JSON layout"""
+    rng = np.random.default_rng(seed)
+    trees = []
+    for _ in range(n_trees):
+        next_id = 0
+
+        def node(level):
+            nonlocal next_id
+            nodeid, next_id = next_id, next_id + 1
+            if level == depth:
+                return {"nodeid": nodeid, "leaf": float(rng.normal(0, 0.1))}
+            left, right = node(level + 1), node(level + 1)
+            return {
+                "nodeid": nodeid,
+                "split": str(rng.choice(features)),
+                "split_condition": float(rng.normal(0.05, 0.1)),
+                "yes": left["nodeid"],
+                "no": right["nodeid"],
+                "missing": left["nodeid"],
+                "children": [left, right],
+            }
+
+        trees.append(node(0))
+    return {"features": list(features), "base_margin": 0.0, "trees": trees}
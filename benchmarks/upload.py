@@ -0,0 +1,70 @@
+"""Count CAS round trips and time upload_key_press against the mock server
+
+Usage: python benchmarks/upload.py [n_keystrokes] [chunk_bytes]
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from taptracker import connections
+from taptracker.mockserver import MockViyaServer
+
+from synthetic import write_csv
+
+
+def legacy_append(caslib, table, file):
+    """The tableExists/upload/runCode/dropTable chain uploads used to make"""
+    if connections.cas_table_exists(caslib, table):
+        temp_table = f"{table}_legacy"
+        connections.cas_table_exists(caslib, temp_table)
+        connections.upload_data(caslib, temp_table, file)
+        connections.append_cas_table(caslib, table, temp_table)
+        connections.delete_cas_table(caslib, temp_table)
+    else:
+        connections.upload_data(caslib, table, file)
+
+
+def run(server: MockViyaServer, key_file: Path, chunk_bytes: int, label: str):
+    server.requests.clear()
+    server.tables.clear()
+    connections.UPLOAD_STATE_FILE.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    connections.upload_key_press(key_file, chunk_bytes=chunk_bytes)
+    elapsed = time.perf_counter() - start
+
+    rows = len(server.table("Public", "taptracker"))
+    print(
+        f"{label}: {sum(server.requests.values())} requests in {elapsed:.3f}s, "
+        f"{rows} rows, {dict(server.requests)}"
+    )
+
+
+def main(n: int = 200_000, chunk_bytes: int = 4 * 1024 * 1024):
+    with tempfile.TemporaryDirectory() as tmp, MockViyaServer() as server:
+        tmp = Path(tmp)
+        connections.BASE_URL, connections.CAS_SERVER = server.url, server.cas_url
+        connections.CREDENTIALS_FILE = tmp / "credentials.json"
+        connections.UPLOAD_STATE_FILE = tmp / "upload_state.json"
+        connections.REFRESH_TOKEN_FILE = tmp / "refresh_token.txt"
+        connections.REFRESH_TOKEN_FILE.write_text("mock")
+
+        key_file = write_csv(tmp / "key_presses.csv", n)
+        print(f"{n} keystrokes, {os.path.getsize(key_file)} bytes")
+        connections.ensure_access_token()
+        connections.ensure_cas_session()
+
+        run(server, key_file, chunk_bytes, "batched")
+
+        append_key_press_data = connections.append_key_press_data
+        connections.append_key_press_data = legacy_append
+        try:
+            run(server, key_file, chunk_bytes, "legacy ")
+        finally:
+            connections.append_key_press_data = append_key_press_data
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
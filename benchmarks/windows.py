@@ -0,0 +1,79 @@
+"""Check windowed features against describing each window from scratch
+
+Usage: python benchmarks/windows.py [n_keystrokes] [window_size] [step]
+
+Synthetic keystrokes are spread over about 100 days per million.
+"""
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from taptracker import windows
+from taptracker.features import FEATURE_NAMES, FeatureEngine, describe, prepare
+
+from synthetic import write_csv
+
+
+def from_scratch(engine, data, labels):
+    """Features of each window by filtering and describing it on its own
+
+    labels are a boolean mask or a slice of keystrokes for each window
+    """
+    columns, masks = prepare(
+        data["hand"], data["press_ts"], data["release_ts"], data["hold_time"]
+    )
+    values = np.full((len(labels), len(engine.columns)), np.nan)
+    for row, in_window in enumerate(labels):
+        for (group, column), targets in engine.plan.items():
+            x = columns[column][in_window]
+            stats = describe(x[masks[group][in_window]])
+            for out, stat in targets:
+                values[row, out] = stats[stat]
+    return values
+
+
+def main(n: int = 1_000_000, size: int = 1000, step: int = 100):
+    columns = list(FEATURE_NAMES)
+    engine = FeatureEngine(columns)
+    with tempfile.TemporaryDirectory() as tmp:
+        key_file = write_csv(Path(tmp) / "key_presses.csv", n)
+        start = time.perf_counter()
+        data = windows.load_sorted(key_file)
+        load = time.perf_counter() - start
+        time_of = pd.DatetimeIndex(windows.to_datetime64(data["time"][1:]))
+        print(f"{n} keystrokes from {time_of[0]} to {time_of[-1]}")
+        print(f"loaded and sorted in {load:.2f}s")
+
+        for window in ("1D", "1h", size):
+            start = time.perf_counter()
+            if isinstance(window, int):
+                labels, result = windows.count_windows(engine, data, window, step)
+            else:
+                labels, result = windows.time_windows(engine, data, window)
+            windowed = time.perf_counter() - start
+
+            if isinstance(window, int):
+                total = len(time_of)
+                ends = np.arange((total - size) % step + size, total + 1, step)
+                labels = [slice(end - size, end) for end in ends]
+            else:
+                starts = time_of.floor(window)
+                labels = [starts == label for label in labels]
+
+            start = time.perf_counter()
+            expected = from_scratch(engine, data, labels)
+            scratch = time.perf_counter() - start
+
+            np.testing.assert_allclose(result, expected, rtol=1e-8, atol=1e-12)
+            print(
+                f"{window!s:>5} windows: {len(result):>6}, windowed {windowed:.2f}s, "
+                f"from scratch {scratch:.2f}s ({scratch / windowed:.1f}x)"
+            )
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
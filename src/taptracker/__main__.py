@@ -1,11 +1,39 @@
+"""Command line entry point
+
+Only what parsing arguments needs is imported up front. Each command imports
+its own subsystem, so --track never loads the GUI, HTTP or data libraries,
+and --report never needs a keyboard backend or a display. See
+benchmarks/startup.py for the import time budget of --track.
+"""
 import argparse
-from typing import Optional
+import sys
+from pathlib import Path
+
+from . import metrics
+from .keylog import FSYNC_POLICIES
+from .keymap import layouts
+from .params import (
+    KEY_BIN_FILE,
+    KEY_FILE,
+    KEY_STORE,
+    KEYBOARD_LAYOUT,
+    LOCAL_MODEL_FILE,
+    LOG_FSYNC,
+    SCORING_BACKENDS,
+    STATS_DIR,
+)
+
+
+def window_spec(value: str) -> str | int:
+    """Parse a --windows value, a number of keystrokes or a pandas frequency"""
+    return int(value) if value.isdigit() else value
+
 
-from . import track, upload, report
-from .gui import gui
+def print_progress(name: str, description: str, number: int, total: int):
+    print(f"[{number}/{total}] {description}...", file=sys.stderr)
 
 
-def main(argv: Optional[str] = None):
+def main(argv: str | None = None):
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--track",
@@ -15,6 +43,39 @@ def main(argv: Optional[str] = None):
             "No identifying information is stored"
         ),
     )
+    parser.add_argument(
+        "--buffered",
+        action="store_true",
+        help=(
+            "With --track, write key presses from a background thread instead "
+            "of the keyboard hook"
+        ),
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default=LOG_FSYNC,
+        help=(
+            "With --track, when written key presses are forced to disk: after "
+            "every write (commit), on exit, or never, leaving it to the OS"
+        ),
+    )
+    parser.add_argument(
+        "--layout",
+        choices=layouts(),
+        default=KEYBOARD_LAYOUT,
+        help="With --track, keyboard layout deciding which hand types each key",
+    )
+    parser.add_argument(
+        "--control",
+        choices=("status", "start", "stop", "flush", "features", "metrics", "shutdown"),
+        help=(
+            "Send a command to the running tracker and print its reply: live "
+            "stats, start or stop tracking, write out held key presses, typing "
+            "statistics so far, timings if started with --stats, or stop "
+            "tracking and exit"
+        ),
+    )
     parser.add_argument(
         "--upload", action="store_true", help="Upload the local taptracker data to CAS"
     )
@@ -23,6 +84,85 @@ def main(argv: Optional[str] = None):
         action="store_true",
         help="Run the SAS Viya model for taptracker and determine Parkinsons ",
     )
+    parser.add_argument(
+        "--format",
+        choices=("csv", "binary", "partitioned"),
+        default="csv",
+        help=(
+            "Key press data format to track to, upload or report from. "
+            f"csv uses {KEY_FILE.name}, binary uses {KEY_BIN_FILE.name}, "
+            f"partitioned uses daily segment files in {KEY_STORE.name}"
+        ),
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help=(
+            f"Compact small segments in {KEY_STORE.name} and delete any past "
+            "the retention period"
+        ),
+    )
+    parser.add_argument(
+        "--convert",
+        action="store_true",
+        help=f"Convert existing {KEY_FILE.name} data to {KEY_BIN_FILE.name}",
+    )
+    parser.add_argument(
+        "--processing",
+        choices=("pandas", "numpy", "incremental", "live"),
+        default="pandas",
+        help=(
+            "With --report, how to calculate typing statistics. numpy is a faster "
+            "single pass equivalent of pandas, incremental only reads key "
+            "presses recorded since the last report, live asks the running "
+            "tracker, which keeps the incremental statistics in memory"
+        ),
+    )
+    parser.add_argument(
+        "--scoring",
+        choices=SCORING_BACKENDS,
+        default="mas",
+        help=(
+            "With --report, score with the model deployed in SAS Viya (mas) or "
+            "with an exported copy of it on this machine (local)"
+        ),
+    )
+    parser.add_argument(
+        "--model-file",
+        type=Path,
+        default=LOCAL_MODEL_FILE,
+        help="Exported model to use with --scoring local",
+    )
+    parser.add_argument(
+        "--windows",
+        type=window_spec,
+        metavar="WINDOW",
+        help=(
+            "With --report, score each window of key presses to show the trend, "
+            "either a pandas frequency such as 1h or 1D, or a number of key "
+            "presses for the latest that many"
+        ),
+    )
+    parser.add_argument(
+        "--step",
+        type=int,
+        help="With --windows N, key presses between rolling windows",
+    )
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        type=Path,
+        metavar="PATH",
+        help=(
+            "With --report, score every ID in these key files, or directories "
+            "of them, calculating typing statistics in parallel processes"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="With --corpus, processes to use, by default one per CPU",
+    )
     parser.add_argument(
         "--gui",
         action="store_true",
@@ -30,21 +170,123 @@ def main(argv: Optional[str] = None):
             "Launch the visual interface"
         ),
     )
+    parser.add_argument(
+        "--stats",
+        nargs="?",
+        const="-",
+        metavar="FILE",
+        help=(
+            "Time each stage of the command, printing a table when it finishes, "
+            "or writing JSON to FILE. A tracker started with it also answers "
+            "--control metrics"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        choices=metrics.PROFILERS,
+        help=(
+            "Profile the capture, processing and network stages of the command, "
+            f"writing one profile per stage to {STATS_DIR.name}"
+        ),
+    )
     args = parser.parse_args(argv)
 
+    if args.stats is None and args.profile is None:
+        return run(parser, args)
+
+    metrics.enable(args.profile)
+    try:
+        return run(parser, args)
+    finally:
+        metrics.dump(args.stats)
+
+
+def run(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Carry out the command parsed from the arguments"""
     if args.gui and any((args.track, args.report, args.upload)):
         raise ValueError("Cannot open GUI and use CLI")
     if args.track and args.report:
         raise ValueError("Cannot specify both --track and --report")
 
+    key_file = {"binary": KEY_BIN_FILE, "partitioned": KEY_STORE}.get(
+        args.format, KEY_FILE
+    )
+
     if args.gui:
+        from .gui import gui
+
         gui()
+    elif args.convert:
+        from .binary import convert_csv
+
+        convert_csv(KEY_FILE, KEY_BIN_FILE)
+    elif args.compact:
+        from .storage import get_store
+
+        store = get_store(KEY_STORE)
+        print(f"Removed {store.compact()} segments by compaction")
+        print(f"Removed {store.apply_retention()} segments past retention")
     elif args.track:
-        track()
+        from . import _taptracker, control
+
+        try:
+            # Already running, in the background or the GUI
+            control.request("start")
+            print("Taptracker is already running, tracking is started")
+            return
+        except control.NotRunning:
+            pass
+        _taptracker.track(
+            key_file, buffered=args.buffered, layout=args.layout, fsync=args.fsync
+        )
+        # Serve the control API until the shutdown command or hotkey
+        try:
+            _taptracker.wait()
+        except KeyboardInterrupt:
+            pass
+        _taptracker.shutdown()
+    elif args.control:
+        import json
+
+        from . import control
+
+        try:
+            print(json.dumps(control.request(args.control), indent=2))
+        except (control.NotRunning, RuntimeError) as e:
+            print(e, file=sys.stderr)
+            return 1
     elif args.upload:
-        upload()
+        from . import upload
+
+        upload(key_file)
+    elif args.report and args.corpus:
+        from . import report_corpus
+
+        print(report_corpus(args.corpus, args.scoring, args.model_file, args.workers))
+    elif args.report and args.windows is not None:
+        from . import report_windows
+
+        print(
+            report_windows(
+                key_file, args.windows, args.scoring, args.model_file, args.step
+            )
+        )
     elif args.report:
-        report()
+        from .reporting import Cancelled, ReportJob
+
+        job = ReportJob(
+            key_file,
+            args.processing,
+            args.scoring,
+            args.model_file,
+            on_progress=print_progress,
+        ).start()
+        try:
+            print(job.result())
+        except (KeyboardInterrupt, Cancelled):
+            job.cancel()
+            print("Report cancelled", file=sys.stderr)
+            return 130
     else:
         parser.print_help()
 
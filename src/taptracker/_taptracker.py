@@ -1,58 +1,130 @@
-import csv
+import atexit
+import contextlib
+import math
+import os
 import sys
 import time
-from dataclasses import astuple, dataclass, fields
-from datetime import datetime
 from pathlib import Path
-from typing import Type
 from types import TracebackType
 
-from pynput.keyboard import Key, KeyCode, Listener, HotKey
+from .params import (
+    BUFFER_CAPACITY,
+    CONTROL_TIMEOUT,
+    KEY_FILE,
+    KEYBOARD_LAYOUT,
+    LOCAL_MODEL_FILE,
+    LOG_COMMIT_INTERVAL,
+    LOG_FSYNC,
+    UUID,
+)
+# Only what tracking needs is imported here, pynput, HTTP and the data
+# libraries are imported by the functions using them, see __main__.py
+from . import binary, control, keylog, metrics, storage
+from .capture import EventRate, KeystrokeWriter, RingBuffer
+from .live import LiveFeatures, end_offset
+
+# Longest a command waits in all, so its reply reaches a client waiting
+# CONTROL_TIMEOUT seconds
+COMMAND_TIMEOUT = CONTROL_TIMEOUT / 2
+
+# Keyboard listener, if tracking
+_listener = None
+# Arguments track was last called with, for the start command
+_settings: dict = {}
+# Keystrokes tracked and their rate, since tracking started
+_rate: EventRate | None = None
+# Typing statistics of everything tracked, kept up to date, see live.py
+_live: LiveFeatures | None = None
+# Control API of this tracker, see control.py
+_server: control.ControlServer | None = None
+# Background writer used by buffered tracking, if running
+_writer: KeystrokeWriter | None = None
+# Group committed writes to the key file while tracking
+_log: keylog.KeyLog | None = None
+# Background compaction of a partitioned key store, if tracking to one
+_compactor: storage.Compactor | None = None
+
+# Pressing esc stops the keyboard listener
+ESC_CODE = binary.key_code("esc")
 
-from .params import KEY_FILE, KEY_HAND_MAP, UUID, IS_RUNNING
-from . import connections
 
-
-@dataclass
 class KeyInfo:
-    """Simple class to store key press info with sensible defaults."""
-
-    id: str = UUID
-    timestamp: datetime = datetime.now()
-    press_ts: float = -1
-    release_ts: float = -1
-    key: str = ""
-    hand: str = "U"
-    hold_time: float = -1
+    """One keystroke from the keyboard hook, slotted to be small and quick to make
 
-    def field_names(self):
-        return tuple(f.name for f in fields(self))
+    key and hand are integer codes as stored in binary key files, see
+    binary.key_code and binary.HANDS, from a keymap.KeyLookup.
+    Press and release are time.perf_counter_ns() readings. The wall clock time
+    of a keystroke is only worked out when it is written, from one
+    binary.clock_anchor for the whole batch, see binary.keystroke_rows.
+    """
 
-    def __iter__(self):
-        return iter(astuple(self))
+    __slots__ = ("key", "hand", "press_ns", "release_ns")
+    id = UUID
+    # Columns of the CSV key file
+    FIELDS = binary.CSV_FIELDS
+
+    def __init__(self, key: int, hand: int, press_ns: int, release_ns: int = -1):
+        self.key = key
+        self.hand = hand
+        self.press_ns = press_ns
+        self.release_ns = release_ns
+
+    @property
+    def press_ts(self) -> float:
+        return self.press_ns / 1e9
+
+    @property
+    def release_ts(self) -> float:
+        return self.release_ns / 1e9
+
+    @property
+    def hold_time(self) -> float:
+        return (self.release_ns - self.press_ns) / 1e9
+
+    def __repr__(self):
+        return (
+            f"KeyInfo(key={binary.key_name(self.key)!r}, "
+            f"hand={binary.HANDS[self.hand]!r}, "
+            f"press_ns={self.press_ns}, release_ns={self.release_ns})"
+        )
 
 
+@metrics.timed("capture.append_keystrokes")
 def append_keystrokes(info: list[KeyInfo], key_file: Path = KEY_FILE):
     """Add info about keystrokes to local data file
 
     Args:
     ----
         info: List of KeyInfo to save
-        key_file: File to either create or append to
+        key_file: File to either create or append to, in the binary format
+            if it has the binary.SUFFIX extension, a partitioned store if it
+            has the storage.SUFFIX extension, otherwise CSV
     """
-    # Check if database created, if not add header row
-    write_header = not key_file.exists()
-    mode = "w" if write_header else "a"
+    if key_file.suffix == storage.SUFFIX:
+        storage.get_store(key_file).append(info)
+        return
+
+    sink = keylog.open_sink(key_file)
+    try:
+        sink.write(info)
+    finally:
+        sink.close()
+
+
+class _NoHotKey:
+    """Stands in for pynput's HotKey when the listener is injected"""
 
-    with key_file.open(mode, newline="") as f:
-        writer = csv.writer(f)
-        if write_header:
-            writer.writerow(KeyInfo().field_names())
-        writer.writerows(info)
+    def press(self, key):
+        pass
 
+    def release(self, key):
+        pass
+
+
+def get_name(key) -> str:
+    """Get the simple name of a pynput Key or KeyCode"""
+    from pynput.keyboard import Key, KeyCode
 
-def get_name(key: Key | KeyCode) -> str:
-    """Get the simple name of a key like object"""
     try:
         if isinstance(key, KeyCode):
             name = key.char.lower()
@@ -63,118 +135,445 @@ def get_name(key: Key | KeyCode) -> str:
     return name
 
 
-def check_running():
-    if IS_RUNNING.exists():
-        raise RuntimeError("The process is already running")
-    else:
-        IS_RUNNING.touch()
+def stop_writer():
+    """Flush and stop the background writer, if buffered tracking is running"""
+    global _writer
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def stop_log():
+    """Write and close the key file of tracking, if running"""
+    global _log
+    if _log is not None:
+        _log.close()
+        _log = None
+
+
+def stop_compactor():
+    """Stop background compaction of the key store, if tracking to one"""
+    global _compactor
+    if _compactor is not None:
+        _compactor.stop()
+        _compactor = None
 
 
-def stop_running():
-    IS_RUNNING.unlink(missing_ok=True)
+def writer_stats() -> dict:
+    """Counters from the background writer, empty if not buffered tracking"""
+    return {} if _writer is None else _writer.stats()
+
+
+def log_stats() -> dict:
+    """Counters from writing the key file, empty if not tracking"""
+    return {} if _log is None else _log.stats()
+
+
+def stop_server():
+    """Stop serving the control API, if running"""
+    global _server
+    if _server is not None:
+        _server.stop()
+        _server = None
 
 
 def stop_tracking():
-    """Exit Python on global hotkey"""
-    Listener().stop()
-    stop_running()
+    """Stop the keyboard listener, and write everything tracked
+
+    The control API keeps running, so tracking can be started again with the
+    start command
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    stop_writer()
+    stop_log()
+    stop_compactor()
     print("Stopped tracking...")
 
 
+def shutdown():
+    """Stop tracking and the control API, ending a tracker run with --track"""
+    stop_tracking()
+    stop_server()
+
+
+def wait():
+    """Wait until the control API is shut down, by the hotkey or a command"""
+    server = _server
+    if server is not None:
+        server.wait()
+
+
 def handle_exception(
-    exc_type: Type[BaseException],
+    exc_type: type[BaseException],
     exc_value: BaseException,
     exc_traceback: TracebackType,
 ) -> None:
-    """Deletes IS_RUNNING if exception found"""
-    stop_running()
+    """Writes held keystrokes and stops the control API if exception found"""
+    stop_writer()
+    stop_log()
+    stop_server()
     sys.__excepthook__(exc_type, exc_value, exc_traceback)
 
 
-def track():
+def tracker_status() -> dict:
+    """Whether tracking, and live counters of the tracker"""
+    tracking = _listener is not None and getattr(_listener, "running", True)
+    result = {"tracking": tracking, "pid": os.getpid()}
+    if _rate is not None:
+        result.update(
+            key_file=str(_settings["key_file"]),
+            uptime=time.monotonic() - _rate.started,
+            keystrokes=_rate.count,
+            events_per_sec=_rate.rate(),
+            held=len(_log) if _log is not None else 0,
+            buffer_depth=len(_writer.buffer) if _writer is not None else 0,
+            history_read=_live is not None and _live.seeded.is_set(),
+            log=log_stats(),
+            writer=writer_stats(),
+        )
+    return result
+
+
+def _start() -> dict:
+    """Start tracking again as last started, if stopped"""
+    if _listener is None:
+        if not _settings:
+            raise RuntimeError("Tracking has not been started in this process")
+        track(**_settings)
+    return tracker_status()
+
+
+def _stop() -> dict:
+    stop_tracking()
+    return tracker_status()
+
+
+def flush_tracking(timeout: float = COMMAND_TIMEOUT) -> dict:
+    """Write and fsync everything held in memory
+
+    Args:
+    ----
+        timeout: Seconds to wait for the writer thread of buffered tracking
+    """
+    if _writer is not None:
+        _writer.sync(timeout)
+    if _log is not None:
+        _log.commit(sync=True)
+    return tracker_status()
+
+
+def snapshot_features() -> dict:
+    """Typing statistics of the whole key file, from memory, after a flush"""
+    if _live is None:
+        raise RuntimeError("Tracking has not been started in this process")
+    # One budget for both waits, see COMMAND_TIMEOUT
+    deadline = time.monotonic() + COMMAND_TIMEOUT
+    flush_tracking(COMMAND_TIMEOUT)
+    _live.seeded.wait(max(deadline - time.monotonic(), 0))
+    # JSON has no NaN, as statistics of too few keystrokes are
+    return {
+        "id": UUID,
+        "key_file": str(_settings["key_file"]),
+        "features": {
+            name: None if math.isnan(value) else value
+            for name, value in _live.features().items()
+        },
+    }
+
+
+# Commands of the control API, see control.py
+COMMANDS = {
+    "status": tracker_status,
+    "start": _start,
+    "stop": _stop,
+    "flush": flush_tracking,
+    "features": snapshot_features,
+    "metrics": metrics.snapshot,
+}
+
+
+def track(
+    key_file: Path = KEY_FILE,
+    buffered: bool = False,
+    listener_cls: type | None = None,
+    layout: str = KEYBOARD_LAYOUT,
+    fsync: str = LOG_FSYNC,
+    serve: bool = True,
+    buffer_capacity: int = BUFFER_CAPACITY,
+):
+    """Start listening to the keyboard and recording key presses
+
+    Args:
+    ----
+        key_file: File to record key presses to, see append_keystrokes
+        buffered: If True the keyboard hook only places finished keystrokes in
+            a preallocated ring buffer, and a background thread writes them to
+            key_file in batches. Otherwise every LOG_COMMIT_EVENTS keystrokes
+            are written from the hook itself, or after LOG_COMMIT_INTERVAL
+            seconds from a background thread.
+        listener_cls: Called with on_press and on_release to create the
+            keyboard listener, by default pynput's Listener, e.g. to replay
+            recorded key events instead. pynput is then not imported at all,
+            so there is no exit hotkey, and keys only need the char or name
+            attribute of pynput's KeyCode or Key
+        layout: Keyboard layout deciding the hand of each key, see keymap.py
+        fsync: When written keystrokes are forced to disk, see keylog.py
+        serve: Whether to serve the control API, see control.py, unless this
+            process already does. Serving it also checks that no other
+            process is tracking
+        buffer_capacity: Keystrokes the ring buffer of buffered tracking
+            holds, any more are dropped until the writer catches up
+
+    Returns
+    -------
+        The started listener
+
+    Raises
+    ------
+        RuntimeError: If this process, or with serve another, is tracking
+    """
+    global _listener, _settings, _rate, _live, _server, _writer, _log, _compactor
+    from .keymap import KeyLookup
+
+    if _listener is not None:
+        raise RuntimeError("Already tracking")
+    settings = dict(
+        key_file=key_file,
+        buffered=buffered,
+        listener_cls=listener_cls,
+        layout=layout,
+        fsync=fsync,
+        serve=serve,
+        buffer_capacity=buffer_capacity,
+    )
+    if listener_cls is None:
+        # Imported only here, as importing it needs a keyboard backend, e.g. a
+        # display on Linux
+        from pynput.keyboard import HotKey, Listener
+
+        listener_cls = Listener
+        # Global hotkey to exit taptracker
+        hotkey = HotKey(HotKey.parse("<ctrl>+<alt>+<shift>+<esc>"), shutdown)
+    else:
+        hotkey = _NoHotKey()
+
+    # Everything is built into locals, and only made global once the listener
+    # has started. If a step fails, what was started so far is stopped again,
+    # so the next call starts afresh
+    server = writer = compactor = None
+    with contextlib.ExitStack() as undo:
+        if serve and (_server is None or _server.stopped):
+            # The shutdown command stops the server itself, once it has replied
+            server = control.ControlServer(COMMANDS, on_shutdown=stop_tracking)
+            server.start()
+            undo.callback(server.stop)
+
+        # Repairs anything a crash left in key_file, then keeps it open.
+        # Whatever it writes is also folded into the live statistics
+        live = LiveFeatures()
+        log = keylog.KeyLog(
+            key_file,
+            commit_interval=None if buffered else LOG_COMMIT_INTERVAL,
+            fsync=fsync,
+            on_write=live.add_many,
+        )
+        undo.callback(log.close)
+        # Nothing has been written yet, so the history is everything up to here
+        live.start_seeding(key_file, end_offset(key_file))
+
+        if buffered:
+            writer = KeystrokeWriter(RingBuffer(buffer_capacity), log.write)
+            writer.start()
+            undo.callback(writer.stop)
+            buffer = writer.buffer
+
+        if key_file.suffix == storage.SUFFIX:
+            compactor = storage.get_store(key_file).start_compactor()
+            undo.callback(compactor.stop)
+
+        # Key and hand codes of each key, see keymap.KeyLookup
+        lookup = KeyLookup(layout)
+        # Keys that are currently pressed, as key code: KeyInfos
+        current_keys: dict[int, KeyInfo] = {}
+
+        rate = EventRate()
+
+        def on_press(key: "Key | KeyCode"):
+            """Inner function that records initial info when key is pressed
+
+            Accesses current_keys, hotkey from outer scope
+            """
+            hotkey.press(listener.canonical(key))
+
+            code, hand = lookup(key)
+            current_keys[code] = KeyInfo(code, hand, time.perf_counter_ns())
+
+            if code == ESC_CODE:
+                raise SystemExit()
+
+        def on_release(key: "Key | KeyCode"):
+            """Inner function that records final info when key released and stores
+
+            Accesses current_keys, log, rate, hotkey from outer scope. The key
+            press is held by log, which writes it to key_file with those before it
+            """
+            hotkey.release(listener.canonical(key))
+
+            key_info = current_keys.pop(lookup(key)[0], None)
+
+            if key_info is not None:
+                key_info.release_ns = time.perf_counter_ns()
+                rate.add()
+                if buffered:
+                    buffer.put(key_info)
+                else:
+                    log.add(key_info)
+
+        if metrics.enabled():
+            # Only wrapped when enabled, so the hook costs nothing extra otherwise
+            on_press = metrics.timed("capture.on_press")(on_press)
+            on_release = metrics.timed("capture.on_release")(on_release)
+
+        listener = listener_cls(on_press=on_press, on_release=on_release)
+        listener.start()
+        undo.pop_all()
+
+    if server is not None:
+        _server = server
+        atexit.register(stop_server)
+    _settings = settings
+    _live, _log, _writer, _compactor, _rate = live, log, writer, compactor, rate
+    atexit.register(stop_log)
+    if writer is not None:
+        atexit.register(stop_writer)
+    if compactor is not None:
+        atexit.register(stop_compactor)
+    _listener = listener
+
     print("Running taptracker, to exit press Ctrl + Alt + Shift + Esc")
-    check_running()
     sys.excepthook = handle_exception
+    return listener
 
-    # List of all keys that have been pressed and released, as KeyInfo
-    key_presses: list[KeyInfo] = []
-    # Keys that are currently pressed, as str: KeyInfos
-    current_keys: dict[str, KeyInfo] = {}
 
-    # Global hotkey to exit taptracker
-    hotkey = HotKey(HotKey.parse("<ctrl>+<alt>+<shift>+<esc>"), stop_tracking)
+def upload(key_file: Path = KEY_FILE):
+    from taptracker import connections
 
-    def on_press(key: Key | KeyCode):
-        """Inner function that records initial info when key is pressed
+    connections.ensure_access_token()
+    connections.ensure_cas_session()
+    connections.upload_key_press(key_file)
+    # key_file.unlink()
 
-        Accesses current_keys, hotkey from outer scope
-        """
-        hotkey.press(listener.canonical(key))
 
-        name = get_name(key)
+def report(
+    key_file: Path = KEY_FILE,
+    processing_backend: str = "pandas",
+    scoring_backend: str = "mas",
+    model_file: Path = LOCAL_MODEL_FILE,
+):
+    """Score typing patterns in key_file and describe the result
 
-        current_keys[name] = KeyInfo(
-            timestamp=datetime.now(),
-            press_ts=time.perf_counter(),
-            key=name,
-            hand=KEY_HAND_MAP.get(name, "U"),
-        )
+    Args:
+    ----
+        key_file: CSV or binary key press data
+        processing_backend: How to calculate features, see processing.process
+        scoring_backend: "mas" to score with SAS Viya, "local" to score the
+            exported model in model_file without any network calls
+        model_file: Model export used by the local scoring backend
+
+    To report in the background, with progress, use reporting.ReportJob
+    """
+    from taptracker.reporting import ReportJob
 
-        if key == Key.esc:
-            raise SystemExit()
+    return ReportJob(key_file, processing_backend, scoring_backend, model_file).run()
 
-    def on_release(key: Key | KeyCode):
-        """Inner function that records final info when key released and stores
 
-        Accesses current_keys, key_presses, hotkey from outer scope. If more than 50
-        keys have been pressed and stored, then appends key_presses to KEY_FILE
-        and resets key_presses
-        """
-        hotkey.release(listener.canonical(key))
+def report_batch(
+    key_file: Path = KEY_FILE,
+    window: str | int | None = None,
+    scoring_backend: str = "mas",
+    model_file: Path = LOCAL_MODEL_FILE,
+    step: int | None = None,
+):
+    """Score each ID, or each ID and window, in key_file
+
+    Args:
+    ----
+        key_file: CSV or binary key press data, which may hold several IDs
+        window: pandas frequency to split history into, e.g. "1D", or a
+            number of keystrokes for rolling windows of the latest keystrokes
+        scoring_backend, model_file: As for report
+        step: Keystrokes between rolling windows, see windows.window_features
+
+    Returns
+    -------
+        DataFrame indexed by ID and window with classification and probability
+    """
+    from taptracker import processing, scoring
 
-        nonlocal key_presses
-        name = get_name(key)
+    scorer = scoring.get_backend(scoring_backend, model_file)
+    scorer.connect()
 
-        key_info = current_keys.pop(name, None)
+    if not key_file.exists():
+        raise RuntimeError(f"No key press data found in {key_file}")
 
-        if key_info is not None:
-            key_info.release_ts = time.perf_counter()
-            key_info.hold_time = key_info.release_ts - key_info.press_ts
-            key_presses.append(key_info)
+    rows = processing.feature_rows(key_file, window, scorer.input_columns(), step)
+    return scorer.score_rows(rows)
 
-        if len(key_presses) > 25:
-            append_keystrokes(key_presses)
-            key_presses = []
 
-    listener = Listener(on_press=on_press, on_release=on_release)
-    listener.start()
+def report_windows(
+    key_file: Path = KEY_FILE,
+    window: str | int = "1D",
+    scoring_backend: str = "mas",
+    model_file: Path = LOCAL_MODEL_FILE,
+    step: int | None = None,
+) -> str:
+    """Describe how the score for key_file changes from window to window
 
+    Arguments are as for report_batch
+    """
+    scores = report_batch(key_file, window, scoring_backend, model_file, step)
+    if scores.empty:
+        return f"Not enough key press data in {key_file} for windows of {window}"
 
-def upload():
-    connections.refresh_access_token()
-    connections.create_cas_session()
-    connections.upload_key_press(KEY_FILE)
-    # KEY_FILE.unlink()
+    lines = []
+    for (id, start), (classification, prob) in scores.iterrows():
+        lines.append(f"{id}  {start:%Y-%m-%d %H:%M}  {classification}  {prob:.2%}")
+    return "\n".join(lines)
 
 
-def report():
-    from taptracker import processing
+def report_corpus(
+    sources: list[Path],
+    scoring_backend: str = "mas",
+    model_file: Path = LOCAL_MODEL_FILE,
+    max_workers: int | None = None,
+) -> str:
+    """Score every ID in many key files, calculating statistics in parallel
 
-    connections.refresh_access_token()
+    Args:
+    ----
+        sources: Key files, in any format, or directories of them
+        scoring_backend, model_file: As for report
+        max_workers: Processes to use, see parallel.corpus_features
+    """
+    from taptracker import parallel, scoring
 
-    if KEY_FILE.exists():
-        key_stats = processing.process(KEY_FILE)
-    else:
-        raise RuntimeError(f"No key press data found in {KEY_FILE}")
+    scorer = scoring.get_backend(scoring_backend, model_file)
+    scorer.connect()
 
-    classification, prob = connections.model_score_presses(
-        key_stats, "gb_predict_parkinsons"
-    )
+    files = parallel.key_files(sources)
+    missing = [f for f in files if not f.exists()]
+    if missing or not files:
+        raise RuntimeError(f"No key press data found in {(missing or sources)[0]}")
 
-    return (
-        f"Based on your typing patterns and this model, it is likely {classification}"
-        " that you are showing symptoms of Parkinson's disease. This is based on"
-        f" the estimated likelihood of {prob:.2%}."
+    rows = parallel.corpus_features(files, scorer.input_columns(), max_workers)
+    scores = scorer.score_rows(rows)
+    return "\n".join(
+        f"{id}  {classification}  {prob:.2%}"
+        for id, (classification, prob) in scores.iterrows()
     )
 
 
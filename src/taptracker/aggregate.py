@@ -0,0 +1,386 @@
+"""Incremental feature aggregation, so reports only read new key presses
+
+IncrementalAggregator keeps, per ID and hand/direction group, running moments
+and a mergeable quantile sketch of FlightTime and HoldTime. Its state is saved
+next to the key file with a checkpoint of how much of the file has been folded
+in, so each report only reads and aggregates keystrokes recorded since the
+last one.
+
+Tolerance against processing.keysprep:
+    mean, std, kurtosis, skew: exact up to floating point rounding (~1e-9
+        relative), moments are combined with the pairwise update formulas of
+        Pebay (2008) rather than recomputed.
+    percentiles: within SKETCH_ACCURACY (0.5%) relative error of
+        np.percentile, or SKETCH_MIN_VALUE (1 microsecond) absolute error for
+        percentiles that fall between values of opposite sign.
+"""
+import io
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import binary, storage
+from .features import COLUMNS, GROUPS, PERCENTILES, STATS, feature_name, prepare
+
+SKETCH_ACCURACY = 0.005
+SKETCH_MIN_VALUE = 1e-6
+STATE_VERSION = 1
+
+
+class RunningMoments:
+    """Count, mean and central moment sums up to 4th order, mergeable"""
+
+    __slots__ = ("n", "mean", "m2", "m3", "m4")
+
+    def __init__(self, n=0, mean=0.0, m2=0.0, m3=0.0, m4=0.0):
+        self.n, self.mean, self.m2, self.m3, self.m4 = n, mean, m2, m3, m4
+
+    @classmethod
+    def from_values(cls, x: np.ndarray) -> "RunningMoments":
+        if len(x) == 0:
+            return cls()
+        mean = x.mean()
+        d = x - mean
+        d2 = d * d
+        return cls(len(x), mean, d2.sum(), (d2 * d).sum(), (d2 * d2).sum())
+
+    def update(self, x: np.ndarray):
+        self.merge(RunningMoments.from_values(x))
+
+    def add(self, x: float):
+        """Fold in a single value, merge with n=1 simplified"""
+        n = self.n + 1
+        delta = x - self.mean
+        d_n = delta / n
+        term = delta * d_n * self.n
+        self.m4 += (
+            term * d_n * d_n * (n * n - 3 * n + 3)
+            + 6 * d_n * d_n * self.m2
+            - 4 * d_n * self.m3
+        )
+        self.m3 += term * d_n * (n - 2) - 3 * d_n * self.m2
+        self.m2 += term
+        self.mean += d_n
+        self.n = n
+
+    def merge(self, other: "RunningMoments"):
+        na, nb = self.n, other.n
+        if nb == 0:
+            return
+        if na == 0:
+            self.n, self.mean = other.n, other.mean
+            self.m2, self.m3, self.m4 = other.m2, other.m3, other.m4
+            return
+
+        n = na + nb
+        delta = other.mean - self.mean
+        d_n = delta / n
+        nab = na * nb
+
+        m2 = self.m2 + other.m2 + delta * d_n * nab
+        m3 = (
+            self.m3
+            + other.m3
+            + delta * d_n * d_n * nab * (na - nb)
+            + 3 * d_n * (na * other.m2 - nb * self.m2)
+        )
+        m4 = (
+            self.m4
+            + other.m4
+            + delta * d_n**3 * nab * (na * na - nab + nb * nb)
+            + 6 * d_n * d_n * (na * na * other.m2 + nb * nb * self.m2)
+            + 4 * d_n * (na * other.m3 - nb * self.m3)
+        )
+
+        self.n, self.mean = n, self.mean + d_n * nb
+        self.m2, self.m3, self.m4 = m2, m3, m4
+
+    def stats(self) -> tuple[float, float, float, float]:
+        """mean, std, kurtosis and skew as np.std, scipy's kurtosis and skew"""
+        if self.n == 0:
+            return (math.nan,) * 4
+        std = math.sqrt(self.m2 / self.n)
+        if self.m2 <= 0:
+            return self.mean, std, math.nan, math.nan
+        kurtosis = self.n * self.m4 / (self.m2 * self.m2) - 3
+        skew = math.sqrt(self.n) * self.m3 / self.m2**1.5
+        return self.mean, std, kurtosis, skew
+
+    def to_list(self) -> list:
+        return [self.n, self.mean, self.m2, self.m3, self.m4]
+
+
+class QuantileSketch:
+    """Relative error quantile sketch (DDSketch) with logarithmic buckets
+
+    A value x > 0 is counted in bucket ceil(log_gamma(x)), negative values
+    in a mirrored set of buckets and anything smaller in magnitude than
+    min_value in a zero bucket. Sketches merge by adding bucket counts.
+    """
+
+    def __init__(
+        self, accuracy: float = SKETCH_ACCURACY, min_value: float = SKETCH_MIN_VALUE
+    ):
+        self.accuracy = accuracy
+        self.min_value = min_value
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: dict[int, int] = {}
+        self.negative: dict[int, int] = {}
+        self.zero = 0
+
+    @property
+    def n(self) -> int:
+        return self.zero + sum(self.positive.values()) + sum(self.negative.values())
+
+    def _add(self, buckets: dict, x: np.ndarray):
+        indices = np.ceil(np.log(x) / self._log_gamma).astype(np.int64)
+        for index, count in zip(*np.unique(indices, return_counts=True)):
+            buckets[int(index)] = buckets.get(int(index), 0) + int(count)
+
+    def add(self, x: float):
+        """Count a single value"""
+        if abs(x) < self.min_value:
+            self.zero += 1
+            return
+        buckets = self.positive if x > 0 else self.negative
+        index = math.ceil(math.log(abs(x)) / self._log_gamma)
+        buckets[index] = buckets.get(index, 0) + 1
+
+    def update(self, x: np.ndarray):
+        small = np.abs(x) < self.min_value
+        self.zero += int(small.sum())
+        self._add(self.positive, x[~small & (x > 0)])
+        self._add(self.negative, -x[~small & (x < 0)])
+
+    def merge(self, other: "QuantileSketch"):
+        for mine, theirs in (
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ):
+            for index, count in theirs.items():
+                mine[index] = mine.get(index, 0) + count
+        self.zero += other.zero
+
+    def quantiles(self, qs) -> list[float]:
+        """Estimates of np.percentile(x, q) for each q in qs (0 - 100)"""
+        neg = sorted(self.negative.items(), reverse=True)
+        pos = sorted(self.positive.items())
+        scale = 2 / (self.gamma + 1)
+        values = np.array(
+            [-scale * self.gamma**i for i, _ in neg]
+            + [0.0]
+            + [scale * self.gamma**i for i, _ in pos]
+        )
+        counts = np.array([c for _, c in neg] + [self.zero] + [c for _, c in pos])
+        n = counts.sum()
+        if n == 0:
+            return [math.nan] * len(qs)
+
+        # Same linear interpolation between order statistics as np.percentile
+        cumulative = np.cumsum(counts)
+        ranks = np.asarray(qs, dtype=float) / 100 * (n - 1)
+        lower = values[np.searchsorted(cumulative, np.floor(ranks), side="right")]
+        upper = values[np.searchsorted(cumulative, np.ceil(ranks), side="right")]
+        return list(lower + (upper - lower) * (ranks - np.floor(ranks)))
+
+    def to_dict(self) -> dict:
+        return {
+            "positive": self.positive,
+            "negative": self.negative,
+            "zero": self.zero,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantileSketch":
+        sketch = cls()
+        sketch.positive = {int(i): c for i, c in data["positive"].items()}
+        sketch.negative = {int(i): c for i, c in data["negative"].items()}
+        sketch.zero = data["zero"]
+        return sketch
+
+
+def state_file(key_file: Path) -> Path:
+    """Where the aggregation state for a key file is stored"""
+    return key_file.with_name(f"{key_file.name}.agg.json")
+
+
+class IncrementalAggregator:
+    """Running hand/direction statistics for each ID in a key file
+
+    Args:
+    ----
+        key_file: CSV or binary key file the statistics are calculated from
+    """
+
+    def __init__(self, key_file: str | Path):
+        self.key_file = Path(key_file)
+        self.reset()
+
+    def reset(self):
+        # {id: {group: {column: (moments, sketch)}}}
+        self.groups: dict[str, dict[str, dict[str, tuple]]] = {}
+        # Bytes (CSV), records (binary) or rows (store) already aggregated
+        self.offset = 0
+        # Hand and release_ts of the last aggregated L/R keystroke
+        self.prev: tuple[str, float] | None = None
+
+    def _group(self, id: str, group: str, column: str) -> tuple:
+        columns = self.groups.setdefault(id, {}).setdefault(group, {})
+        if column not in columns:
+            columns[column] = (RunningMoments(), QuantileSketch())
+        return columns[column]
+
+    def load(self) -> "IncrementalAggregator":
+        """Restore saved state, if any and it is still valid for key_file"""
+        path = state_file(self.key_file)
+        if not path.exists():
+            return self
+
+        state = json.loads(path.read_text())
+        if state["version"] != STATE_VERSION or state["format"] != self._format:
+            return self
+
+        self.offset = state["offset"]
+        self.prev = tuple(state["prev"]) if state["prev"] else None
+        for id, groups in state["groups"].items():
+            for group, columns in groups.items():
+                for column, (moments, sketch) in columns.items():
+                    self.groups.setdefault(id, {}).setdefault(group, {})[column] = (
+                        RunningMoments(*moments),
+                        QuantileSketch.from_dict(sketch),
+                    )
+        return self
+
+    def save(self):
+        state = {
+            "version": STATE_VERSION,
+            "format": self._format,
+            "offset": self.offset,
+            "prev": self.prev,
+            "groups": {
+                id: {
+                    group: {
+                        column: [moments.to_list(), sketch.to_dict()]
+                        for column, (moments, sketch) in columns.items()
+                    }
+                    for group, columns in groups.items()
+                }
+                for id, groups in self.groups.items()
+            },
+        }
+        state_file(self.key_file).write_text(json.dumps(state))
+
+    @property
+    def _format(self) -> str:
+        if self.key_file.suffix == storage.SUFFIX:
+            return "store"
+        return "binary" if self.key_file.suffix == binary.SUFFIX else "csv"
+
+    def _read_new(self, until: int | None = None) -> pd.DataFrame:
+        """Read complete keystrokes added to key_file since offset, up to until"""
+        if self._format != "csv":
+            if self._format == "store":
+                # Row numbers survive compaction and retention, only new
+                # segments are read
+                uuid, records = storage.read_keystrokes(self.key_file, self.offset)
+                if until is not None:
+                    records = records[: max(until - self.offset, 0)]
+            else:
+                uuid, records = binary.read_keystrokes(self.key_file)
+                if len(records) < self.offset:
+                    self.reset()
+                records = records[self.offset : until]
+            self.offset += len(records)
+            return pd.DataFrame(
+                {
+                    "id": uuid,
+                    "hand": np.array(binary.HANDS, dtype=object)[records["hand"]],
+                    "press_ts": records["press_ts"],
+                    "release_ts": records["release_ts"],
+                    "hold_time": records["release_ts"] - records["press_ts"],
+                }
+            )
+
+        with self.key_file.open("rb") as f:
+            header = f.readline()
+            if self.key_file.stat().st_size < self.offset:
+                self.reset()
+            f.seek(max(self.offset, len(header)))
+            data = f.read(-1 if until is None else max(until - f.tell(), 0))
+
+        # Leave any partly written last line for next time
+        end = data.rfind(b"\n") + 1
+        self.offset = max(self.offset, len(header)) + end
+        names = header.decode().strip().split(",")
+        if end == 0:
+            return pd.DataFrame(columns=names)
+        return pd.read_csv(io.BytesIO(data[:end]), header=None, names=names)
+
+    def update(self, until: int | None = None) -> int:
+        """Fold keystrokes added to key_file since the last update into the stats
+
+        Args:
+        ----
+            until: Offset to stop at, in the units of offset, see
+                live.end_offset. By default the end of the file
+
+        Returns
+        -------
+            Number of new keystrokes read
+        """
+        df = self._read_new(until)
+        df = df[df["hand"] != "U"]
+        if len(df) == 0:
+            return 0
+
+        ids = df["id"].to_numpy()
+        columns, masks = prepare(
+            df["hand"].to_numpy(),
+            df["press_ts"].to_numpy(),
+            df["release_ts"].to_numpy(),
+            df["hold_time"].to_numpy(),
+            self.prev,
+        )
+        if self.prev is None:
+            ids = ids[1:]
+        self.prev = (df["hand"].iat[-1], float(df["release_ts"].iat[-1]))
+
+        for id in pd.unique(ids):
+            is_id = ids == id
+            for group in GROUPS:
+                mask = masks[group] & is_id
+                for column in COLUMNS:
+                    values = columns[column][mask]
+                    moments, sketch = self._group(id, group, column)
+                    moments.update(values)
+                    sketch.update(values)
+        return len(df)
+
+    def features(self) -> pd.DataFrame:
+        """Current statistics as a frame shaped like keysprep's, one row per ID"""
+        rows = []
+        for id, groups in self.groups.items():
+            row = {"id": id}
+            for group in GROUPS:
+                for column in COLUMNS:
+                    if column in groups.get(group, {}):
+                        moments, sketch = groups[group][column]
+                    else:
+                        moments, sketch = RunningMoments(), QuantileSketch()
+                    values = (*moments.stats(), *sketch.quantiles(PERCENTILES))
+                    for stat, value in zip(STATS, values):
+                        row[feature_name(group, column, stat)] = value
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+
+def aggregate(key_file: str | Path) -> pd.DataFrame:
+    """Update the saved statistics for key_file with new data and return them"""
+    aggregator = IncrementalAggregator(key_file).load()
+    aggregator.update()
+    aggregator.save()
+    return aggregator.features()
@@ -0,0 +1,290 @@
+"""Compact append-only binary format for key press data
+
+A file is a fixed 32 byte header followed by packed little-endian records, one
+per keystroke. The header holds the machine UUID once instead of on every row,
+and records hold the key as a small integer code and the hand as an enum:
+
+    header: magic b"TAPK", format version (u2), record size (u2), UUID (12s)
+    record: key code (u2), hand (u1), timestamp (f8, unix seconds),
+            press_ts (f8), release_ts (f8)
+
+hold_time is not stored, it is always release_ts - press_ts.
+"""
+import csv
+import struct
+import time
+from collections.abc import Iterable
+from datetime import datetime
+from itertools import starmap
+from pathlib import Path
+
+from .params import UUID
+
+SUFFIX = ".tap"
+MAGIC = b"TAPK"
+VERSION = 1
+
+HEADER = struct.Struct("<4sHH12s12x")
+RECORD = struct.Struct("<HBddd")
+
+# Columns of the key_presses.csv layout
+CSV_FIELDS = ("id", "timestamp", "press_ts", "release_ts", "key", "hand", "hold_time")
+
+# Hand enum, stored as index into this tuple
+HANDS = ("U", "L", "R")
+HAND_CODES = {hand: code for code, hand in enumerate(HANDS)}
+
+# Non character keys are given codes in the unicode private use area, so that
+# character keys can use their own code point. Append only, never reorder.
+NAMED_KEY_BASE = 0xE000
+NAMED_KEYS = (
+    "alt", "alt_l", "alt_r", "alt_gr", "backspace", "caps_lock", "cmd", "cmd_l",
+    "cmd_r", "ctrl", "ctrl_l", "ctrl_r", "delete", "down", "end", "enter", "esc",
+    "f1", "f2", "f3", "f4", "f5", "f6", "f7", "f8", "f9", "f10", "f11", "f12",
+    "f13", "f14", "f15", "f16", "f17", "f18", "f19", "f20", "home", "left",
+    "page_down", "page_up", "right", "shift", "shift_l", "shift_r", "space",
+    "tab", "up", "media_play_pause", "media_volume_mute", "media_volume_down",
+    "media_volume_up", "media_previous", "media_next", "insert", "menu",
+    "num_lock", "pause", "print_screen", "scroll_lock",
+)
+NAMED_KEY_CODES = {name: NAMED_KEY_BASE + i for i, name in enumerate(NAMED_KEYS)}
+
+
+def key_code(name: str) -> int:
+    """Integer code for a key name from get_name, 0 if unknown"""
+    if len(name) == 1 and ord(name) < NAMED_KEY_BASE:
+        return ord(name)
+    return NAMED_KEY_CODES.get(name, 0)
+
+
+def key_name(code: int) -> str:
+    """Inverse of key_code"""
+    if code >= NAMED_KEY_BASE:
+        index = code - NAMED_KEY_BASE
+        return NAMED_KEYS[index] if index < len(NAMED_KEYS) else ""
+    return chr(code) if code else ""
+
+
+def record_dtype():
+    """NumPy structured dtype matching RECORD, for zero copy reads"""
+    import numpy as np
+
+    return np.dtype(
+        [
+            ("key", "<u2"),
+            ("hand", "u1"),
+            ("timestamp", "<f8"),
+            ("press_ts", "<f8"),
+            ("release_ts", "<f8"),
+        ]
+    )
+
+
+def local_seconds(timestamp):
+    """Unix seconds as seconds since the epoch in local time
+
+    The same instants as the naive local datetimes written to key_presses.csv,
+    so hours and days split at the same points for both formats. Offsets are
+    looked up once per distinct hour, daylight saving changes on the hour.
+    """
+    import numpy as np
+
+    timestamp = np.asarray(timestamp, dtype=float)
+    hours, inverse = np.unique(timestamp // 3600, return_inverse=True)
+    offsets = np.array(
+        [
+            datetime.fromtimestamp(hour * 3600).astimezone().utcoffset().total_seconds()
+            for hour in hours
+        ]
+    )
+    return timestamp + offsets[inverse].reshape(timestamp.shape)
+
+
+def write_header(f, uuid: str = UUID):
+    f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, uuid.encode("ascii")))
+
+
+def read_header(f) -> str:
+    """Validate header of an open binary key file and return the UUID"""
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError("Binary key file is missing its header")
+
+    magic, version, record_size, uuid = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Not a taptracker binary key file")
+    if version != VERSION or record_size != RECORD.size:
+        raise ValueError(
+            f"Unsupported binary key file version {version}, record size {record_size}"
+        )
+    return uuid.decode("ascii")
+
+
+def pack_rows(rows: Iterable[tuple]) -> bytes:
+    """Pack (key, hand, timestamp, press_ts, release_ts) rows into records
+
+    timestamp may either be unix seconds or a datetime
+    """
+    out = bytearray()
+    for key, hand, timestamp, press_ts, release_ts in rows:
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        out += RECORD.pack(
+            key_code(key), HAND_CODES.get(hand, 0), timestamp, press_ts, release_ts
+        )
+    return bytes(out)
+
+
+def pack_records(rows: Iterable[tuple]) -> bytes:
+    """Pack (key code, hand code, timestamp, press_ts, release_ts) rows
+
+    As pack_rows, but for rows already holding key and hand codes with
+    timestamp in unix seconds, e.g. from keystroke_rows
+    """
+    return b"".join(starmap(RECORD.pack, rows))
+
+
+def clock_anchor() -> tuple[float, int]:
+    """Unix seconds now, and time.perf_counter_ns() read at the same moment
+
+    Keystrokes are only timed with perf_counter_ns, the anchor taken when a
+    batch is written dates every keystroke in it.
+    """
+    return time.time(), time.perf_counter_ns()
+
+
+def keystroke_rows(
+    info: list, anchor: tuple[float, int] | None = None
+) -> list[tuple[int, int, float, float, float]]:
+    """(key code, hand code, timestamp, press_ts, release_ts) of KeyInfo records
+
+    timestamp is unix seconds of the key press, from anchor, or a new
+    clock_anchor if None. press_ts and release_ts are perf_counter seconds.
+    """
+    wall, mono = anchor or clock_anchor()
+    return [
+        (
+            k.key,
+            k.hand,
+            wall + (k.press_ns - mono) / 1e9,
+            k.press_ns / 1e9,
+            k.release_ns / 1e9,
+        )
+        for k in info
+    ]
+
+
+def append_keystrokes(info: list, key_file: Path):
+    """Add KeyInfo records to a binary key file, creating it if needed"""
+    write_header_row = not key_file.exists()
+
+    with key_file.open("ab") as f:
+        if write_header_row:
+            write_header(f, info[0].id if info else UUID)
+        f.write(pack_records(keystroke_rows(info)))
+
+
+def read_keystrokes(key_file: str | Path):
+    """Memory map a binary key file
+
+    Returns
+    -------
+        Tuple of the file's UUID and a read-only structured array with
+        record_dtype(), backed directly by the file. A trailing partial record
+        from an interrupted write is ignored.
+    """
+    import numpy as np
+
+    key_file = Path(key_file)
+    with key_file.open("rb") as f:
+        uuid = read_header(f)
+
+    dtype = record_dtype()
+    count = (key_file.stat().st_size - HEADER.size) // dtype.itemsize
+    if count == 0:
+        return uuid, np.empty(0, dtype=dtype)
+
+    records = np.memmap(
+        key_file, dtype=dtype, mode="r", offset=HEADER.size, shape=(count,)
+    )
+    return uuid, records
+
+
+def convert_csv(csv_file: str | Path, key_file: str | Path, chunk_rows: int = 65536):
+    """Convert a key_presses.csv file to the binary format, streaming rows
+
+    Raises
+    ------
+        ValueError: If the CSV holds data for more than one ID, or key_file exists
+    """
+    csv_file, key_file = Path(csv_file), Path(key_file)
+    if key_file.exists():
+        raise ValueError(f"{key_file} already exists")
+
+    with csv_file.open("r", newline="") as src, key_file.open("wb") as dst:
+        reader = csv.DictReader(src)
+        uuid = None
+        chunk = []
+        for row in reader:
+            if uuid is None:
+                uuid = row["id"]
+                write_header(dst, uuid)
+            elif row["id"] != uuid:
+                raise ValueError(f"{csv_file} contains more than one id")
+
+            chunk.append(
+                (
+                    row["key"],
+                    row["hand"],
+                    datetime.fromisoformat(row["timestamp"]),
+                    float(row["press_ts"]),
+                    float(row["release_ts"]),
+                )
+            )
+            if len(chunk) >= chunk_rows:
+                dst.write(pack_rows(chunk))
+                chunk = []
+
+        if uuid is None:
+            write_header(dst)
+        dst.write(pack_rows(chunk))
+
+
+def export_csv(
+    key_file: str | Path,
+    csv_file: str | Path,
+    start: int = 0,
+    chunk_rows: int = 65536,
+):
+    """Write a binary key file out in the key_presses.csv layout
+
+    Args:
+    ----
+        key_file: Binary file to read
+        csv_file: CSV file to create
+        start: Number of records to skip
+        chunk_rows: Records to convert at a time
+    """
+    key_file, csv_file = Path(key_file), Path(csv_file)
+
+    with key_file.open("rb") as src, csv_file.open("w", newline="") as dst:
+        uuid = read_header(src)
+        src.seek(start * RECORD.size, 1)
+        writer = csv.writer(dst)
+        writer.writerow(CSV_FIELDS)
+        while data := src.read(RECORD.size * chunk_rows):
+            usable = len(data) - len(data) % RECORD.size
+            writer.writerows(
+                (
+                    uuid,
+                    str(datetime.fromtimestamp(timestamp)),
+                    press_ts,
+                    release_ts,
+                    key_name(key),
+                    HANDS[hand],
+                    release_ts - press_ts,
+                )
+                for key, hand, timestamp, press_ts, release_ts in RECORD.iter_unpack(
+                    data[:usable]
+                )
+            )
@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable
+
+from .params import BUFFER_CAPACITY, WRITER_BATCH_SIZE, WRITER_FLUSH_INTERVAL
+
+
+class RingBuffer:
+    """Preallocated single-producer/single-consumer ring of keystroke records.
+
+    The keyboard hook thread is the only producer and only ever advances
+    ``head``, the writer thread is the only consumer and only ever advances
+    ``tail``. Under the GIL each of those stores is atomic, so neither side
+    needs a lock and ``put`` never blocks the hook: when the ring is full the
+    record is counted in ``dropped`` and discarded.
+    """
+
+    def __init__(self, capacity: int = BUFFER_CAPACITY):
+        if capacity < 1:
+            raise ValueError("Ring buffer capacity must be at least 1")
+        self.capacity = capacity
+        self._slots: list = [None] * capacity
+        # Monotonic counts of records written/read, slot is count % capacity
+        self._head = 0
+        self._tail = 0
+        self.dropped = 0
+        self.high_water = 0
+
+    def __len__(self) -> int:
+        return self._head - self._tail
+
+    def put(self, record: object) -> bool:
+        """Store record in the next free slot, returns False if it was dropped"""
+        head = self._head
+        depth = head - self._tail
+        if depth >= self.capacity:
+            self.dropped += 1
+            return False
+
+        self._slots[head % self.capacity] = record
+        self._head = head + 1
+
+        if depth >= self.high_water:
+            self.high_water = depth + 1
+        return True
+
+    def drain(self, max_records: int | None = None) -> list:
+        """Remove and return up to max_records of the oldest records"""
+        tail = self._tail
+        count = self._head - tail
+        if max_records is not None:
+            count = min(count, max_records)
+
+        records = []
+        for i in range(tail, tail + count):
+            slot = i % self.capacity
+            records.append(self._slots[slot])
+            self._slots[slot] = None
+        self._tail = tail + count
+        return records
+
+
+class KeystrokeWriter(threading.Thread):
+    """Background thread that drains a RingBuffer to disk in batches
+
+    Args:
+    ----
+        buffer: Ring buffer filled by the keyboard hook
+        write: Callable taking a list of records, e.g. append_keystrokes
+        batch_size: Maximum records per write, and depth that triggers a write
+        flush_interval: Maximum seconds a record waits in the buffer
+    """
+
+    def __init__(
+        self,
+        buffer: RingBuffer,
+        write: Callable[[list], object],
+        batch_size: int = WRITER_BATCH_SIZE,
+        flush_interval: float = WRITER_FLUSH_INTERVAL,
+    ):
+        super().__init__(name="taptracker-writer", daemon=True)
+        self.buffer = buffer
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.batches = 0
+        self._stopping = threading.Event()
+        # Events of callers of sync, set once the buffer has been written
+        self._synced: queue.SimpleQueue = queue.SimpleQueue()
+
+    def run(self):
+        # Poll rather than have the hook signal us, so put() stays lock free
+        poll = min(self.flush_interval, 0.05)
+        last_flush = time.monotonic()
+
+        while not self._stopping.wait(poll):
+            now = time.monotonic()
+            waiting = self._take_synced()
+            if (
+                waiting
+                or len(self.buffer) >= self.batch_size
+                or now - last_flush >= self.flush_interval
+            ):
+                self.flush()
+                last_flush = now
+            for done in waiting:
+                done.set()
+
+        waiting = self._take_synced()
+        self.flush()
+        for done in waiting:
+            done.set()
+
+    def _take_synced(self) -> list[threading.Event]:
+        waiting = []
+        while not self._synced.empty():
+            waiting.append(self._synced.get())
+        return waiting
+
+    def sync(self, timeout: float | None = None) -> bool:
+        """Have the writer thread write everything in the buffer now
+
+        flush may only be called from the writer thread, as the buffer has a
+        single consumer, this is for any other thread. Returns whether the
+        write finished within timeout seconds
+        """
+        done = threading.Event()
+        self._synced.put(done)
+        if not self.is_alive():
+            return False
+        return done.wait(timeout)
+
+    def flush(self):
+        """Write everything currently in the buffer, from the writer thread"""
+        while len(self.buffer):
+            batch = self.buffer.drain(self.batch_size)
+            self.write(batch)
+            self.written += len(batch)
+            self.batches += 1
+
+    def stop(self, timeout: float | None = None):
+        """Stop the thread after a final flush of the buffer"""
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "batches": self.batches,
+            "depth": len(self.buffer),
+            "dropped": self.buffer.dropped,
+            "high_water": self.buffer.high_water,
+            "capacity": self.buffer.capacity,
+        }
+
+
+class EventRate:
+    """Count of events from one thread, and their recent rate
+
+    The counting thread only increments count. Each call to rate, from any
+    thread, records a sample, and the rate is measured from the oldest sample
+    still within window seconds, or since counting began for the first call.
+    """
+
+    def __init__(self, window: float = 60.0):
+        self.window = window
+        self.count = 0
+        self.started = time.monotonic()
+        self._samples = deque([(self.started, 0)])
+        self._lock = threading.Lock()
+
+    def add(self):
+        self.count += 1
+
+    def rate(self) -> float:
+        """Events per second over about the last window seconds"""
+        with self._lock:
+            now, count = time.monotonic(), self.count
+            samples = self._samples
+            samples.append((now, count))
+            while len(samples) > 2 and now - samples[1][0] >= self.window:
+                samples.popleft()
+            then, before = samples[0]
+        return (count - before) / (now - then) if now > then else 0.0
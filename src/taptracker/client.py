@@ -0,0 +1,161 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .params import HTTP_BACKOFF, HTTP_POOL_SIZE, HTTP_RETRIES, HTTP_TIMEOUT
+
+# Methods that are safe to send again if the first attempt fails
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LatencyStats:
+    """Running count, total, min and max of request durations in seconds"""
+
+    __slots__ = ("count", "errors", "total", "min", "max")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def add(self, seconds: float, error: bool = False):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+        }
+
+
+class ViyaClient:
+    """Shared keep-alive HTTP session for all Viya and CAS calls
+
+    Connections to each host are pooled and reused, so only the first call to
+    a server pays for the TCP and TLS handshakes. Idempotent calls that fail to
+    connect, time out or get a retryable status are retried with exponential
+    backoff.
+
+    Args:
+    ----
+        pool_size: Maximum connections kept open to each host
+        timeout: Seconds, or (connect, read) seconds, before a call fails
+        retries: Extra attempts for idempotent calls
+        backoff: Seconds before the first retry, doubled for each after
+        verify: Whether to verify TLS certificates
+    """
+
+    def __init__(
+        self,
+        pool_size: int = HTTP_POOL_SIZE,
+        timeout: float | tuple[float, float] = HTTP_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        verify: bool = False,
+    ):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._latency: dict[str, LatencyStats] = {}
+        self._lock = threading.Lock()
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        endpoint: str | None = None,
+        idempotent: bool | None = None,
+        **kwargs,
+    ) -> requests.Response:
+        """Send a request through the pooled session
+
+        Args:
+        ----
+            method, url, kwargs: As for requests.Session.request
+            endpoint: Name to record latency under, defaults to method and url
+            idempotent: Whether the call may be retried, defaults to True for
+                IDEMPOTENT_METHODS. Set True for POSTs that only read.
+        """
+        method = method.upper()
+        endpoint = endpoint or f"{method} {url}"
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        attempts = 1 + (self.retries if idempotent else 0)
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(attempts):
+            if attempt:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            # Streamed bodies, e.g. connections.FileSlice, are sent from the start
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)
+
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._record(endpoint, time.perf_counter() - start, error=True)
+                if attempt == attempts - 1:
+                    raise
+                continue
+
+            retry = response.status_code in RETRY_STATUSES
+            self._record(endpoint, time.perf_counter() - start, error=retry)
+            if not retry or attempt == attempts - 1:
+                return response
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def _record(self, endpoint: str, seconds: float, error: bool = False):
+        with self._lock:
+            if endpoint not in self._latency:
+                self._latency[endpoint] = LatencyStats()
+            self._latency[endpoint].add(seconds, error)
+
+    def latency_stats(self) -> dict[str, dict]:
+        """Latency of every attempt so far, by endpoint"""
+        with self._lock:
+            return {name: s.to_dict() for name, s in self._latency.items()}
+
+    def close(self):
+        self.session.close()
+
+
+_client: ViyaClient | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ViyaClient:
+    """The process wide ViyaClient, created on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ViyaClient()
+        return _client
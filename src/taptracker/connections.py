@@ -1,26 +1,87 @@
 import base64
+import io
 import json
 import os
+import tempfile
+import threading
+import time
+import uuid
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urljoin
 
 import requests
 
+from . import binary, metrics, storage
+from .client import get_client
 from .params import (
     BASE_URL,
     CAS_SERVER,
+    CAS_SESSION_TTL,
     CLIENT_ID,
     CLIENT_SECRET,
+    CREDENTIALS_FILE,
+    HTTP_POOL_SIZE,
     KEY_FILE,
     REFRESH_TOKEN_FILE,
+    SCHEMA_CACHE_FILE,
+    SCHEMA_CACHE_VERSION,
+    SCHEMA_TTL,
+    TOKEN_MIN_REMAINING,
+    TOKEN_REFRESH_AHEAD,
+    UPLOAD_CHUNK_BYTES,
+    UPLOAD_STATE_FILE,
 )
 
 warnings.simplefilter(
     "ignore", category=requests.packages.urllib3.exceptions.InsecureRequestWarning
 )
 
+_refresh_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_credentials_lock = threading.Lock()
+_watermark_lock = threading.Lock()
 
+
+def write_atomic(path: Path, text: str):
+    """Replace path with text in one step, so readers never see half of it
+
+    The text is written to a temporary file in the same directory, created
+    readable only by this user, which then replaces path
+    """
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(temp, path)
+    except BaseException:
+        Path(temp).unlink(missing_ok=True)
+        raise
+
+
+def load_credentials() -> dict:
+    """Cached access token and CAS session from previous runs, if any"""
+    try:
+        return json.loads(CREDENTIALS_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_credentials(**updates):
+    """Update the cached credentials, atomically and readable only by this user
+
+    The background token refresh saves too, so updates are made under a lock,
+    and the file is replaced in one step so load_credentials never sees half
+    of it
+    """
+    with _credentials_lock:
+        credentials = load_credentials()
+        credentials.update(updates)
+        write_atomic(CREDENTIALS_FILE, json.dumps(credentials))
+
+
+@metrics.timed()
 def refresh_access_token():
     base64_message = base64.b64encode(
         f"{CLIENT_ID}:{CLIENT_SECRET}".encode("ascii")
@@ -34,9 +95,38 @@ def refresh_access_token():
     }
     url = f"{BASE_URL}/SASLogon/oauth/token#refresh_token"
 
-    response = requests.post(url, headers=headers, data=payload, verify=False)
+    with _refresh_lock:
+        response = get_client().post(
+            url, endpoint="SASLogon.token", headers=headers, data=payload
+        )
+        token = json.loads(response.text)
+
+        os.environ["VIYA_ACCESS_TOKEN"] = token["access_token"]
+        save_credentials(
+            access_token=token["access_token"],
+            expires_at=time.time() + token.get("expires_in", 0),
+        )
+
+
+@metrics.timed()
+def ensure_access_token():
+    """Reuse the cached access token if it is still valid, else refresh it
+
+    A token with less than TOKEN_REFRESH_AHEAD seconds left is still used, but
+    a new one is fetched in the background for the next call. Only tokens
+    with less than TOKEN_MIN_REMAINING seconds left are refreshed before
+    returning.
+    """
+    credentials = load_credentials()
+    remaining = credentials.get("expires_at", 0) - time.time()
 
-    os.environ["VIYA_ACCESS_TOKEN"] = json.loads(response.text)["access_token"]
+    if remaining < TOKEN_MIN_REMAINING:
+        refresh_access_token()
+        return
+
+    os.environ["VIYA_ACCESS_TOKEN"] = credentials["access_token"]
+    if remaining < TOKEN_REFRESH_AHEAD and not _refresh_lock.locked():
+        threading.Thread(target=refresh_access_token, daemon=True).start()
 
 
 def get_access_token() -> str:
@@ -48,132 +138,531 @@ def get_refresh_token() -> str:
         return f.read()
 
 
+@metrics.timed()
+def viya_request(
+    method: str, url: str, endpoint: str, headers: dict | None = None, **kwargs
+) -> requests.Response:
+    """Send a request with the access token, refreshing it once if rejected"""
+    headers = dict(headers or {})
+    for retry in (False, True):
+        headers["Authorization"] = f"Bearer {get_access_token()}"
+        response = get_client().request(
+            method, url, endpoint=endpoint, headers=headers, **kwargs
+        )
+        if response.status_code != 401 or retry:
+            return response
+        refresh_access_token()
+
+
+@metrics.timed()
 def create_cas_session():
-    session_id = requests.put(
-        urljoin(CAS_SERVER, "cas/sessions"),
-        headers={
-            "Authorization": f"Bearer {get_access_token()}",
-        },
-        verify=False,
+    session_id = viya_request(
+        "PUT", urljoin(CAS_SERVER, "cas/sessions"), "cas.sessions", idempotent=False
     ).json()["session"]
 
     os.environ["VIYA_CAS_SESSION_ID"] = session_id
+    save_credentials(cas_session=session_id, cas_session_used=time.time())
+
+
+@metrics.timed()
+def ensure_cas_session():
+    """Reuse the cached CAS session if used in the last CAS_SESSION_TTL seconds
+
+    If CAS has already ended it, cas_action starts a new session on demand.
+    """
+    credentials = load_credentials()
+    if time.time() - credentials.get("cas_session_used", 0) > CAS_SESSION_TTL:
+        create_cas_session()
+        return
+
+    os.environ["VIYA_CAS_SESSION_ID"] = credentials["cas_session"]
+    save_credentials(cas_session_used=time.time())
 
 
 def get_session_id() -> str:
     return os.environ["VIYA_CAS_SESSION_ID"]
 
 
-def upload_data(caslib: str, table: str, file: str | Path) -> requests.Response:
-    file = Path(file)
+@metrics.timed()
+def cas_action(action: str, method: str = "POST", **kwargs) -> requests.Response:
+    """Run a CAS action in the current session, starting a new one if it has gone"""
+    for retry in (False, True):
+        response = viya_request(
+            method,
+            urljoin(CAS_SERVER, f"cas/sessions/{get_session_id()}/actions/{action}"),
+            f"cas.{action}",
+            **kwargs,
+        )
+        if response.status_code != 404 or retry:
+            return response
+        create_cas_session()
+
+
+class FileSlice:
+    """Read only file like view of an optional header then bytes [start, end)
+
+    Lets requests stream part of a file as a request body with a known
+    Content-Length, without reading it all into memory. Counts the lines read
+    after the header, and can be rewound with seek(0) to be sent again.
+    """
+
+    def __init__(
+        self, path: str | Path, start: int = 0, end: int | None = None, header=b""
+    ):
+        self.path = Path(path)
+        self.start = start
+        self.end = self.path.stat().st_size if end is None else end
+        self.header = header
+        self._f = None
+        self.seek(0)
+
+    def __len__(self) -> int:
+        return len(self.header) + self.end - self.start
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("FileSlice can only be rewound")
+        self.close()
+        self._header_left = self.header
+        self._pos = self.start
+        self.lines = 0
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._header_left:
+            if size < 0:
+                size = len(self)
+            data, self._header_left = (
+                self._header_left[:size],
+                self._header_left[size:],
+            )
+            return data
+
+        remaining = self.end - self._pos
+        if size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            self.close()
+            return b""
+
+        if self._f is None:
+            self._f = self.path.open("rb")
+            self._f.seek(self._pos)
+        data = self._f.read(size)
+        self._pos += len(data)
+        self.lines += data.count(b"\n")
+        return data
+
+    def close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+@metrics.timed()
+def upload_data(
+    caslib: str, table: str, file: str | Path | FileSlice
+) -> requests.Response:
+    """Stream a file, or part of one, into a new promoted CAS table"""
+    if not isinstance(file, FileSlice):
+        file = FileSlice(file)
     json_params_str = json.dumps(
         {
             "casOut": {"caslib": caslib, "name": table, "promote": "true"},
-            "importOptions": {"fileType": file.suffix[1:].upper()},
+            "importOptions": {"fileType": file.path.suffix[1:].upper()},
         }
     )
 
-    with file.open("rb") as f:
-        data = f.read()
-
-    return requests.put(
-        urljoin(CAS_SERVER, f"cas/sessions/{get_session_id()}/actions/upload"),
-        data=data,
+    # Not retried: a retry after a timeout that did create the table would
+    # fail with "table exists"
+    return cas_action(
+        "upload",
+        method="PUT",
+        idempotent=False,
+        data=file,
         headers={
-            "Authorization": f"Bearer {get_access_token()}",
             "Content-Type": "binary/octet-stream",
             "JSON-Parameters": json_params_str,
         },
-        verify=False,
     )
 
 
+@metrics.timed()
 def cas_table_exists(caslib: str, table: str) -> bool:
-    result = requests.post(
-        urljoin(
-            CAS_SERVER, f"cas/sessions/{get_session_id()}/actions/table.tableExists"
-        ),
-        headers={
-            "Authorization": f"Bearer {get_access_token()}",
-            "Content-Type": "application/json",
-        },
+    result = cas_action(
+        "table.tableExists",
+        idempotent=True,
+        headers={"Content-Type": "application/json"},
         json={"caslib": caslib, "name": table},
-        verify=False,
     )
 
     return int(result.json()["results"]["exists"])
 
 
+@metrics.timed()
 def append_cas_table(caslib: str, base: str, data: str) -> requests.Response:
-    result = requests.post(
-        urljoin(
-            CAS_SERVER, f"cas/sessions/{get_session_id()}/actions/dataStep.runCode"
-        ),
-        headers={
-            "Authorization": f"Bearer {get_access_token()}",
-            "Content-Type": "application/json",
-        },
+    result = cas_action(
+        "dataStep.runCode",
+        headers={"Content-Type": "application/json"},
         json={"code": f"data {caslib}.{base}(append=force) ; set {caslib}.{data};run;"},
-        verify=False,
     )
 
     return result
 
 
+@metrics.timed()
 def delete_cas_table(caslib: str, table: str) -> requests.Response:
-    result = requests.post(
-        urljoin(CAS_SERVER, f"cas/sessions/{get_session_id()}/actions/table.dropTable"),
-        headers={
-            "Authorization": f"Bearer {get_access_token()}",
-            "Content-Type": "application/json",
-        },
+    result = cas_action(
+        "table.dropTable",
+        idempotent=True,
+        headers={"Content-Type": "application/json"},
         json={"caslib": caslib, "name": table},
-        verify=False,
     )
 
     return result
 
 
+def raise_for_cas(response: requests.Response) -> requests.Response:
+    """Raise if a CAS call failed, either over HTTP or as an action error"""
+    response.raise_for_status()
+    disposition = response.json().get("disposition", {})
+    if disposition.get("severity") == "Error":
+        raise RuntimeError(f"CAS action failed: {disposition.get('formattedStatus')}")
+    return response
+
+
+@metrics.timed()
+def run_casl(code: str) -> requests.Response:
+    """Run a CASL program, so several actions cost a single round trip"""
+    return cas_action(
+        "sccasl.runCasl",
+        headers={"Content-Type": "application/json"},
+        json={"code": code},
+    )
+
+
+def append_and_drop_casl(caslib: str, base: str, data: str) -> str:
+    """CASL that appends table data to base, creating base if needed, then drops data"""
+    return (
+        f'table.tableExists result=r / caslib="{caslib}" name="{base}";\n'
+        "if r.exists then do;\n"
+        f'  dataStep.runCode / code="data {caslib}.{base}(append=force); '
+        f'set {caslib}.{data}; run;";\n'
+        "end;\n"
+        "else do;\n"
+        f'  dataStep.runCode / code="data {caslib}.{base}(promote=yes); '
+        f'set {caslib}.{data}; run;";\n'
+        "end;\n"
+        f'table.dropTable / caslib="{caslib}" name="{data}" quiet=true;\n'
+    )
+
+
+@metrics.timed()
+def append_key_press_data(
+    caslib: str, table: str, file: str | Path | FileSlice
+) -> requests.Response:
+    """Add the rows of a CSV file to table, creating it if needed
+
+    Takes two CAS calls: an upload to a uniquely named temporary table, then
+    one CASL program that appends it to table and drops it. The temporary
+    table is dropped if either fails, even part way through the upload.
+    """
+    temp_table = f"{table}_{uuid.uuid4().hex[:12]}"
+    try:
+        raise_for_cas(upload_data(caslib, temp_table, file))
+        return raise_for_cas(
+            run_casl(append_and_drop_casl(caslib, table, temp_table))
+        )
+    except Exception:
+        # Failing to clean up, e.g. in the same outage, must not hide why
+        try:
+            delete_cas_table(caslib, temp_table)
+        except Exception as e:
+            warnings.warn(f"Could not drop temporary table {temp_table}: {e}")
+        raise
+
+
+def load_watermark(key_file: Path) -> dict:
+    """How much of key_file has been uploaded, as offset and rows
+
+    offset is in bytes for CSV files and records for binary files
+    """
+    try:
+        state = json.loads(UPLOAD_STATE_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    return state.get(str(key_file.resolve()), {"offset": 0, "rows": 0})
+
+
+def save_watermark(key_file: Path, offset: int, rows: int):
+    """Record how much of key_file has been uploaded, see load_watermark
+
+    A torn state file would read as nothing uploaded, and the next run would
+    upload the whole key file again, so it is replaced atomically
+    """
+    with _watermark_lock:
+        try:
+            state = json.loads(UPLOAD_STATE_FILE.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        state[str(key_file.resolve())] = {"offset": offset, "rows": rows}
+        write_atomic(UPLOAD_STATE_FILE, json.dumps(state))
+
+
+def line_end(f, start: int, limit: int) -> int:
+    """Offset just after the first complete line ending at or after limit
+
+    If the file ends with a partly written line, stop before it instead
+    """
+    f.seek(limit)
+    line = f.readline()
+    if line.endswith(b"\n"):
+        return limit + len(line)
+
+    pos = limit
+    while pos > start:
+        block_start = max(start, pos - 65536)
+        f.seek(block_start)
+        block = f.read(pos - block_start)
+        newline = block.rfind(b"\n")
+        if newline >= 0:
+            return block_start + newline + 1
+        pos = block_start
+    return start
+
+
+@metrics.timed()
+def upload_csv_chunks(
+    csv_file: Path,
+    caslib: str,
+    table: str,
+    start: int = 0,
+    chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+):
+    """Append the rows of csv_file after byte offset start to table in chunks
+
+    Each chunk is about chunk_bytes of whole lines sent with the header line,
+    streamed from disk so memory use does not depend on the file size.
+
+    Yields
+    ------
+        Byte offset and number of rows appended after each chunk
+    """
+    size = csv_file.stat().st_size
+    with csv_file.open("rb") as f:
+        header = f.readline()
+        start = max(start, len(header))
+
+        while start < size:
+            end = line_end(f, start, min(start + chunk_bytes, size))
+            if end <= start:
+                return
+            chunk = FileSlice(csv_file, start, end, header)
+            append_key_press_data(caslib, table, chunk)
+            yield end, chunk.lines
+            start = end
+
+
+@metrics.profiled("network")
+@metrics.timed()
 def upload_key_press(
-    key_press_file: str = KEY_FILE, caslib: str = "Public", table: str = "taptracker"
+    key_press_file: str | Path = KEY_FILE,
+    caslib: str = "Public",
+    table: str = "taptracker",
+    chunk_bytes: int = UPLOAD_CHUNK_BYTES,
 ):
-    if cas_table_exists(caslib, table):
-        i = 0
-        while cas_table_exists(caslib, f"{table}_i"):
-            i += 1
-        temp_table = f"{table}_i"
-        upload_data(caslib, temp_table, key_press_file)
-        append_cas_table(caslib, table, temp_table)
-        delete_cas_table(caslib, temp_table)
+    """Upload key presses added since the last upload, in bounded chunks
+
+    A watermark is saved after each chunk is appended, so an upload that fails
+    part way resumes from the last complete chunk next time.
+    """
+    key_press_file = Path(key_press_file)
+    if key_press_file.suffix == storage.SUFFIX:
+        upload_key_store(key_press_file, caslib, table, chunk_bytes)
+        return
+
+    watermark = load_watermark(key_press_file)
+    offset, rows = watermark["offset"], watermark["rows"]
+
+    if key_press_file.suffix == binary.SUFFIX:
+        _, records = binary.read_keystrokes(key_press_file)
+        if len(records) < offset:
+            offset, rows = 0, 0
+        # CAS only understands the CSV layout
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_file = Path(tmp) / KEY_FILE.name
+            binary.export_csv(key_press_file, csv_file, start=offset)
+            for _, chunk_rows in upload_csv_chunks(
+                csv_file, caslib, table, chunk_bytes=chunk_bytes
+            ):
+                offset, rows = offset + chunk_rows, rows + chunk_rows
+                save_watermark(key_press_file, offset, rows)
     else:
-        upload_data(caslib, table, key_press_file)
+        if key_press_file.stat().st_size < offset:
+            offset, rows = 0, 0
+        for offset, chunk_rows in upload_csv_chunks(
+            key_press_file, caslib, table, offset, chunk_bytes
+        ):
+            rows += chunk_rows
+            save_watermark(key_press_file, offset, rows)
+
+
+@metrics.profiled("network")
+@metrics.timed()
+def upload_key_store(
+    store_dir: str | Path,
+    caslib: str = "Public",
+    table: str = "taptracker",
+    chunk_bytes: int = UPLOAD_CHUNK_BYTES,
+):
+    """Upload the rows of a partitioned store after its uploaded watermark
+
+    Only segments holding rows that have not been uploaded are read. The
+    watermark in the store's index is moved on after each chunk.
+    """
+    store = storage.get_store(store_dir)
+    missing = 0
+    while True:
+        index = store.load_index()
+        pending = store.segments(index, from_row=index["uploaded_rows"])
+        if not pending:
+            return
+        name, entry = pending[0]
+        start = max(index["uploaded_rows"] - entry["first_row"], 0)
+        uploaded = entry["first_row"] + start
+
+        with tempfile.TemporaryDirectory() as tmp:
+            csv_file = Path(tmp) / KEY_FILE.name
+            try:
+                binary.export_csv(store.root / name, csv_file, start=start)
+            except FileNotFoundError:
+                # Compacted since the index was read, read it again
+                missing += 1
+                if missing == 3:
+                    raise
+                continue
+            missing = 0
+            for _, chunk_rows in upload_csv_chunks(
+                csv_file, caslib, table, chunk_bytes=chunk_bytes
+            ):
+                uploaded += chunk_rows
+                store.mark_uploaded(uploaded)
+        # Segments are immutable, so every row has been sent, even if none were
+        store.mark_uploaded(entry["first_row"] + entry["rows"])
+
+
+def load_schema_cache() -> dict:
+    try:
+        cache = json.loads(SCHEMA_CACHE_FILE.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache if cache.get("version") == SCHEMA_CACHE_VERSION else {}
+
+
+@metrics.timed()
+def fetch_model_inputs(model_id: str = "gb_predict_parkinsons") -> list[str]:
+    """Get the model's input columns from MAS, revalidating any cached copy
+
+    A cached ETag is sent as If-None-Match, so an unchanged schema costs a
+    304 with no body. The result is saved to SCHEMA_CACHE_FILE.
+    """
+    cached = load_schema_cache().get("models", {}).get(model_id)
+    url = f"{BASE_URL}/microanalyticScore/modules/{model_id}/steps"
+    headers = {"Accept": "application/vnd.sas.collection+json"}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
 
+    response = viya_request("GET", url, "microanalyticScore.steps", headers=headers)
+    if response.status_code == 304 and cached:
+        columns, etag = cached["columns"], cached["etag"]
+    else:
+        response.raise_for_status()
+        columns = [e["name"] for e in response.json()["items"][-1]["inputs"]]
+        etag = response.headers.get("ETag")
+
+    with _schema_lock:
+        cache = load_schema_cache()
+        cache["version"] = SCHEMA_CACHE_VERSION
+        cache.setdefault("models", {})[model_id] = {
+            "columns": columns,
+            "etag": etag,
+            "fetched_at": time.time(),
+        }
+        write_atomic(SCHEMA_CACHE_FILE, json.dumps(cache))
+    return columns
 
-def model_get_inputs(model_id: str = "gb_predict_parkinsons"):
-    url = f"{BASE_URL}/microanalyticScore/modules/{model_id}/steps"
-    headers = {
-        "Accept": "application/vnd.sas.collection+json",
-        "Authorization": f"Bearer {get_access_token()}",
-    }
-    response = requests.get(url, headers=headers, verify=False).json()
 
-    return [e["name"] for e in response["items"][-1]["inputs"]]
+@metrics.profiled("network")
+@metrics.timed()
+def model_get_inputs(model_id: str = "gb_predict_parkinsons") -> list[str]:
+    """The model's input columns, from the local cache where possible
+
+    Only the first call for a model waits on MAS. Afterwards the cached
+    columns are returned straight away, and once older than SCHEMA_TTL they
+    are revalidated in the background for the next call.
+    """
+    cached = load_schema_cache().get("models", {}).get(model_id)
+    if cached is None:
+        return fetch_model_inputs(model_id)
 
+    if time.time() - cached["fetched_at"] > SCHEMA_TTL and not _schema_lock.locked():
+        threading.Thread(
+            target=fetch_model_inputs, args=(model_id,), daemon=True
+        ).start()
+    return cached["columns"]
 
+
+@metrics.profiled("network")
+@metrics.timed()
 def model_score_presses(
     payload_dict: dict, model_id: str = "gb_predict_parkinsons"
 ) -> requests.Response:
     url = f"{BASE_URL}/microanalyticScore/modules/{model_id}/steps/score"
     headers = {
-        "Authorization": "Bearer " + get_access_token(),
         "Content-Type": "application/vnd.sas.microanalytic.module.step.input+json",
     }
 
-    result = requests.post(
-        url, data=json.dumps(payload_dict), headers=headers, verify=False
+    result = viya_request(
+        "POST",
+        url,
+        "microanalyticScore.score",
+        idempotent=True,
+        data=json.dumps(payload_dict),
+        headers=headers,
     ).json()
 
     classification = result["outputs"][0]["value"]
     probability = result["outputs"][1]["value"]
 
     return classification, probability
+
+
+@metrics.timed()
+def model_score_many(
+    payloads: list[dict],
+    model_id: str = "gb_predict_parkinsons",
+    max_workers: int = 4,
+) -> list[tuple]:
+    """Score many payloads concurrently over the pooled session
+
+    MAS scores one set of inputs per request, so throughput comes from keeping
+    up to max_workers requests in flight on the shared connection pool.
+
+    Returns
+    -------
+        (classification, probability) for each payload, in order
+    """
+    if not payloads:
+        return []
+    workers = max(1, min(max_workers, len(payloads), HTTP_POOL_SIZE))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda payload: model_score_presses(payload, model_id), payloads
+            )
+        )
+
+
+def latency_stats() -> dict[str, dict]:
+    """Per endpoint latency of every Viya/CAS call made by this process"""
+    return get_client().latency_stats()
@@ -0,0 +1,260 @@
+"""Control API of the running tracker, over a local socket
+
+The process tracking keystrokes serves requests on CONTROL_SOCKET, a Unix
+socket, or on 127.0.0.1:CONTROL_PORT where Unix sockets are not available.
+Each request and each reply is one line of JSON:
+
+    {"command": "status"}
+    {"ok": true, "tracking": true, "keystrokes": 1520, ...}
+    {"ok": false, "error": "Unknown command stats, choose from ..."}
+
+The commands are those the tracker registers, see _taptracker.COMMANDS, plus
+"shutdown", which replies before the server stops. A tracker answering here
+is what marks it as running, so a crash leaves nothing behind that blocks the
+next start: a socket file that nobody answers on is removed before binding.
+
+Every request also carries "token", a random value the server writes to
+CONTROL_TOKEN_FILE, readable only by its user, when it binds. Other users'
+processes, and web pages posting to the TCP port, cannot read it, so they
+cannot stop tracking. A request without it, or a line that is not JSON, gets
+an error and the connection is closed.
+"""
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections.abc import Callable
+from pathlib import Path
+
+from .params import (
+    CONTROL_PORT,
+    CONTROL_SOCKET,
+    CONTROL_TIMEOUT,
+    CONTROL_TOKEN_FILE,
+)
+
+# Longest Unix socket path that binds on every platform that has them
+MAX_SOCKET_PATH = 100
+
+
+class NotRunning(ConnectionError):
+    """Raised by request when no tracker is answering"""
+
+
+def address() -> str | tuple[str, int]:
+    """Unix socket path of the control API, or (host, port) where there are none"""
+    path = str(CONTROL_SOCKET)
+    if hasattr(socket, "AF_UNIX") and len(os.fsencode(path)) <= MAX_SOCKET_PATH:
+        return path
+    return ("127.0.0.1", CONTROL_PORT)
+
+
+def read_token() -> str:
+    """Token of the running tracker
+
+    Raises
+    ------
+        NotRunning: If no tracker has written one
+    """
+    try:
+        return CONTROL_TOKEN_FILE.read_text().strip()
+    except FileNotFoundError as e:
+        raise NotRunning("Taptracker is not running") from e
+
+
+def write_token() -> str:
+    """Write a new random token, readable only by this user, and return it"""
+    # Imported here, as with hmac it loads OpenSSL, which clients never need
+    import secrets
+
+    token = secrets.token_hex(32)
+    CONTROL_TOKEN_FILE.unlink(missing_ok=True)
+    # Created with its final mode, so it is never readable by others
+    fd = os.open(CONTROL_TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+def request(command: str, timeout: float = CONTROL_TIMEOUT, **args) -> dict:
+    """Send a command to the running tracker and return its reply
+
+    Args:
+    ----
+        command: Name of the command
+        timeout: Seconds to wait for the tracker to answer
+        args: Any other fields of the request
+
+    Raises
+    ------
+        NotRunning: If no tracker is answering, e.g. the socket is stale, the
+            connection was reset or the tracker did not answer within timeout
+        RuntimeError: If the tracker could not carry out the command
+    """
+    message = {"command": command, **args, "token": read_token()}
+    addr = address()
+    family = socket.AF_INET if isinstance(addr, tuple) else socket.AF_UNIX
+    try:
+        with socket.socket(family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(addr)
+            sock.sendall(json.dumps(message).encode() + b"\n")
+            with sock.makefile("rb") as f:
+                line = f.readline()
+    except (FileNotFoundError, ConnectionError) as e:
+        raise NotRunning("Taptracker is not running") from e
+    except TimeoutError as e:
+        raise NotRunning(f"Taptracker did not answer within {timeout}s") from e
+    if not line:
+        raise NotRunning("Taptracker closed the connection")
+
+    reply = json.loads(line)
+    if not reply.pop("ok"):
+        raise RuntimeError(reply["error"])
+    return reply
+
+
+def running() -> bool:
+    """Whether a tracker is answering on the control API"""
+    try:
+        request("status")
+    except NotRunning:
+        return False
+    except RuntimeError:
+        # Answered, but with a token other than the one in the file
+        pass
+    return True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        control = self.server.control
+        for line in self.rfile:
+            reply, close = control.dispatch(line)
+            self.wfile.write(json.dumps(reply).encode() + b"\n")
+            self.wfile.flush()
+            if close == "shutdown":
+                control.stop()
+            if close:
+                return
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    # Windows would let a second tracker bind the same port
+    allow_reuse_address = os.name != "nt"
+
+
+class ControlServer:
+    """Serves the control API of a tracker from a background thread
+
+    Args:
+    ----
+        commands: Function for each command, called with the other fields of
+            the request and returning a dict of fields for the reply
+        on_shutdown: Called for the shutdown command, before replying
+
+    Raises
+    ------
+        RuntimeError: If another tracker is already answering
+    """
+
+    def __init__(
+        self,
+        commands: dict[str, Callable[..., dict]],
+        on_shutdown: Callable[[], None] | None = None,
+    ):
+        self.commands = commands
+        self.on_shutdown = on_shutdown
+        self.address = address()
+        if running():
+            raise RuntimeError("Taptracker is already running")
+
+        if isinstance(self.address, tuple):
+            self._server = _TCPServer(self.address, _Handler)
+        else:
+            # Left by a tracker that crashed, as nothing answered on it
+            Path(self.address).unlink(missing_ok=True)
+            self._server = _UnixServer(self.address, _Handler)
+            os.chmod(self.address, 0o600)
+        self._server.control = self
+        self._token = write_token()
+        self._thread: threading.Thread | None = None
+        self._stop_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def dispatch(self, line: bytes) -> tuple[dict, str | None]:
+        """Reply to one request, and why to close the connection, if it should
+
+        Returns
+        -------
+            The reply, and "shutdown" to stop the server after replying,
+            "rejected" to only close the connection, or None to carry on
+        """
+        import hmac
+
+        try:
+            args = json.loads(line)
+            command = args.pop("command")
+            token = args.pop("token", "")
+        except (ValueError, KeyError, AttributeError):
+            return {"ok": False, "error": f"Not a request: {line[:80]!r}"}, "rejected"
+        if not isinstance(token, str) or not hmac.compare_digest(
+            token.encode(), self._token.encode()
+        ):
+            return {"ok": False, "error": "Missing or wrong token"}, "rejected"
+
+        if command == "shutdown":
+            if self.on_shutdown is not None:
+                self.on_shutdown()
+            return {"ok": True}, "shutdown"
+        if command not in self.commands:
+            choices = sorted([*self.commands, "shutdown"])
+            error = f"Unknown command {command}, choose from {choices}"
+            return {"ok": False, "error": error}, None
+        try:
+            return {"ok": True, **self.commands[command](**args)}, None
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}, None
+
+    def start(self) -> "ControlServer":
+        """Serve requests from a background thread, returns self"""
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name="taptracker-control",
+            daemon=True,
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving, and remove the socket and token files"""
+        with self._stop_lock:
+            if self._stopped.is_set():
+                return
+            if self._thread is not None:
+                self._server.shutdown()
+            self._server.server_close()
+            if not isinstance(self.address, tuple):
+                Path(self.address).unlink(missing_ok=True)
+            with contextlib.suppress(NotRunning):
+                # Unless a tracker started since has replaced it
+                if read_token() == self._token:
+                    CONTROL_TOKEN_FILE.unlink(missing_ok=True)
+            self._stopped.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def wait(self):
+        """Wait until the server has been stopped"""
+        # Wait in short steps, so Ctrl+C can interrupt on every platform
+        while not self._stopped.wait(0.1):
+            pass
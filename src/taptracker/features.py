@@ -0,0 +1,257 @@
+"""Names and per keystroke inputs of the typing features the model is scored on
+
+These mirror what processing.keysprep produces: for each hand (L, R) and
+direction (LL, LR, RL, RR, current hand then previous hand) the mean, std,
+kurtosis, skew and 10th to 90th percentiles of FlightTime and HoldTime.
+"""
+import functools
+import math
+
+import numpy as np
+import pandas as pd
+
+from . import binary
+
+GROUPS = ("L", "R", "LL", "LR", "RL", "RR")
+COLUMNS = ("FlightTime", "HoldTime")
+PERCENTILES = tuple(range(10, 100, 10))
+# Percentiles are named as pandas names the lambdas keysprep is given
+STATS = ("mean", "std", "kurtosis", "skew") + tuple(
+    f"<lambda_{i}>" for i in range(len(PERCENTILES))
+)
+
+
+def feature_name(group: str, column: str, stat: str) -> str:
+    return f"{group}_{column}_{stat}".lower()
+
+
+# Indices into STATS, so describe can skip work nothing needs
+ALL_STATS = frozenset(range(len(STATS)))
+MOMENT_STATS = frozenset({1, 2, 3})
+HIGHER_MOMENT_STATS = frozenset({2, 3})
+PERCENTILE_STATS = frozenset(range(4, len(STATS)))
+
+FEATURE_NAMES = tuple(
+    feature_name(group, column, stat)
+    for group in GROUPS
+    for column in COLUMNS
+    for stat in STATS
+)
+
+
+def prepare(
+    hand: np.ndarray,
+    press_ts: np.ndarray,
+    release_ts: np.ndarray,
+    hold_time: np.ndarray,
+    prev: tuple[str, float] | None = None,
+) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+    """Calculate FlightTime and hand/direction of consecutive L/R keystrokes
+
+    Args:
+    ----
+        hand: "L" or "R" for each keystroke, unknown hands already removed
+        press_ts, release_ts, hold_time: Matching keystroke timings
+        prev: (hand, release_ts) of the keystroke before these, if known. If
+            None the first keystroke is dropped, as it has no direction
+
+    Returns
+    -------
+        Tuple of {column: values} for COLUMNS and {group: mask} for GROUPS,
+        all aligned to the keystrokes that were kept
+    """
+    hand = np.asarray(hand)
+    is_text = hand.dtype.kind in "OUS"
+    press_ts = np.asarray(press_ts, dtype=float)
+    release_ts = np.asarray(release_ts, dtype=float)
+    hold_time = np.asarray(hold_time, dtype=float)
+
+    left = hand == ("L" if is_text else binary.HAND_CODES["L"])
+    if prev is None:
+        prev_left = left[:-1]
+        prev_release = release_ts[:-1]
+        left, press_ts, hold_time = left[1:], press_ts[1:], hold_time[1:]
+    else:
+        prev_left = np.concatenate(([prev[0] == "L"], left[:-1]))
+        prev_release = np.concatenate(([prev[1]], release_ts[:-1]))
+
+    right, prev_right = ~left, ~prev_left
+    columns = {"FlightTime": press_ts - prev_release, "HoldTime": hold_time}
+    masks = {
+        "L": left,
+        "R": right,
+        "LL": left & prev_left,
+        "LR": left & prev_right,
+        "RL": right & prev_left,
+        "RR": right & prev_right,
+    }
+    return columns, masks
+
+
+def describe(x: np.ndarray, wanted: frozenset[int] | None = None) -> np.ndarray:
+    """STATS of x at once, sorting it a single time for the percentiles
+
+    Matches np.mean, np.std, scipy.stats.kurtosis, scipy.stats.skew and
+    np.percentile with their default arguments. If wanted is given, only
+    the statistics with those indices into STATS are calculated, the rest
+    are left as NaN.
+    """
+    n = len(x)
+    out = np.full(len(STATS), np.nan)
+    if n == 0:
+        return out
+    if wanted is None:
+        wanted = ALL_STATS
+
+    mean = x.mean()
+    out[0] = mean
+    if wanted & MOMENT_STATS:
+        d = x - mean
+        d2 = d * d
+        m2 = d2.mean()
+        out[1] = math.sqrt(m2)
+        if m2 > 0 and wanted & HIGHER_MOMENT_STATS:
+            out[2] = (d2 * d2).mean() / (m2 * m2) - 3
+            out[3] = (d2 * d).mean() / m2**1.5
+
+    if wanted & PERCENTILE_STATS:
+        x = np.sort(x)
+        ranks = np.array(PERCENTILES) / 100 * (n - 1)
+        lower = np.floor(ranks).astype(np.intp)
+        upper = np.minimum(lower + 1, n - 1)
+        out[4:] = x[lower] + (x[upper] - x[lower]) * (ranks - lower)
+    return out
+
+
+class FeatureEngine:
+    """Single pass NumPy replacement for processing.keysprep
+
+    The mapping from statistics to output columns is worked out once when the
+    engine is created, then each (group, column) the model needs is filtered,
+    sorted and described a single time per ID and written straight into its
+    place in the output. Statistics and groups the columns don't include are
+    never calculated. Use compiled() to reuse engines for the same columns.
+
+    Args:
+    ----
+        columns: Output columns in order, as model_get_inputs returns them.
+            "id" is filled with the ID, anything else must be in FEATURE_NAMES
+    """
+
+    def __init__(self, columns=("id",) + FEATURE_NAMES):
+        self.columns = list(columns)
+        positions = {name: i for i, name in enumerate(FEATURE_NAMES)}
+        n_stats = len(STATS)
+
+        # {(group, column): [(output position, stat index), ...]}
+        self.plan: dict[tuple[str, str], list[tuple[int, int]]] = {}
+        self.id_position = None
+        for out, name in enumerate(self.columns):
+            if name == "id":
+                self.id_position = out
+                continue
+            if name not in positions:
+                raise ValueError(f"No feature {name} can be calculated")
+
+            i = positions[name]
+            group = GROUPS[i // (len(COLUMNS) * n_stats)]
+            column = COLUMNS[i // n_stats % len(COLUMNS)]
+            self.plan.setdefault((group, column), []).append((out, i % n_stats))
+
+        self.wanted = {
+            key: frozenset(stat for _, stat in targets)
+            for key, targets in self.plan.items()
+        }
+
+    @classmethod
+    @functools.lru_cache(maxsize=8)
+    def compiled(cls, columns: tuple[str, ...]) -> "FeatureEngine":
+        """Engine for columns, shared between calls with the same columns"""
+        return cls(columns)
+
+    def compute(
+        self,
+        ids: np.ndarray,
+        hand: np.ndarray,
+        press_ts: np.ndarray,
+        release_ts: np.ndarray,
+        hold_time: np.ndarray,
+    ) -> pd.DataFrame:
+        """Features for keystrokes with known hands, one row per ID
+
+        Arguments are aligned arrays as in prepare, ids may also be a single ID.
+        The result is indexed by ID whether or not "id" is one of the columns.
+        """
+        ids = np.broadcast_to(np.asarray(ids, dtype=object), np.shape(hand))
+        columns, masks = prepare(hand, press_ts, release_ts, hold_time)
+        ids = ids[1:]
+
+        unique_ids = sorted(set(ids))
+        values = np.full((len(unique_ids), len(self.columns)), np.nan)
+        for row, id in enumerate(unique_ids):
+            is_id = ids == id if len(unique_ids) > 1 else True
+            self._fill(values[row], columns, masks, is_id)
+
+        df = pd.DataFrame(
+            values, columns=self.columns, index=pd.Index(unique_ids, name="ID")
+        )
+        if self.id_position is not None:
+            df[self.columns[self.id_position]] = unique_ids
+        return df
+
+    def _fill(self, out: np.ndarray, columns: dict, masks: dict, is_id=True):
+        """Write the features of prepare's output into the row out"""
+        for (group, column), targets in self.plan.items():
+            stats = describe(
+                columns[column][masks[group] & is_id], self.wanted[group, column]
+            )
+            for position, stat in targets:
+                out[position] = stats[stat]
+
+    def compute_row(
+        self,
+        hand: np.ndarray,
+        press_ts: np.ndarray,
+        release_ts: np.ndarray,
+        hold_time: np.ndarray,
+        out: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Features of one ID's keystrokes as a row of floats, NaN for "id"
+
+        If out is given the row is written into it, e.g. shared memory
+        """
+        if out is None:
+            out = np.full(len(self.columns), np.nan)
+        self._fill(out, *prepare(hand, press_ts, release_ts, hold_time))
+        return out
+
+    def compute_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Features from a frame in the key_presses.csv layout
+
+        hand may be strings, or categorical over binary.HANDS as ingest.read_csv
+        reads it, whose codes are compared without making any strings
+        """
+        df = df[df["hand"] != "U"]
+        hand = df["hand"]
+        if isinstance(hand.dtype, pd.CategoricalDtype) and tuple(
+            hand.cat.categories
+        ) == binary.HANDS:
+            hand = hand.cat.codes
+        return self.compute(
+            df["id"].to_numpy(),
+            hand.to_numpy(),
+            df["press_ts"].to_numpy(),
+            df["release_ts"].to_numpy(),
+            df["hold_time"].to_numpy(),
+        )
+
+    def compute_records(self, uuid: str, records: np.ndarray) -> pd.DataFrame:
+        """Features straight from memory mapped binary.read_keystrokes records"""
+        records = records[records["hand"] != binary.HAND_CODES["U"]]
+        return self.compute(
+            uuid,
+            records["hand"],
+            records["press_ts"],
+            records["release_ts"],
+            records["release_ts"] - records["press_ts"],
+        )
@@ -1,10 +1,22 @@
 import sys
 
 import tkinter
+import tkinter.messagebox
 import customtkinter
 
 from .params import THEME_FILE, LOGO_FILE
-from . import track, report, stop_tracking, handle_exception
+from . import control, track, handle_exception
+from .reporting import ReportJob, TkDispatcher
+
+# Labels for the scoring backend menu, see scoring.py
+SCORING_BACKENDS = {"Score with SAS Viya": "mas", "Score locally": "local"}
+# Labels for the processing backend menu, the first is the default. live
+# statistics come from the running tracker's memory and estimate percentiles,
+# see processing.process
+PROCESSING_BACKENDS = {
+    "Exact statistics": "pandas",
+    "Live statistics (approximate)": "live",
+}
 
 
 def gui():
@@ -16,20 +28,60 @@ def gui():
     app = customtkinter.CTk()
     app.iconphoto(True, tkinter.PhotoImage(file=LOGO_FILE))
     app.title("Taptracker")
-    app.geometry("400x240")
-
+    app.geometry("400x300")
+
+    def show_control_error(action, error):
+        tkinter.messagebox.showerror("Taptracker", f"Could not {action}: {error}")
+
+    def show_tracking():
+        """Set the track button from the status of the running tracker"""
+        try:
+            tracking = control.request("status")["tracking"]
+        except control.NotRunning:
+            tracking = False
+        except (RuntimeError, OSError) as e:
+            show_control_error("get the status of the tracker", e)
+            tracking = False
+        if tracking:
+            track_button.configure(text="Stop tracking", command=btn_stop_tracking)
+        else:
+            track_button.configure(text="Start tracking", command=btn_track)
+
+    # Tracking goes through the control API, so a tracker already running in
+    # another process is used rather than a second one started. If that
+    # fails, e.g. it is already tracking or rejects the request, the error is
+    # shown and the button set from its status
     def btn_track():
-        track()
+        try:
+            try:
+                control.request("start")
+            except control.NotRunning:
+                track()
+        except (RuntimeError, OSError) as e:
+            show_control_error("start tracking", e)
+            show_tracking()
+            return
         track_button.configure(text="Stop tracking", command=btn_stop_tracking)
 
     def btn_stop_tracking():
-        stop_tracking()
+        try:
+            control.request("stop")
+        except control.NotRunning:
+            pass
+        except (RuntimeError, OSError) as e:
+            show_control_error("stop tracking", e)
+            show_tracking()
+            return
         track_button.configure(text="Start tracking", command=btn_track)
 
-    def btn_report():
-        print("Calculating...")
-        report_button.configure(text="Calculating...")
+    # Runs report callbacks in the Tk thread, see reporting.py
+    dispatch = TkDispatcher(app)
+    # The report the button belongs to. Callbacks of an earlier report, e.g.
+    # queued just before it was cancelled, must not touch the button
+    current_job = None
 
+    def btn_report():
+        nonlocal current_job
         # Create new window for results
         results_window = customtkinter.CTkToplevel(app)
         results_window.iconphoto(True, tkinter.PhotoImage(file=LOGO_FILE))
@@ -47,20 +99,70 @@ def gui():
         results_window.attributes("-topmost", True)
         # results_window.after_idle(results_window.attributes, "-topmost", False)
 
-        # Get and show result from model scoring
-        result = report()
-        textbox.configure(text=result)
-        report_button.configure(text="Report")
+        def show(text):
+            # The window may have been closed while the report ran
+            if results_window.winfo_exists():
+                textbox.configure(text=text)
+
+        def show_progress(name, description, number, total):
+            if not job.cancelled:
+                show(f"{description}... ({number}/{total})")
+
+        def show_result(text):
+            nonlocal current_job
+            if job is not current_job:
+                return
+            current_job = None
+            show(text)
+            report_button.configure(text="Report", command=btn_report)
+
+        def show_error(error):
+            show_result(f"Could not calculate a report: {error}")
+
+        def cancel():
+            if not job.done():
+                job.cancel()
+                show_result("Cancelled")
+
+        def close():
+            cancel()
+            results_window.destroy()
+
+        results_window.protocol("WM_DELETE_WINDOW", close)
+        report_button.configure(text="Cancel", command=cancel)
+
+        # Score in a worker thread, so the window keeps responding
+        job = ReportJob(
+            processing_backend=PROCESSING_BACKENDS[processing_menu.get()],
+            scoring_backend=SCORING_BACKENDS[scoring_menu.get()],
+            on_progress=show_progress,
+            on_done=show_result,
+            on_error=show_error,
+            notify=dispatch,
+        )
+        current_job = job
+        job.start()
 
     track_button = customtkinter.CTkButton(
         master=app, text="Start tracking", command=btn_track
     )
-    track_button.place(relx=0.5, rely=0.4, anchor=tkinter.CENTER)
+    show_tracking()
+    track_button.place(relx=0.5, rely=0.2, anchor=tkinter.CENTER)
 
     report_button = customtkinter.CTkButton(
         master=app, text="Report", command=btn_report
     )
-    report_button.place(relx=0.5, rely=0.6, anchor=tkinter.CENTER)
+    report_button.place(relx=0.5, rely=0.4, anchor=tkinter.CENTER)
+
+    scoring_menu = customtkinter.CTkOptionMenu(
+        master=app, values=list(SCORING_BACKENDS)
+    )
+    scoring_menu.place(relx=0.5, rely=0.6, anchor=tkinter.CENTER)
+
+    processing_menu = customtkinter.CTkOptionMenu(
+        master=app, values=list(PROCESSING_BACKENDS), width=220
+    )
+    processing_menu.place(relx=0.5, rely=0.8, anchor=tkinter.CENTER)
 
     app.mainloop()
 
@@ -0,0 +1,191 @@
+"""Typed, column selective reading of CSV key files, in chunks
+
+pd.read_csv on its own infers the type of every column, keeps each id, key
+and hand as a separate Python string and parses timestamps nobody asked for.
+read_csv here only reads the columns asked for, with pinned types:
+
+    id, key     categorical, each distinct value is stored once
+    hand        categorical over binary.HANDS, so its codes are binary hand codes
+    press_ts, release_ts, hold_time     float64
+    timestamp   float64 seconds since the epoch, of the local time written
+
+Keystrokes of unknown hand ("U") are dropped chunk by chunk as the file is
+read, so they never take up memory. With pyarrow installed, the file can be
+streamed with pyarrow.csv instead of pandas' C parser, see ENGINES.
+"""
+import importlib.util
+from pathlib import Path
+from typing import Iterator, Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from . import binary
+from .params import CSV_CHUNK_ROWS
+
+# Columns the features of each ID are calculated from, see features.prepare
+FEATURE_COLUMNS = ("id", "hand", "press_ts", "release_ts", "hold_time")
+HAND_DTYPE = pd.CategoricalDtype(binary.HANDS)
+DTYPES = {
+    "id": "category",
+    "timestamp": str,
+    "press_ts": "float64",
+    "release_ts": "float64",
+    "key": "category",
+    "hand": HAND_DTYPE,
+    "hold_time": "float64",
+}
+# Read as categorical
+TEXT_COLUMNS = ("id", "key", "hand")
+ENGINES = ("c", "pyarrow")
+# Rough length of a key_presses.csv row, to size pyarrow's blocks in rows
+ROW_BYTES = 80
+
+
+def default_engine() -> str:
+    """pyarrow if it is installed, else pandas' C parser"""
+    return "pyarrow" if importlib.util.find_spec("pyarrow") else "c"
+
+
+def seconds(times: pd.Series) -> np.ndarray:
+    """Seconds since the epoch of ISO 8601 strings or datetimes, as float64"""
+    if not pd.api.types.is_datetime64_any_dtype(times):
+        times = pd.to_datetime(times, format="ISO8601")
+    return times.to_numpy("datetime64[ns]").astype(np.int64) / 1e9
+
+
+def _empty(columns: Sequence[str]) -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            column: pd.Series(
+                dtype="float64" if column == "timestamp" else DTYPES[column]
+            )
+            for column in columns
+        }
+    )
+
+
+def _chunks_c(
+    key_file: Path, usecols: list[str], known_hands: bool, chunk_rows: int
+) -> Iterator[pd.DataFrame]:
+    dtype = {column: DTYPES[column] for column in usecols}
+    with pd.read_csv(
+        key_file, usecols=usecols, dtype=dtype, chunksize=chunk_rows
+    ) as reader:
+        for chunk in reader:
+            if known_hands:
+                chunk = chunk[chunk["hand"] != "U"]
+            if "timestamp" in usecols:
+                chunk = chunk.assign(timestamp=seconds(chunk["timestamp"]))
+            yield chunk
+
+
+def _concat(chunks: Iterator[pd.DataFrame], columns: Sequence[str]) -> pd.DataFrame:
+    """Join chunks column by column, merging the categories of each chunk
+
+    Each column is copied out of its chunk as it is read, and each column's
+    parts are freed once joined, so the peak is about the result and a column
+    """
+    parts: dict[str, list] = {column: [] for column in columns}
+    for chunk in chunks:
+        for column in columns:
+            values = chunk[column]
+            if column in TEXT_COLUMNS:
+                parts[column].append(values.array)
+            else:
+                parts[column].append(values.to_numpy(copy=True))
+    if not parts[columns[0]]:
+        return _empty(columns)
+
+    data = {}
+    for column in columns:
+        values = parts.pop(column)
+        if column in TEXT_COLUMNS:
+            data[column] = union_categoricals(values)
+        else:
+            data[column] = np.concatenate(values)
+        del values
+    return pd.DataFrame(data, copy=False)
+
+
+def _read_pyarrow(
+    key_file: Path, usecols: list[str], known_hands: bool, chunk_rows: int
+) -> pd.DataFrame:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    from pyarrow import csv
+
+    types = {}
+    for column in usecols:
+        if column in TEXT_COLUMNS:
+            types[column] = pa.string()
+        elif column == "timestamp":
+            types[column] = pa.timestamp("ns")
+        else:
+            types[column] = pa.float64()
+    block_size = max(chunk_rows * ROW_BYTES, 1 << 16)
+    reader = csv.open_csv(
+        key_file,
+        read_options=csv.ReadOptions(block_size=block_size),
+        convert_options=csv.ConvertOptions(
+            include_columns=usecols, column_types=types
+        ),
+    )
+    batches = []
+    for batch in reader:
+        if known_hands:
+            batch = batch.filter(pc.not_equal(batch.column("hand"), "U"))
+        batches.append(batch)
+    table = pa.Table.from_batches(batches, schema=reader.schema)
+    del batches
+    # Strings only become categorical here, as comparing dictionary arrays
+    # while filtering is not supported by every pyarrow version
+    df = table.to_pandas(
+        strings_to_categorical=True, split_blocks=True, self_destruct=True
+    )
+    if "hand" in df:
+        df["hand"] = df["hand"].astype(HAND_DTYPE)
+    if "timestamp" in df:
+        df["timestamp"] = seconds(df["timestamp"])
+    return df
+
+
+def read_csv(
+    key_file: str | Path,
+    columns: Sequence[str] = FEATURE_COLUMNS,
+    known_hands: bool = True,
+    engine: str | None = None,
+    chunk_rows: int = CSV_CHUNK_ROWS,
+) -> pd.DataFrame:
+    """Read columns of a CSV key file with pinned types, see DTYPES
+
+    Args:
+    ----
+        key_file: CSV key file, in the key_presses.csv layout
+        columns: Columns to read, any of binary.CSV_FIELDS, in this order
+        known_hands: Whether to drop keystrokes of unknown hand while reading
+        engine: One of ENGINES, "c" reads chunk_rows rows at a time with
+            pandas, "pyarrow" streams blocks of about as many rows with
+            pyarrow.csv. By default pyarrow if it is installed
+        chunk_rows: Rows read at a time, the peak memory on top of the result
+
+    Raises
+    ------
+        ValueError: If a column or the engine is unknown
+    """
+    columns = list(columns)
+    unknown = [column for column in columns if column not in DTYPES]
+    if unknown:
+        raise ValueError(f"Unknown columns {unknown}, choose from {list(DTYPES)}")
+    engine = engine or default_engine()
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown CSV engine {engine}, choose from {ENGINES}")
+
+    # hand is needed to drop unknown hands, even if not asked for
+    usecols = columns + ["hand"] if known_hands and "hand" not in columns else columns
+    if engine == "pyarrow":
+        df = _read_pyarrow(Path(key_file), usecols, known_hands, chunk_rows)
+        return df[columns]
+
+    return _concat(_chunks_c(Path(key_file), usecols, known_hands, chunk_rows), columns)
@@ -0,0 +1,266 @@
+"""Group committed appends of keystrokes to a key file, that survive a crash
+
+track() keeps one KeyLog open on its key file for the whole session, so a
+write is a single call on a long lived file handle. Keystrokes are held in
+memory and written together, a group commit, once there are commit_events of
+them or commit_interval seconds have passed. When written data is forced to
+disk is a separate choice:
+
+    fsync="commit"  after every group commit, at most the keystrokes held in
+                    memory are lost if the machine loses power
+    fsync="exit"    only when the log is closed, the operating system writes
+                    the rest out in its own time
+    fsync="never"   leave it all to the operating system
+
+Keystrokes already written survive the process dying, and closing the log,
+as stop_tracking and an uncaught exception do, writes what is held. A crash
+part way through a write leaves a torn final row or record, which would
+misalign every record appended after it, so opening a KeyLog first repairs
+the key file, see recover. A partitioned store is written through its
+journal, see storage.KeyStore.append_journal.
+"""
+import csv
+import os
+import threading
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+from . import binary, metrics, storage
+from .params import LOG_COMMIT_EVENTS, LOG_COMMIT_INTERVAL, LOG_FSYNC, UUID
+
+FSYNC_POLICIES = ("commit", "exit", "never")
+
+
+class FileSink:
+    """Appends KeyInfo records to a key file kept open"""
+
+    file = None
+
+    def write(self, info: list):
+        raise NotImplementedError
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+class CsvSink(FileSink):
+    """Appends KeyInfo records to a key_presses.csv file"""
+
+    def __init__(self, key_file: Path):
+        self.file = key_file.open("a", newline="")
+        self.writer = csv.writer(self.file)
+        if self.file.tell() == 0:
+            self.writer.writerow(binary.CSV_FIELDS)
+
+    def write(self, info: list):
+        self.writer.writerows(
+            (
+                UUID,
+                datetime.fromtimestamp(timestamp),
+                press_ts,
+                release_ts,
+                binary.key_name(key),
+                binary.HANDS[hand],
+                release_ts - press_ts,
+            )
+            for key, hand, timestamp, press_ts, release_ts in binary.keystroke_rows(
+                info
+            )
+        )
+        self.file.flush()
+
+
+class BinarySink(FileSink):
+    """Appends KeyInfo records to a binary key file"""
+
+    def __init__(self, key_file: Path):
+        self.file = key_file.open("ab")
+        if self.file.tell() == 0:
+            binary.write_header(self.file, UUID)
+
+    def write(self, info: list):
+        self.file.write(binary.pack_records(binary.keystroke_rows(info)))
+        self.file.flush()
+
+
+class StoreSink:
+    """Appends KeyInfo records to the journal of a partitioned store"""
+
+    def __init__(self, key_file: Path):
+        self.store = storage.get_store(key_file)
+
+    def write(self, info: list):
+        self.store.append_journal(binary.keystroke_rows(info))
+
+    def sync(self):
+        self.store.sync_journal()
+
+    def close(self):
+        self.store.seal_journal()
+
+
+def open_sink(key_file: Path) -> CsvSink | BinarySink | StoreSink:
+    """Sink for the key file's format, see _taptracker.append_keystrokes"""
+    if key_file.suffix == binary.SUFFIX:
+        return BinarySink(key_file)
+    if key_file.suffix == storage.SUFFIX:
+        return StoreSink(key_file)
+    return CsvSink(key_file)
+
+
+def recover(key_file: Path) -> int:
+    """Repair what a crash can leave at the end of a key file
+
+    A torn final CSV row or binary record is cut off, and rows left in a
+    store's journal are moved into its segments.
+
+    Returns
+    -------
+        Number of bytes cut off, or of rows recovered from a store's journal
+    """
+    if key_file.suffix == storage.SUFFIX:
+        return storage.get_store(key_file).seal_journal() if key_file.exists() else 0
+    if not key_file.exists():
+        return 0
+
+    size = key_file.stat().st_size
+    if key_file.suffix == binary.SUFFIX:
+        if size < binary.HEADER.size:
+            keep = 0
+        else:
+            keep = size - (size - binary.HEADER.size) % binary.RECORD.size
+    else:
+        keep = csv_end(key_file, size)
+
+    if keep < size:
+        with key_file.open("r+b") as f:
+            f.truncate(keep)
+    return size - keep
+
+
+def csv_end(key_file: Path, size: int, chunk: int = 4096) -> int:
+    """Size of key_file up to and including its last newline"""
+    with key_file.open("rb") as f:
+        end = size
+        while end > 0:
+            start = max(end - chunk, 0)
+            f.seek(start)
+            newline = f.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            end = start
+    return 0
+
+
+class KeyLog:
+    """Long lived, group committed writer of keystrokes to a key file
+
+    Args:
+    ----
+        key_file: CSV or binary key file, or partitioned store, repaired with
+            recover before it is opened
+        commit_events: Keystrokes held before they are written, 1 writes each
+            keystroke as soon as it is added
+        commit_interval: Seconds a keystroke can be held before a background
+            thread writes it, None to only write on commit_events and close
+        fsync: When written keystrokes are forced to disk, see FSYNC_POLICIES
+        on_write: Called with each group of KeyInfo once written, in the
+            order they were written, e.g. live.LiveFeatures.add_many
+    """
+
+    def __init__(
+        self,
+        key_file: str | Path,
+        commit_events: int = LOG_COMMIT_EVENTS,
+        commit_interval: float | None = LOG_COMMIT_INTERVAL,
+        fsync: str = LOG_FSYNC,
+        on_write: Callable[[list], None] | None = None,
+    ):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(
+                f"Unknown fsync policy {fsync}, choose from {FSYNC_POLICIES}"
+            )
+        self.key_file = Path(key_file)
+        self.commit_events = max(commit_events, 1)
+        self.commit_interval = commit_interval
+        self.fsync = fsync
+        self.on_write = on_write
+        self.recovered = recover(self.key_file)
+        self.written = 0
+        self.commits = 0
+        self.syncs = 0
+
+        self._sink = open_sink(self.key_file)
+        self._pending: list = []
+        # Held only to swap out _pending, so add never waits on a write
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._timer = None
+        if commit_interval:
+            self._timer = threading.Thread(
+                target=self._run_timer, name="taptracker-keylog", daemon=True
+            )
+            self._timer.start()
+
+    def __len__(self) -> int:
+        """Keystrokes held in memory, not yet written"""
+        return len(self._pending)
+
+    def add(self, info):
+        """Hold a KeyInfo, writing everything held once commit_events are"""
+        with self._pending_lock:
+            self._pending.append(info)
+            full = len(self._pending) >= self.commit_events
+        if full:
+            self.commit()
+
+    def write(self, info: list):
+        """Write a batch of KeyInfo now, along with anything held"""
+        with self._pending_lock:
+            self._pending.extend(info)
+        self.commit()
+
+    def commit(self, sync: bool = False):
+        """Write everything held in one group, and fsync as the policy says"""
+        with self._write_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if batch:
+                with metrics.profiled("capture"), metrics.timer("keylog.write"):
+                    self._sink.write(batch)
+                metrics.observe("keylog.batch", len(batch))
+                self.written += len(batch)
+                self.commits += 1
+                if self.on_write is not None:
+                    self.on_write(batch)
+            if (batch and self.fsync == "commit") or sync:
+                with metrics.timer("keylog.sync"):
+                    self._sink.sync()
+                self.syncs += 1
+
+    def _run_timer(self):
+        while not self._stopping.wait(self.commit_interval):
+            if self._pending:
+                self.commit()
+
+    def close(self):
+        """Write and, unless the policy is never, fsync anything held"""
+        self._stopping.set()
+        if self._timer is not None:
+            self._timer.join()
+        self.commit(sync=self.fsync != "never")
+        self._sink.close()
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written,
+            "commits": self.commits,
+            "syncs": self.syncs,
+            "held": len(self),
+            "recovered": self.recovered,
+        }
@@ -0,0 +1,72 @@
+"""Keyboard layouts, and the key lookup the keyboard hook uses
+
+A layout is a JSON file in the package data directory named layout_{name}.json,
+listing the key names typed with each hand:
+
+    {"name": "UK QWERTY", "hands": {"L": ["tab", "q", ...], "R": ["enter", ...]}}
+
+Key names are as binary.key_name gives them, lower case characters or the
+names of pynput Key members. Keys not listed are given hand "U".
+"""
+import json
+from functools import cache
+
+from . import binary
+from .params import DATA, KEYBOARD_LAYOUT
+
+UNKNOWN_KEY = (0, binary.HAND_CODES["U"])
+
+
+def layouts() -> list[str]:
+    """Names of the layouts available"""
+    return sorted(p.stem.removeprefix("layout_") for p in DATA.glob("layout_*.json"))
+
+
+@cache
+def load_layout(name: str = KEYBOARD_LAYOUT) -> dict[str, str]:
+    """Hand of each key name in a layout"""
+    path = DATA / f"layout_{name}.json"
+    if not path.exists():
+        raise ValueError(f"Unknown keyboard layout {name}, choose from {layouts()}")
+    hands = json.loads(path.read_text())["hands"]
+    return {key: hand for hand, keys in hands.items() for key in keys}
+
+
+class KeyLookup:
+    """Turn pynput keys into (key code, hand code) with one dict lookup
+
+    Codes are those of the binary format, binary.key_code and binary.HANDS.
+    Characters, lower cased, and named keys, by their name, are resolved the
+    first time each is seen and remembered, so repeated keys cost a single
+    lookup on the character or key pynput already holds. Only the char and
+    name attributes of keys are used, so pynput itself is not imported.
+    """
+
+    def __init__(self, layout: str = KEYBOARD_LAYOUT):
+        self.layout = layout
+        self._hands = load_layout(layout)
+        self._named: dict = {}
+        self._chars: dict[str, tuple[int, int]] = {}
+
+    def _resolve(self, name: str) -> tuple[int, int]:
+        code = binary.key_code(name)
+        if code == 0:
+            return UNKNOWN_KEY
+        return code, binary.HAND_CODES[self._hands.get(name, "U")]
+
+    def __call__(self, key: "Key | KeyCode") -> tuple[int, int]:
+        # Key members have no char, KeyCodes without one are unnamed keys
+        char = getattr(key, "char", None)
+        if char is not None:
+            try:
+                return self._chars[char]
+            except KeyError:
+                entry = self._chars[char] = self._resolve(char.lower())
+                return entry
+        try:
+            return self._named[key]
+        except KeyError:
+            name = getattr(key, "name", None)
+            entry = self._resolve(name.lower()) if name else UNKNOWN_KEY
+            self._named[key] = entry
+            return entry
@@ -0,0 +1,172 @@
+"""Typing statistics kept up to date in memory while tracking
+
+LiveFeatures holds, for the tracker's own ID, the running moments and
+quantile sketches aggregate.IncrementalAggregator keeps, and folds in each
+keystroke as the key log writes it, in constant time per keystroke. So the
+running tracker can answer with the features of its whole history without
+reading the key file, and report() can score from it in a time that does not
+grow with the history, see the "live" backend of processing.process.
+
+The history recorded before tracking started is read once, by seed_history
+in a background thread: the saved aggregation state of the key file is
+brought up to where tracking started and taken over, then keystrokes written
+in the meantime are folded in. Statistics are those of the "incremental"
+backend, see aggregate.py for how closely they match "pandas".
+"""
+import threading
+from pathlib import Path
+
+from . import binary, storage
+from .params import UUID
+
+
+def end_offset(key_file: Path) -> int:
+    """Current end of key_file in the units of IncrementalAggregator.offset
+
+    Bytes of a CSV file, records of a binary file or rows of a store
+    """
+    if key_file.suffix == storage.SUFFIX:
+        return len(storage.get_store(key_file)) if key_file.exists() else 0
+    if not key_file.exists():
+        return 0
+    size = key_file.stat().st_size
+    if key_file.suffix == binary.SUFFIX:
+        return max(size - binary.HEADER.size, 0) // binary.RECORD.size
+    return size
+
+
+class LiveFeatures:
+    """Running hand/direction statistics of the keystrokes tracked
+
+    add_many may be called from one thread while features is called from
+    others. Until seed_history has finished, keystrokes are held rather than
+    folded in, as the first of them needs the last keystroke of the history
+    for its direction.
+    """
+
+    def __init__(self):
+        # {group: {column: (moments, sketch)}}, from seed_history
+        self.stats: dict[str, dict[str, tuple]] = {}
+        # Hand and release_ts of the last L/R keystroke
+        self.prev: tuple[str, float] | None = None
+        self.keystrokes = 0
+        self.seeded = threading.Event()
+        self._held: list = []
+        self._lock = threading.Lock()
+
+    def _add(self, hand: str, press_ts: float, release_ts: float):
+        if hand == "U":
+            return
+        self.keystrokes += 1
+        prev, self.prev = self.prev, (hand, release_ts)
+        if prev is None:
+            # No direction, as processing drops the first keystroke
+            return
+
+        flight, hold = press_ts - prev[1], release_ts - press_ts
+        for group in (hand, hand + prev[0]):
+            columns = self.stats[group]
+            moments, sketch = columns["FlightTime"]
+            moments.add(flight)
+            sketch.add(flight)
+            moments, sketch = columns["HoldTime"]
+            moments.add(hold)
+            sketch.add(hold)
+
+    def _add_info(self, info: list):
+        hands = binary.HANDS
+        for key_info in info:
+            self._add(
+                hands[key_info.hand], key_info.press_ns / 1e9, key_info.release_ns / 1e9
+            )
+
+    def add_many(self, info: list):
+        """Fold in KeyInfo records in order, e.g. a batch the key log wrote"""
+        with self._lock:
+            if self.seeded.is_set():
+                self._add_info(info)
+            else:
+                self._held.extend(info)
+
+    def seed(self, stats: dict, prev: tuple[str, float] | None):
+        """Start from the statistics of the keystrokes before those added
+
+        Args:
+        ----
+            stats: {group: {column: (moments, sketch)}} of an aggregator,
+                taken over rather than copied
+            prev: Hand and release_ts of the last keystroke they include
+        """
+        # aggregate imports pandas, which tracking does not otherwise need
+        from .aggregate import QuantileSketch, RunningMoments
+        from .features import COLUMNS, GROUPS
+
+        with self._lock:
+            self.stats = {
+                group: {
+                    column: stats.get(group, {}).get(column)
+                    or (RunningMoments(), QuantileSketch())
+                    for column in COLUMNS
+                }
+                for group in GROUPS
+            }
+            self.prev = prev
+            self._add_info(self._held)
+            self._held = []
+            self.seeded.set()
+
+    def seed_history(self, key_file: Path, until: int, id: str = UUID):
+        """Seed with the statistics of key_file up to until, see end_offset
+
+        Also saves the aggregation state of key_file, so the next start and
+        the "incremental" backend only read what has been added since
+        """
+        from .aggregate import IncrementalAggregator
+
+        try:
+            aggregator = IncrementalAggregator(key_file).load()
+            if aggregator.offset > until:
+                # Saved by a report that already read keystrokes added here
+                aggregator.reset()
+            if aggregator.offset < until:
+                aggregator.update(until)
+                aggregator.save()
+        except Exception:
+            # Carry on with the keystrokes tracked from now on alone
+            self.seed({}, None)
+            raise
+        self.seed(aggregator.groups.get(id, {}), aggregator.prev)
+
+    def start_seeding(self, key_file: Path, until: int) -> threading.Thread:
+        """Run seed_history in a background thread"""
+        thread = threading.Thread(
+            target=self.seed_history,
+            args=(key_file, until),
+            name="taptracker-live",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def features(self) -> dict[str, float]:
+        """Every one of features.FEATURE_NAMES, NaN with too few keystrokes
+
+        Raises
+        ------
+            RuntimeError: If the history has not been read yet
+        """
+        from .features import PERCENTILES, STATS, feature_name
+
+        if not self.seeded.is_set():
+            raise RuntimeError("Still reading the key file, try again shortly")
+        with self._lock:
+            values = {
+                (group, column): (*moments.stats(), *sketch.quantiles(PERCENTILES))
+                for group, columns in self.stats.items()
+                for column, (moments, sketch) in columns.items()
+            }
+        return {
+            feature_name(group, column, stat): float(value)
+            for (group, column), stats in values.items()
+            for stat, value in zip(STATS, stats)
+        }
@@ -0,0 +1,342 @@
+"""Counters, histograms and timers of where taptracker spends its time
+
+Disabled until enable() is called, e.g. by the --stats or --profile options.
+While disabled every function here returns straight away, and the keyboard
+hook is not wrapped at all, see _taptracker.track. Names are dotted by stage:
+
+    capture.on_press, capture.on_release    time in the keyboard hook
+    keylog.write, keylog.sync, keylog.batch key file writes, and their size
+    processing.read, processing.keysprep    reading and aggregating key files
+    connections.upload_data, ...            each call to Viya and CAS
+    report.connect, report.score, ...       each stage of a report
+
+The capture (key file writes), processing and network stages can also be
+profiled, with cProfile or pyinstrument if installed. The calls of each stage
+are accumulated into one profile, written to STATS_DIR by write_profiles. Only
+one stage is profiled at a time, calls made while another is being profiled,
+e.g. by another thread, are timed but not profiled.
+
+The running tracker serves snapshot() as the "metrics" control command.
+"""
+import contextlib
+import functools
+import json
+import math
+import sys
+import threading
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+from .params import STATS_DIR
+
+PROFILERS = ("cprofile", "pyinstrument")
+# Histogram buckets per doubling of the value, so estimates are within 10%
+BUCKETS_PER_OCTAVE = 4
+
+_enabled = False
+_profiler: str | None = None
+
+
+class Histogram:
+    """Count, sum, extremes and log scale buckets of observed values
+
+    Adding a value is constant time, quantiles are estimated from the buckets,
+    to within a factor of 2 ** (1 / BUCKETS_PER_OCTAVE)
+    """
+
+    __slots__ = ("count", "total", "min", "max", "nonpositive", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.nonpositive = 0
+        # {b: count} of values in (2 ** ((b - 1) / k), 2 ** (b / k)]
+        self.buckets: dict[int, int] = {}
+
+    def add(self, value: float):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.nonpositive += 1
+            return
+        bucket = math.ceil(math.log2(value) * BUCKETS_PER_OCTAVE)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate of the q quantile, the geometric middle of its bucket"""
+        if not self.count:
+            return math.nan
+        rank = q * (self.count - 1)
+        seen = self.nonpositive
+        if rank < seen:
+            return max(self.min, 0.0)
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if rank < seen:
+                value = 2 ** ((bucket - 0.5) / BUCKETS_PER_OCTAVE)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count,
+            "min": self.min,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+        }
+
+
+class Registry:
+    """Named counters, histograms of values, and histograms of seconds"""
+
+    def __init__(self):
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, Histogram] = {}
+        self.timers: dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def _observe(self, histograms: dict[str, Histogram], name: str, value: float):
+        with self._lock:
+            histogram = histograms.get(name)
+            if histogram is None:
+                histogram = histograms[name] = Histogram()
+            histogram.add(value)
+
+    def observe(self, name: str, value: float):
+        self._observe(self.histograms, name, value)
+
+    def record_time(self, name: str, seconds: float):
+        self._observe(self.timers, name, seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+                "timers": {k: h.to_dict() for k, h in self.timers.items()},
+            }
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.timers.clear()
+
+
+REGISTRY = Registry()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(profiler: str | None = None):
+    """Start collecting metrics, and profiling stages with profiler if given
+
+    Raises
+    ------
+        ValueError: If profiler is not one of PROFILERS
+        ImportError: If profiler is pyinstrument and it is not installed
+    """
+    global _enabled, _profiler
+    if profiler is not None:
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, choose from {PROFILERS}")
+        if profiler == "pyinstrument":
+            import pyinstrument  # noqa: F401
+    _enabled, _profiler = True, profiler
+
+
+def disable():
+    global _enabled, _profiler
+    _enabled, _profiler = False, None
+
+
+def count(name: str, n: int = 1):
+    if _enabled:
+        REGISTRY.count(name, n)
+
+
+def observe(name: str, value: float):
+    if _enabled:
+        REGISTRY.observe(name, value)
+
+
+class _Timer:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        REGISTRY.record_time(self.name, time.perf_counter() - self.start)
+        if exc[0] is not None:
+            REGISTRY.count(f"{self.name}.errors")
+
+
+_NOT_TIMED = contextlib.nullcontext()
+
+
+def timer(name: str):
+    """Context manager recording the seconds its block takes under name"""
+    return _Timer(name) if _enabled else _NOT_TIMED
+
+
+def timed(name: str | None = None) -> Callable[[Callable], Callable]:
+    """Decorator recording the seconds each call takes, see timer
+
+    Args:
+    ----
+        name: Name to record under, by default module.function
+    """
+
+    def decorate(fn: Callable) -> Callable:
+        label = name or f"{fn.__module__.rpartition('.')[2]}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(label):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# {stage: cProfile.Profile or pyinstrument.Profiler}, accumulated over calls
+_profiles: dict = {}
+_profile_lock = threading.Lock()
+
+
+def _new_profile(profiler: str):
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+
+        return Profiler()
+    import cProfile
+
+    return cProfile.Profile()
+
+
+@contextlib.contextmanager
+def profiled(stage: str):
+    """Add the calls made in the block to the profile of stage, if profiling
+
+    Can also decorate a function, to profile each call of it
+    """
+    profiler = _profiler
+    if profiler is None or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        profile = _profiles.get(stage)
+        if profile is None:
+            profile = _profiles[stage] = _new_profile(profiler)
+        # Repeated start and stop add to the same profile, for both profilers
+        if profiler == "pyinstrument":
+            profile.start()
+        else:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profiler == "pyinstrument":
+                profile.stop()
+            else:
+                profile.disable()
+    finally:
+        _profile_lock.release()
+
+
+def write_profiles(directory: Path = STATS_DIR) -> list[Path]:
+    """Write the profile of each stage so far, .prof for pstats or .txt
+
+    Returns
+    -------
+        Paths written, one per stage profiled
+    """
+    paths = []
+    with _profile_lock:
+        for stage, profile in _profiles.items():
+            directory.mkdir(parents=True, exist_ok=True)
+            if hasattr(profile, "dump_stats"):
+                path = directory / f"{stage}.prof"
+                profile.dump_stats(path)
+            else:
+                path = directory / f"{stage}.txt"
+                path.write_text(profile.output_text(unicode=True), encoding="utf-8")
+            paths.append(path)
+    return paths
+
+
+def snapshot() -> dict:
+    """Every counter, histogram and timer so far, timers in seconds"""
+    return REGISTRY.snapshot()
+
+
+def reset():
+    """Forget every metric and profile collected so far"""
+    REGISTRY.reset()
+    with _profile_lock:
+        _profiles.clear()
+
+
+def format_stats(stats: dict) -> str:
+    """A table of a snapshot, timers in milliseconds"""
+    lines = []
+    columns = ("mean", "p50", "p90", "p99", "max")
+    header = f"{'':<36}{'count':>9}" + "".join(f"{c:>10}" for c in columns)
+    for kind, scale in (("timers", 1000), ("histograms", 1)):
+        if not stats[kind]:
+            continue
+        lines.append(f"{kind + (' (ms)' if scale != 1 else ''):<36}" + header[36:])
+        for name, values in sorted(stats[kind].items()):
+            row = f"  {name:<34}{values['count']:>9}"
+            if values["count"]:
+                row += "".join(f"{values[c] * scale:>10.3f}" for c in columns)
+            lines.append(row)
+    if stats["counters"]:
+        lines.append("counters")
+        counters = sorted(stats["counters"].items())
+        lines.extend(f"  {name:<34}{value:>9}" for name, value in counters)
+    return "\n".join(lines) or "No metrics were recorded"
+
+
+def dump(path: Path | str | None = None, directory: Path = STATS_DIR):
+    """Write profiles to directory, and metrics as JSON to path or a table
+
+    Args:
+    ----
+        path: File to write the snapshot to as JSON, or None or "-" to print
+            it as a table to stderr, so it does not mix with a command's output
+        directory: Where to write profiles, if profiling
+    """
+    if path is None or str(path) == "-":
+        print(format_stats(snapshot()), file=sys.stderr)
+    else:
+        Path(path).write_text(json.dumps(snapshot(), indent=2), encoding="utf-8")
+    for profile_path in write_profiles(directory):
+        print(f"Profile written to {profile_path}", file=sys.stderr)
@@ -0,0 +1,344 @@
+"""Local stand-in for the SAS Viya and CAS REST endpoints taptracker calls
+
+Tables are held in memory as CSV rows, MAS scores with an optional local
+scoring.LocalTreeBackend, and every request is counted by endpoint, so
+round trips can be measured without a Viya deployment:
+
+    with MockViyaServer() as server:
+        connections.BASE_URL, connections.CAS_SERVER = server.url, server.cas_url
+        ...
+        print(server.requests)
+
+Only the requests and CASL programs that connections.py sends are understood.
+
+Latency can be injected per endpoint, and the server can be run on its own
+for the taptracker command line to use, through the TAPTRACKER_BASE_URL and
+TAPTRACKER_CAS_SERVER environment variables:
+
+    python -m taptracker.mockserver --port 8080 --latency 0.05
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SESSIONS = re.compile(r"/cas/sessions/?$")
+ACTION = re.compile(r"/cas/sessions/(?P<session>[^/]+)/actions/(?P<action>[\w.]+)$")
+TOKEN = re.compile(r"/SASLogon/oauth/token$")
+STEPS = re.compile(r"/microanalyticScore/modules/(?P<model>[\w-]+)/steps$")
+SCORE = re.compile(r"/microanalyticScore/modules/(?P<model>[\w-]+)/steps/score$")
+DATA_STEP = re.compile(
+    r"data (?P<out>\w+\.\w+)\((?P<option>append=force|promote=yes)\) ?; ?"
+    r"set (?P<data>\w+\.\w+) ?; ?run ?;"
+)
+CASL_EXISTS = re.compile(r'table\.tableExists result=r / caslib="(\w+)" name="(\w+)"')
+CASL_RUN_CODE = re.compile(r'dataStep\.runCode / code="([^"]*)"')
+CASL_DROP = re.compile(r'table\.dropTable / caslib="(\w+)" name="(\w+)"')
+
+
+class MockViyaServer:
+    """Threaded HTTP server imitating SASLogon, CAS and MAS on a free local port
+
+    Args:
+    ----
+        host, port: Address to listen on, by default any free local port
+        model: Scores MAS requests, if None every score is ("0", 0.5) and the
+            model inputs are every feature keysprep can produce
+        latency: Seconds to wait before every reply, or {endpoint: seconds}
+            with endpoints as counted in requests, e.g. "cas.upload", or
+            their service, e.g. "cas" or "microanalyticScore"
+        jitter: Each wait is scaled by a random factor in 1 +/- jitter
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        model=None,
+        latency: float | dict[str, float] = 0.0,
+        jitter: float = 0.0,
+    ):
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.tables: dict[str, list[bytes]] = {}
+        self.sessions: set[str] = set()
+        self.requests: Counter = Counter()
+        self._lock = threading.Lock()
+        self._tokens = 0
+
+        server = self
+
+        class Handler(MockViyaHandler):
+            mock = server
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, name="mock-viya", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def cas_url(self) -> str:
+        return f"{self.url}cas-shared-default-http/"
+
+    def start(self) -> "MockViyaServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockViyaServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def table(self, caslib: str, name: str) -> list[bytes] | None:
+        """Data rows of a table, without the header row"""
+        rows = self.tables.get(f"{caslib}.{name}".lower())
+        return None if rows is None else rows[1:]
+
+    def delay(self, endpoint: str) -> float:
+        """Seconds of injected latency before replying to endpoint"""
+        latency = self.latency
+        if isinstance(latency, dict):
+            service = endpoint.split(".")[0]
+            latency = latency.get(endpoint, latency.get(service, 0.0))
+        if latency and self.jitter:
+            latency *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return latency
+
+    # CAS actions, called with the lock held
+    def new_token(self) -> dict:
+        self._tokens += 1
+        return {
+            "access_token": f"mock-token-{self._tokens}",
+            "token_type": "bearer",
+            "expires_in": 3600,
+        }
+
+    def new_session(self) -> dict:
+        session = f"mock-session-{len(self.sessions) + 1}"
+        self.sessions.add(session)
+        return {"session": session}
+
+    def model_inputs(self) -> list[str]:
+        if self.model is not None:
+            return self.model.input_columns()
+        from .features import FEATURE_NAMES
+
+        return ["id", *FEATURE_NAMES]
+
+    def steps(self) -> tuple[dict, str]:
+        """MAS steps collection for the model, and its ETag"""
+        inputs = self.model_inputs()
+        etag = f'"{zlib.crc32(json.dumps(inputs).encode()):08x}"'
+        body = {
+            "items": [
+                {"id": "score", "inputs": [{"name": name} for name in inputs]}
+            ]
+        }
+        return body, etag
+
+    def score(self, payload: dict) -> dict:
+        if self.model is None:
+            classification, probability = "0", 0.5
+        else:
+            classification, probability = self.model.score(payload)
+        return {
+            "outputs": [
+                {"name": "classification", "value": classification},
+                {"name": "probability", "value": probability},
+            ]
+        }
+
+    def upload(self, params: dict, body: bytes) -> dict:
+        out = params["casOut"]
+        self.tables[f"{out['caslib']}.{out['name']}".lower()] = body.splitlines()
+        return {}
+
+    def table_exists(self, caslib: str, name: str) -> bool:
+        return f"{caslib}.{name}".lower() in self.tables
+
+    def drop_table(self, caslib: str, name: str) -> dict:
+        self.tables.pop(f"{caslib}.{name}".lower(), None)
+        return {}
+
+    def run_code(self, code: str) -> dict:
+        match = DATA_STEP.fullmatch(code.strip())
+        if match is None:
+            return error(f"Unsupported data step: {code}")
+
+        out, data = match["out"].lower(), match["data"].lower()
+        if data not in self.tables:
+            return error(f"Table {data} not found")
+        if match["option"].startswith("append") and out in self.tables:
+            self.tables[out] += self.tables[data][1:]
+        else:
+            self.tables[out] = list(self.tables[data])
+        return {}
+
+    def run_casl(self, code: str) -> dict:
+        steps = CASL_RUN_CODE.findall(code)
+        exists = CASL_EXISTS.search(code)
+        if exists is not None and len(steps) == 2:
+            # if r.exists then do; <append>; end; else do; <create>; end;
+            steps = [steps[0] if self.table_exists(*exists.groups()) else steps[1]]
+
+        for step in steps:
+            result = self.run_code(step)
+            if "disposition" in result:
+                return result
+        for caslib, name in CASL_DROP.findall(code):
+            self.drop_table(caslib, name)
+        return {}
+
+
+def error(message: str) -> dict:
+    return {"disposition": {"severity": "Error", "formattedStatus": message}}
+
+
+class MockViyaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this each reply
+    # would wait on the client's delayed ACK
+    disable_nagle_algorithm = True
+    mock: MockViyaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(
+        self,
+        endpoint: str,
+        body: dict | None,
+        status: int = 200,
+        headers: dict | None = None,
+    ):
+        # Injected latency is slept without the lock, so calls overlap
+        time.sleep(self.mock.delay(endpoint))
+        data = b"" if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def respond(self, handle, *args):
+        """Call get, put or post and count the request with the lock held"""
+        with self.mock._lock:
+            response = handle(*args)
+            self.mock.requests[response[0]] += 1
+        self.reply(*response)
+
+    def do_GET(self):
+        self.respond(self.get, self.path.split("?")[0])
+
+    def do_PUT(self):
+        body = self.read_body()
+        self.respond(self.put, self.path.split("?")[0], body)
+
+    def do_POST(self):
+        body = self.read_body()
+        self.respond(self.post, self.path.split("?")[0], body)
+
+    # Each returns the arguments for reply, and is called with the lock held
+    def get(self, path: str) -> tuple:
+        if STEPS.search(path) is None:
+            return "unknown", {}, 404
+        body, etag = self.mock.steps()
+        if self.headers.get("If-None-Match") == etag:
+            return "microanalyticScore.steps", None, 304
+        return "microanalyticScore.steps", body, 200, {"ETag": etag}
+
+    def put(self, path: str, body: bytes) -> tuple:
+        if SESSIONS.search(path):
+            return "cas.sessions", self.mock.new_session()
+
+        action = ACTION.search(path)
+        if action is None or action["action"] != "upload":
+            return "unknown", {}, 404
+        if action["session"] not in self.mock.sessions:
+            return "cas.upload", {}, 404
+        params = json.loads(self.headers["JSON-Parameters"])
+        return "cas.upload", self.mock.upload(params, body)
+
+    def post(self, path: str, body: bytes) -> tuple:
+        if TOKEN.search(path):
+            return "SASLogon.token", self.mock.new_token()
+        if SCORE.search(path):
+            return "microanalyticScore.score", self.mock.score(json.loads(body))
+
+        action = ACTION.search(path)
+        if action is None:
+            return "unknown", {}, 404
+        name = action["action"]
+        endpoint = f"cas.{name}"
+        if action["session"] not in self.mock.sessions:
+            return endpoint, {}, 404
+
+        params = json.loads(body or b"{}")
+        if name == "table.tableExists":
+            exists = self.mock.table_exists(params["caslib"], params["name"])
+            return endpoint, {"results": {"exists": int(exists)}}
+        if name == "table.dropTable":
+            return endpoint, self.mock.drop_table(params["caslib"], params["name"])
+        if name == "dataStep.runCode":
+            return endpoint, self.mock.run_code(params["code"])
+        if name == "sccasl.runCasl":
+            return endpoint, self.mock.run_casl(params["code"])
+        return endpoint, error(f"Unsupported action {name}")
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds before every reply"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="Latency varies by +/- this fraction"
+    )
+    parser.add_argument(
+        "--model-file",
+        help="Exported model to score with, see scoring.LocalTreeBackend",
+    )
+    args = parser.parse_args(argv)
+
+    model = None
+    if args.model_file:
+        from .scoring import LocalTreeBackend
+
+        model = LocalTreeBackend(args.model_file)
+
+    server = MockViyaServer(args.host, args.port, model, args.latency, args.jitter)
+    print(f"TAPTRACKER_BASE_URL={server.url}")
+    print(f"TAPTRACKER_CAS_SERVER={server.cas_url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
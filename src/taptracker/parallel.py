@@ -0,0 +1,235 @@
+"""Features for a corpus of key files from many machines, across processes
+
+corpus_features takes key files, or directories of them, and computes one row
+of model inputs per ID. Work is split by ID: every file is first scanned for
+the IDs it holds, files sharing an ID are grouped so each ID is handled by a
+single worker, and the groups are shared between a ProcessPoolExecutor's
+workers, largest first. Each worker writes its IDs' rows straight into one
+shared memory array, so no results are pickled back.
+
+Each ID's keystrokes are taken in file order, with the first dropped, so a
+file holding a single ID gives the same features as processing.feature_rows.
+Unlike feature_rows, flight times never run from one ID's keystrokes into
+another's when IDs are interleaved in a file.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import binary, ingest, storage
+from .features import FeatureEngine
+
+KEY_SUFFIXES = (".csv", binary.SUFFIX, storage.SUFFIX)
+
+
+def key_files(sources: str | Path | list) -> list[Path]:
+    """Key files in sources, each a key file or a directory holding them
+
+    Partitioned stores are key files, not directories to search
+    """
+    if isinstance(sources, (str, Path)):
+        sources = [sources]
+    files = []
+    for source in map(Path, sources):
+        if source.is_dir() and source.suffix != storage.SUFFIX:
+            files.extend(
+                sorted(p for p in source.iterdir() if p.suffix in KEY_SUFFIXES)
+            )
+        else:
+            files.append(source)
+    return files
+
+
+def scan(key_file: Path) -> dict[str, int]:
+    """Number of keystrokes each ID has in key_file"""
+    if storage.is_records(key_file):
+        uuid, records = storage.read_keystrokes(key_file)
+        return {uuid: len(records)}
+    ids = ingest.read_csv(key_file, ["id"], known_hands=False)["id"]
+    return {id: int(n) for id, n in ids.value_counts(sort=False).items()}
+
+
+def load(key_file: Path) -> tuple[np.ndarray, ...]:
+    """(ids, hand codes, press_ts, release_ts, hold_time) of known hands"""
+    if storage.is_records(key_file):
+        uuid, records = storage.read_keystrokes(key_file)
+        records = records[records["hand"] != binary.HAND_CODES["U"]]
+        press_ts, release_ts = records["press_ts"], records["release_ts"]
+        ids = np.full(len(records), uuid, dtype=object)
+        return ids, records["hand"], press_ts, release_ts, release_ts - press_ts
+
+    df = ingest.read_csv(key_file)
+    return (
+        df["id"].to_numpy(dtype=object),
+        # Codes over binary.HANDS, as in binary records
+        df["hand"].cat.codes.to_numpy().astype(np.uint8),
+        df["press_ts"].to_numpy(dtype=float),
+        df["release_ts"].to_numpy(dtype=float),
+        df["hold_time"].to_numpy(dtype=float),
+    )
+
+
+def compute_group(
+    engine: FeatureEngine, files: list[Path], ids: list[str], out: np.ndarray
+):
+    """Write the features of each of ids, from files, into the rows of out"""
+    row_ids, *arrays = (np.concatenate(a) for a in zip(*map(load, files)))
+    # Stable, so each ID's keystrokes stay in file order
+    codes = pd.Index(ids).get_indexer(row_ids)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(ids) + 1))
+    for row in range(len(ids)):
+        rows = order[bounds[row] : bounds[row + 1]]
+        engine.compute_row(*(a[rows] for a in arrays), out=out[row])
+
+
+def _compute_shared(
+    columns: tuple[str, ...],
+    files: list[Path],
+    ids: list[str],
+    name: str,
+    shape: tuple[int, int],
+    first_row: int,
+):
+    # Pool workers share the parent's resource tracker, so attaching adds no
+    # second registration and the parent's unlink is the only cleanup
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        values = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        out = values[first_row : first_row + len(ids)]
+        compute_group(FeatureEngine.compiled(columns), files, ids, out)
+        del values, out
+    finally:
+        shm.close()
+
+
+def group_files(files: list[Path], counts: list[dict]) -> list[tuple[list, list, int]]:
+    """Split files into groups sharing no IDs, largest first
+
+    Returns
+    -------
+        (files, ids, keystrokes) of each group, files in their original order
+        and ids sorted
+    """
+    # Union find over files, joined by the IDs they share
+    parent = list(range(len(files)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    owner: dict[str, int] = {}
+    for i, file_counts in enumerate(counts):
+        for id in file_counts:
+            if id in owner:
+                parent[root(i)] = root(owner[id])
+            else:
+                owner[id] = i
+
+    members: dict[int, list[Path]] = {}
+    ids: dict[int, set[str]] = {}
+    sizes: dict[int, int] = {}
+    for i, file in enumerate(files):
+        group = root(i)
+        members.setdefault(group, []).append(file)
+        ids.setdefault(group, set()).update(counts[i])
+        sizes[group] = sizes.get(group, 0) + sum(counts[i].values())
+    return [
+        (members[group], sorted(ids[group]), sizes[group])
+        for group in sorted(members, key=lambda group: -sizes[group])
+    ]
+
+
+def compute_shared(
+    pool: ProcessPoolExecutor,
+    columns: tuple[str, ...],
+    groups: list[tuple[list, list, int]],
+    n_ids: int,
+) -> np.ndarray:
+    """Run compute_group for each group in pool, into one shared array"""
+    shape = (n_ids, len(columns))
+    size = max(1, n_ids) * len(columns) * np.dtype(float).itemsize
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        shared = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        shared.fill(np.nan)
+        futures, first_row = [], 0
+        for members, member_ids, _ in groups:
+            futures.append(
+                pool.submit(
+                    _compute_shared,
+                    columns,
+                    members,
+                    member_ids,
+                    shm.name,
+                    shape,
+                    first_row,
+                )
+            )
+            first_row += len(member_ids)
+        for future in futures:
+            future.result()
+        values = shared.copy()
+        del shared
+    finally:
+        shm.close()
+        shm.unlink()
+    return values
+
+
+def corpus_features(
+    sources: str | Path | list,
+    input_cols: list[str] | None = None,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """Model inputs for every ID in many key files, computed in parallel
+
+    Args:
+    ----
+        sources: Key files, in any format, or directories of them
+        input_cols: Model input columns, by default from model_get_inputs
+        max_workers: Processes to use, by default one per CPU. With 1, or a
+            single group of files, everything runs in this process
+
+    Returns
+    -------
+        Frame indexed by ID with the model input columns in order
+    """
+    if input_cols is None:
+        from .connections import model_get_inputs
+
+        input_cols = model_get_inputs()
+    columns = tuple(input_cols)
+    engine = FeatureEngine.compiled(columns)
+    files = key_files(sources)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers == 1 or len(files) == 1:
+        groups = group_files(files, [scan(file) for file in files])
+        ids = [id for _, group_ids, _ in groups for id in group_ids]
+        values = np.full((len(ids), len(columns)), np.nan)
+        first_row = 0
+        for members, member_ids, _ in groups:
+            out = values[first_row : first_row + len(member_ids)]
+            compute_group(engine, members, member_ids, out)
+            first_row += len(member_ids)
+    else:
+        # Started before the workers, so they share it, see _compute_shared
+        resource_tracker.ensure_running()
+        with ProcessPoolExecutor(min(max_workers, len(files))) as pool:
+            groups = group_files(files, list(pool.map(scan, files)))
+            ids = [id for _, group_ids, _ in groups for id in group_ids]
+            values = compute_shared(pool, columns, groups, len(ids))
+
+    df = pd.DataFrame(values, columns=list(columns), index=pd.Index(ids, name="ID"))
+    if engine.id_position is not None:
+        df[columns[engine.id_position]] = ids
+    return df.sort_index()
+
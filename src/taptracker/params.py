@@ -1,4 +1,4 @@
-import importlib.resources
+import os
 import uuid
 from pathlib import Path
 
@@ -8,127 +8,90 @@ CLIENT_SECRET = "goobly"
 BASE_URL = "https://xaas-20791154275.engage.sas.com/"
 CAS_SERVER = "https://xaas-20791154275.engage.sas.com:443/cas-shared-default-http/"
 
+# Point at another Viya deployment, or mockserver.py, with environment variables.
+# CAS_SERVER follows BASE_URL unless it is set as well.
+if "TAPTRACKER_BASE_URL" in os.environ:
+    BASE_URL = os.environ["TAPTRACKER_BASE_URL"].rstrip("/") + "/"
+    CAS_SERVER = f"{BASE_URL}cas-shared-default-http/"
+CAS_SERVER = os.environ.get("TAPTRACKER_CAS_SERVER", CAS_SERVER)
+
+# HTTP connection pooling for Viya/CAS calls, see client.py
+HTTP_POOL_SIZE = 10
+HTTP_TIMEOUT = (5.0, 60.0)  # connect, read seconds
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5  # seconds
+
 # Unique identifier for this PC
 UUID = str(uuid.UUID(int=uuid.getnode()))[-12:]
 if UUID[0].isnumeric():
     UUID = f"a{UUID[1:]}"
 
-# Package local files
-DATA = Path(importlib.resources.files("taptracker").joinpath("data"))
+# Package local files. Found from this file rather than with
+# importlib.resources, which takes longer to import than the rest of --track
+DATA = Path(__file__).resolve().parent / "data"
 
 # API tokens
 REFRESH_TOKEN_FILE = DATA / "refresh_token.txt"
+# Access token and CAS session cached between runs, see connections.py
+CREDENTIALS_FILE = DATA / "credentials.json"
+TOKEN_REFRESH_AHEAD = 300  # seconds before expiry to refresh in the background
+TOKEN_MIN_REMAINING = 30  # seconds before expiry to stop using a token
+CAS_SESSION_TTL = 1800  # seconds idle before assuming CAS ended the session
+
+# Model input columns cached from MAS, see connections.model_get_inputs
+SCHEMA_CACHE_FILE = DATA / "schema_cache.json"
+SCHEMA_CACHE_VERSION = 1  # bump to discard caches written by older versions
+SCHEMA_TTL = 24 * 60 * 60  # seconds before revalidating with MAS
+
+# Exported model for scoring locally instead of with MAS, see scoring.py
+LOCAL_MODEL_FILE = DATA / "gb_predict_parkinsons.json"
+SCORING_BACKENDS = ("mas", "local")
+
+# How much of each key file has been uploaded, and how much to send at a time
+UPLOAD_STATE_FILE = DATA / "upload_state.json"
+UPLOAD_CHUNK_BYTES = 16 * 1024 * 1024
 
 # Package directory file to save key info to
 KEY_FILE = DATA / "key_presses.csv"
+# Alternative compact binary format for key info, see binary.py
+KEY_BIN_FILE = DATA / "key_presses.tap"
+# Date partitioned store of binary segments for key info, see storage.py
+KEY_STORE = DATA / "key_presses.parts"
+SEGMENT_TARGET_ROWS = 65536  # small segments are compacted up to this size
+COMPACT_MIN_SEGMENTS = 4  # small segments in a row before compacting them
+COMPACT_INTERVAL = 300.0  # seconds between background compactions
+RETENTION_DAYS = 90  # days of key info to keep, None to keep everything
+RETENTION_REQUIRE_UPLOAD = True  # only delete key info uploaded to CAS
+JOURNAL_SEAL_ROWS = 4096  # journal rows before they are moved into segments
+
+# Writing key info while tracking, see keylog.py
+LOG_COMMIT_EVENTS = 26  # keystrokes held in memory before they are written
+LOG_COMMIT_INTERVAL = 1.0  # seconds a keystroke can be held before it is written
+LOG_FSYNC = "exit"  # fsync after every write ("commit"), on "exit", or "never"
 
 # Theme and image files
 THEME_FILE = DATA / "ctk_theme.json"
 LOGO_FILE = DATA / "Icon.png"
 
-# Whether the process is currently running
-IS_RUNNING = DATA / ".is_running"
-
-# Mapping of each key character to left or right side of keyboard
-KEY_HAND_MAP = {
-    "tab": "L",
-    "caps_lock": "L",
-    "shift_l": "L",
-    "ctrl_l": "L",
-    "f1": "L",
-    "f2": "L",
-    "f3": "L",
-    "f4": "L",
-    "f5": "L",
-    "`": "L",
-    "cmd": "L",
-    "alt": "L",
-    "1": "L",
-    "2": "L",
-    "3": "L",
-    "4": "L",
-    "5": "L",
-    "¬": "L",
-    "|": "L",
-    "!": "L",
-    '"': "L",
-    "£": "L",
-    "$": "L",
-    "%": "L",
-    "q": "L",
-    "w": "L",
-    "e": "L",
-    "r": "L",
-    "t": "L",
-    "y": "L",
-    "a": "L",
-    "s": "L",
-    "d": "L",
-    "f": "L",
-    "g": "L",
-    "z": "L",
-    "x": "L",
-    "c": "L",
-    "v": "L",
-    "b": "L",
-    "u": "R",
-    "i": "R",
-    "o": "R",
-    "p": "R",
-    "h": "R",
-    "j": "R",
-    "k": "R",
-    "l": "R",
-    "n": "R",
-    "m": "R",
-    "6": "R",
-    "7": "R",
-    "8": "R",
-    "9": "R",
-    "0": "R",
-    "^": "R",
-    "&": "R",
-    "*": "R",
-    "(": "R",
-    ")": "R",
-    "-": "R",
-    "=": "R",
-    "[": "R",
-    "]": "R",
-    ";": "R",
-    "'": "R",
-    "#": "R",
-    ",": "R",
-    ".": "R",
-    "/": "R",
-    "_": "R",
-    "+": "R",
-    "{": "R",
-    "}": "R",
-    ":": "R",
-    "@": "R",
-    "~": "R",
-    "<": "R",
-    ">": "R",
-    "?": "R",
-    "enter": "R",
-    "backspace": "R",
-    "alt_r": "R",
-    "ctrl_r": "R",
-    "alt_gr": "R",
-    "up": "R",
-    "down": "R",
-    "left": "R",
-    "right": "R",
-    "shift_r": "R",
-    "insert": "R",
-    "home": "R",
-    "delete": "R",
-    "end": "R",
-    "page_down": "R",
-    "page_up": "R",
-    "print_screen": "R",
-    "scroll_lock": "R",
-    "pause": "R",
-    "num_lock": "R",
-}
+# Control API of the running tracker, see control.py. A Unix socket, or a port
+# on 127.0.0.1 where there are none
+CONTROL_SOCKET = DATA / "taptracker.sock"
+CONTROL_PORT = 47391
+# Random token written by the tracker serving the control API, readable only by
+# its user, which every request has to carry
+CONTROL_TOKEN_FILE = DATA / "taptracker.token"
+CONTROL_TIMEOUT = 5.0  # seconds to wait for the tracker to answer
+
+# Profiles of each stage written by --profile, see metrics.py
+STATS_DIR = DATA / "stats"
+
+# Rows of a CSV key file read at a time, see ingest.py
+CSV_CHUNK_ROWS = 1_000_000
+
+# Buffered capture: ring buffer slots, and how the writer thread drains them
+BUFFER_CAPACITY = 4096
+WRITER_BATCH_SIZE = 256
+WRITER_FLUSH_INTERVAL = 5.0  # seconds
+
+# Keyboard layout deciding which hand types each key, from data/layout_{name}.json
+KEYBOARD_LAYOUT = "uk"
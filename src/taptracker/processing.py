@@ -1,36 +1,124 @@
 from pathlib import Path
+from typing import Sequence
 
 import pandas as pd
 import numpy as np
 from scipy import stats
 
-from taptracker.connections import model_get_inputs
+from taptracker import binary, control, ingest, metrics, storage
+from taptracker.aggregate import aggregate
+from taptracker.connections import model_get_inputs, model_score_many
+from taptracker.features import FeatureEngine
+from taptracker.windows import window_features
 
 
-def process(key_file: str | Path) -> dict:
-    df = pd.read_csv(key_file).query("hand != 'U'")
+@metrics.timed("processing.read")
+def load_keystrokes(
+    key_file: str | Path,
+    columns: Sequence[str] = binary.CSV_FIELDS,
+    known_hands: bool = False,
+) -> pd.DataFrame:
+    """Read key press data from the CSV or binary format, or a partitioned store
 
-    input_cols = model_get_inputs()
+    Columns have the types ingest.read_csv gives them, whatever the format.
+    Binary files are memory mapped, so the numeric columns are only read from
+    disk as they are used
 
-    # Create percentile functions ot use for aggregates
-    def percentn(n):
-        return lambda x: np.percentile(x, n)
-
-    percent_funcs = [percentn(n) for n in range(10, 100, 10)]
+    Args:
+    ----
+        key_file: CSV or binary key press data, or a partitioned store
+        columns: Columns to read, any of binary.CSV_FIELDS
+        known_hands: Whether to leave out keystrokes of unknown hand
+    """
+    key_file = Path(key_file)
+    if not storage.is_records(key_file):
+        return ingest.read_csv(key_file, columns, known_hands)
 
-    agg_df = keysprep(
-        df,
-        ["FlightTime", "HoldTime"],
-        [
-            np.mean,
-            np.std,
-            stats.kurtosis,
-            stats.skew,
-            *percent_funcs
-        ],
-        input_cols,
+    uuid, records = storage.read_keystrokes(key_file)
+    if known_hands:
+        records = records[records["hand"] != binary.HAND_CODES["U"]]
+    press_ts, release_ts = records["press_ts"], records["release_ts"]
+    # Only the columns asked for are made
+    make = {
+        "id": lambda: pd.Categorical.from_codes(np.zeros(len(records), int), [uuid]),
+        "timestamp": lambda: binary.local_seconds(records["timestamp"]),
+        "press_ts": lambda: press_ts,
+        "release_ts": lambda: release_ts,
+        "key": lambda: pd.Categorical(
+            np.vectorize(binary.key_name, otypes=[object])(records["key"])
+        ),
+        "hand": lambda: pd.Categorical.from_codes(
+            records["hand"], dtype=ingest.HAND_DTYPE
+        ),
+        "hold_time": lambda: release_ts - press_ts,
+    }
+    return pd.DataFrame(
+        {column: make[column]() for column in columns},
+        index=pd.RangeIndex(len(records)),
     )
 
+
+@metrics.profiled("processing")
+@metrics.timed()
+def process(
+    key_file: str | Path, backend: str = "pandas", input_cols: list[str] | None = None
+) -> dict:
+    """Calculate the model inputs from key press data as a MAS payload
+
+    Args:
+    ----
+        key_file: CSV or binary key press data, or a partitioned store
+        backend: "pandas" recomputes every statistic from the whole file,
+            "incremental" only reads key presses added since the last call, see
+            aggregate.py for how closely it matches, "numpy" gives the same
+            result as "pandas" in a single pass, see features.FeatureEngine,
+            "live" asks the running tracker, which keeps the "incremental"
+            statistics in memory, see live.py, and is "incremental" otherwise
+        input_cols: Model input columns, by default from model_get_inputs
+    """
+    if input_cols is None:
+        input_cols = model_get_inputs()
+
+    if backend == "live":
+        agg_df = live_features(key_file)[input_cols]
+    elif backend == "incremental":
+        agg_df = aggregate(key_file)[input_cols]
+    elif backend == "numpy":
+        engine = FeatureEngine.compiled(tuple(input_cols))
+        if storage.is_records(key_file):
+            with metrics.timer("processing.read"):
+                uuid, records = storage.read_keystrokes(key_file)
+            agg_df = engine.compute_records(uuid, records)
+        else:
+            with metrics.timer("processing.read"):
+                df = ingest.read_csv(key_file)
+            agg_df = engine.compute_frame(df)
+    elif backend == "pandas":
+        df = load_keystrokes(key_file, ingest.FEATURE_COLUMNS, known_hands=True)
+        # keysprep works on strings, to combine hands into directions
+        df = df.astype({"id": str, "hand": str})
+
+        # Create percentile functions ot use for aggregates
+        def percentn(n):
+            return lambda x: np.percentile(x, n)
+
+        percent_funcs = [percentn(n) for n in range(10, 100, 10)]
+
+        agg_df = keysprep(
+            df,
+            ["FlightTime", "HoldTime"],
+            [
+                np.mean,
+                np.std,
+                stats.kurtosis,
+                stats.skew,
+                *percent_funcs
+            ],
+            input_cols,
+        )
+    else:
+        raise ValueError(f"Unknown processing backend {backend}")
+
     payload_inner = []
     for col, values_dict in agg_df.to_dict().items():
         for value in values_dict.values():
@@ -40,6 +128,92 @@ def process(key_file: str | Path) -> dict:
     return {"inputs": payload_inner}
 
 
+def live_features(key_file: str | Path) -> pd.DataFrame:
+    """Statistics from the running tracker if it tracks key_file, else aggregate
+
+    Also aggregates if the tracker is still reading the key file's history, or
+    does not answer in time
+    """
+    try:
+        reply = control.request("features")
+    except (control.NotRunning, RuntimeError):
+        return aggregate(key_file)
+    if Path(reply["key_file"]) != Path(key_file):
+        return aggregate(key_file)
+    # Sent as null, as JSON has no NaN
+    features = {
+        name: np.nan if value is None else value
+        for name, value in reply["features"].items()
+    }
+    return pd.DataFrame([{"id": reply["id"], **features}])
+
+
+def feature_rows(
+    key_file: str | Path,
+    window: str | int | None = None,
+    input_cols: list[str] | None = None,
+    step: int | None = None,
+) -> pd.DataFrame:
+    """Model inputs for each ID, or each ID and window, one row each
+
+    Args:
+    ----
+        key_file: CSV or binary key press data, which may hold several IDs
+        window: pandas frequency, e.g. "1h" or "1D", to split keystrokes into
+            by their timestamp, or a number of keystrokes for rolling windows
+            of the last window keystrokes, see windows.window_features. If
+            None all of each ID's history is one row
+        input_cols: Model input columns, by default from model_get_inputs
+        step: Keystrokes between rolling windows, see windows.window_features
+
+    Returns
+    -------
+        Frame indexed by ID and window (NaT without a window), with the model
+        input columns in order
+    """
+    if input_cols is None:
+        input_cols = model_get_inputs()
+    if window is not None:
+        return window_features(key_file, window, step, input_cols)
+
+    engine = FeatureEngine.compiled(tuple(input_cols))
+    features = engine.compute_frame(
+        load_keystrokes(key_file, ingest.FEATURE_COLUMNS, known_hands=True)
+    )
+    features.index = pd.MultiIndex.from_arrays(
+        [features.index, [pd.NaT] * len(features)], names=["ID", "window"]
+    )
+    return features
+
+
+def row_payload(row: pd.Series) -> dict:
+    """MAS score payload for one row of feature_rows"""
+    return {
+        "inputs": [
+            {"name": col, "value": 1 if col == "id" else value}
+            for col, value in row.items()
+        ]
+    }
+
+
+def score_rows(
+    rows: pd.DataFrame, model_id: str = "gb_predict_parkinsons", max_workers: int = 4
+) -> pd.DataFrame:
+    """Score every row of feature_rows, with up to max_workers calls at once
+
+    Returns
+    -------
+        Frame with the same index as rows, and classification and probability
+    """
+    results = model_score_many(
+        [row_payload(row) for _, row in rows.iterrows()], model_id, max_workers
+    )
+    return pd.DataFrame(
+        results, index=rows.index, columns=["classification", "probability"]
+    )
+
+
+@metrics.timed()
 def keysprep(user_file_df, columns_to_aggregate, aggregation_functions, scorecols):
     """
     :param user_file_df: pandas dataframe containing all the raw data, one line per keystroke.
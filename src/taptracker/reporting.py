@@ -0,0 +1,221 @@
+"""Run report() in stages on a worker thread, with progress and cancellation
+
+A ReportJob goes through STAGES in order, calling on_progress before each, and
+checks between stages whether it has been cancelled. A stage already running
+is left to finish in the background, and its result thrown away.
+
+Callbacks are made through notify, by default straight from the worker
+thread. A GUI passes a TkDispatcher instead, so they run in the Tk thread:
+
+    dispatch = TkDispatcher(app)
+    job = ReportJob(on_done=show, notify=dispatch).start()
+
+From the command line, or any other thread, wait with ReportJob.result.
+"""
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+
+from . import metrics
+from .params import KEY_FILE, LOCAL_MODEL_FILE
+
+# (name, description) of each stage of a report
+STAGES = (
+    ("connect", "Connecting"),
+    ("schema", "Getting model inputs"),
+    ("features", "Calculating typing statistics"),
+    ("score", "Scoring"),
+)
+
+
+class Cancelled(Exception):
+    """Raised by ReportJob.result when the job was cancelled"""
+
+
+def describe(classification: str, prob: float) -> str:
+    return (
+        f"Based on your typing patterns and this model, it is likely {classification}"
+        " that you are showing symptoms of Parkinson's disease. This is based on"
+        f" the estimated likelihood of {prob:.2%}."
+    )
+
+
+def call(fn: Callable, *args):
+    fn(*args)
+
+
+class ReportJob:
+    """One report, run with run() or in a worker thread with start()
+
+    Args:
+    ----
+        key_file, processing_backend, scoring_backend, model_file: As for report
+        on_progress: Called with (stage name, description, number, total)
+            before each stage, numbered from 1
+        on_done: Called with the report text when finished
+        on_error: Called with the exception if a stage failed
+        notify: Called with a callback and its arguments to make it, e.g. a
+            TkDispatcher to make it in the Tk thread
+    """
+
+    def __init__(
+        self,
+        key_file: Path = KEY_FILE,
+        processing_backend: str = "pandas",
+        scoring_backend: str = "mas",
+        model_file: Path = LOCAL_MODEL_FILE,
+        on_progress: Callable[[str, str, int, int], None] | None = None,
+        on_done: Callable[[str], None] | None = None,
+        on_error: Callable[[BaseException], None] | None = None,
+        notify: Callable = call,
+    ):
+        self.key_file = Path(key_file)
+        self.processing_backend = processing_backend
+        self.scoring_backend = scoring_backend
+        self.model_file = model_file
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.on_error = on_error
+        self.notify = notify
+        self.stage: str | None = None
+        self._result: str | None = None
+        self._error: BaseException | None = None
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Passed from stage to stage
+        self._scorer = None
+        self._input_cols: list[str] | None = None
+        self._payload: dict | None = None
+
+    # One method per stage, sharing state through the job
+    def _connect(self):
+        from .scoring import get_backend
+
+        self._scorer = get_backend(self.scoring_backend, self.model_file)
+        self._scorer.connect()
+
+    def _schema(self):
+        self._input_cols = self._scorer.input_columns()
+
+    def _features(self):
+        from .processing import process
+
+        if not self.key_file.exists():
+            raise RuntimeError(f"No key press data found in {self.key_file}")
+        self._payload = process(
+            self.key_file, self.processing_backend, self._input_cols
+        )
+
+    def _score(self):
+        self._result = describe(*self._scorer.score(self._payload))
+
+    def run(self) -> str:
+        """Run every stage in this thread and return the report text
+
+        Raises
+        ------
+            Cancelled: If cancel was called before the last stage finished
+        """
+        try:
+            for number, (name, description) in enumerate(STAGES, 1):
+                if self._cancelled.is_set():
+                    raise Cancelled(f"Cancelled before {description.lower()}")
+                self.stage = name
+                if self.on_progress is not None:
+                    self.notify(
+                        self.on_progress, name, description, number, len(STAGES)
+                    )
+                with metrics.timer(f"report.{name}"):
+                    getattr(self, f"_{name}")()
+            if self._cancelled.is_set():
+                raise Cancelled("Report cancelled")
+        except BaseException as e:
+            self._error = e
+            self._finished.set()
+            if self.on_error is not None and not isinstance(e, Cancelled):
+                self.notify(self.on_error, e)
+            raise
+        finally:
+            self.stage = None
+        self._finished.set()
+        if self.on_done is not None:
+            self.notify(self.on_done, self._result)
+        return self._result
+
+    def _run_quietly(self):
+        try:
+            self.run()
+        except Exception:
+            # Kept for result and passed to on_error
+            pass
+
+    def start(self) -> "ReportJob":
+        """Run in a worker thread, returns self"""
+        self._thread = threading.Thread(
+            target=self._run_quietly, name="taptracker-report", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """Stop before the next stage, and discard the result of the current one"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def done(self) -> bool:
+        return self._finished.is_set()
+
+    def result(self, timeout: float | None = None) -> str:
+        """Wait for the report text, raising anything the job raised
+
+        Raises
+        ------
+            TimeoutError: If the job has not finished within timeout seconds
+            Cancelled: If the job was cancelled
+        """
+        # Wait in short steps, so Ctrl+C can interrupt on every platform
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._finished.wait(0.1):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError("Report has not finished")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class TkDispatcher:
+    """Makes callbacks from other threads in the Tk thread, via after()
+
+    Tk widgets may only be used from the thread running mainloop, so worker
+    threads queue callbacks here and the Tk thread runs them every interval
+    milliseconds. Create it in the Tk thread.
+
+    Args:
+    ----
+        widget: Any widget of the application, used for after()
+        interval: Milliseconds between checks of the queue
+    """
+
+    def __init__(self, widget, interval: int = 50):
+        self.widget = widget
+        self.interval = interval
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._poll()
+
+    def __call__(self, fn: Callable, *args):
+        self._queue.put((fn, args))
+
+    def _poll(self):
+        while True:
+            try:
+                fn, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            fn(*args)
+        self.widget.after(self.interval, self._poll)
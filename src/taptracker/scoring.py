@@ -0,0 +1,192 @@
+"""Backends that turn typing features into a classification and probability
+
+MASBackend scores with the model deployed to SAS Micro Analytic Service.
+LocalTreeBackend scores an exported gradient boosted tree model in process,
+with no network calls, from a JSON file laid out as:
+
+    {
+        "features": ["l_flighttime_mean", ...],  # model input columns, in order
+        "base_margin": 0.0,          # log odds before any tree, default 0
+        "classes": ["0", "1"],       # classifications for p < / >= threshold
+        "threshold": 0.5,
+        "trees": [...]               # XGBoost dump_model(dump_format="json")
+    }
+
+where each tree node is either a leaf {"nodeid": 3, "leaf": 0.12} or a split
+{"nodeid": 0, "split": "l_holdtime_mean", "split_condition": 0.1,
+"yes": 1, "no": 2, "missing": 1, "children": [...]}, going to "yes" when the
+feature is less than split_condition.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import connections
+from .params import LOCAL_MODEL_FILE, SCORING_BACKENDS
+
+BACKENDS = SCORING_BACKENDS
+
+
+class ScoringBackend:
+    """Interface for scoring the payloads processing.process produces"""
+
+    def connect(self):
+        """Prepare anything needed before scoring, e.g. credentials"""
+
+    def input_columns(self) -> list[str]:
+        """Columns the model needs, in the order processing should give them"""
+        raise NotImplementedError
+
+    def score(self, payload: dict) -> tuple[str, float]:
+        """Classification and probability for one MAS style payload"""
+        raise NotImplementedError
+
+    def score_rows(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """Classification and probability for each row of model inputs"""
+        raise NotImplementedError
+
+
+class MASBackend(ScoringBackend):
+    """Score with the model module deployed to SAS Micro Analytic Service"""
+
+    def __init__(self, model_id: str = "gb_predict_parkinsons", max_workers: int = 4):
+        self.model_id = model_id
+        self.max_workers = max_workers
+
+    def connect(self):
+        connections.ensure_access_token()
+
+    def input_columns(self) -> list[str]:
+        return connections.model_get_inputs(self.model_id)
+
+    def score(self, payload: dict) -> tuple[str, float]:
+        return connections.model_score_presses(payload, self.model_id)
+
+    def score_rows(self, rows: pd.DataFrame) -> pd.DataFrame:
+        from .processing import score_rows
+
+        return score_rows(rows, self.model_id, self.max_workers)
+
+
+class LocalTreeBackend(ScoringBackend):
+    """Score an exported gradient boosted tree model with NumPy
+
+    Every tree is flattened into rows of padded (n_trees, max_nodes) arrays,
+    so all rows are pushed through all trees together, one level per step.
+
+    Args:
+    ----
+        model_file: JSON model export, see the module docstring
+    """
+
+    def __init__(self, model_file: str | Path = LOCAL_MODEL_FILE):
+        model = json.loads(Path(model_file).read_text())
+        self.features = list(model["features"])
+        self.base_margin = float(model.get("base_margin", 0.0))
+        self.classes = tuple(model.get("classes", ("0", "1")))
+        self.threshold = float(model.get("threshold", 0.5))
+        self._compile(model["trees"])
+
+    def _compile(self, trees: list[dict]):
+        index = {name: i for i, name in enumerate(self.features)}
+        flat = [self._flatten(tree) for tree in trees]
+        max_nodes = max(len(nodes) for nodes in flat)
+        shape = (len(flat), max_nodes)
+
+        # Leaves (and padding) have feature -1 and point back at themselves
+        self.feature = np.full(shape, -1, dtype=np.intp)
+        self.split_value = np.zeros(shape)
+        self.yes = np.tile(np.arange(max_nodes), (len(flat), 1))
+        self.no = self.yes.copy()
+        self.missing = self.yes.copy()
+        self.value = np.zeros(shape)
+
+        depth = 0
+        for t, nodes in enumerate(flat):
+            position = {node["nodeid"]: i for i, node in enumerate(nodes)}
+            for i, node in enumerate(nodes):
+                if "leaf" in node:
+                    self.value[t, i] = node["leaf"]
+                    continue
+                self.feature[t, i] = index[node["split"]]
+                self.split_value[t, i] = node["split_condition"]
+                self.yes[t, i] = position[node["yes"]]
+                self.no[t, i] = position[node["no"]]
+                self.missing[t, i] = position[node.get("missing", node["yes"])]
+                depth = max(depth, node.get("depth", 0) + 1)
+        self.depth = depth
+
+    @staticmethod
+    def _flatten(tree: dict) -> list[dict]:
+        nodes, stack = [], [(tree, 0)]
+        while stack:
+            node, depth = stack.pop()
+            nodes.append({**node, "depth": depth})
+            stack.extend((child, depth + 1) for child in node.get("children", ()))
+        return nodes
+
+    def input_columns(self) -> list[str]:
+        return list(self.features)
+
+    def margins(self, X: np.ndarray) -> np.ndarray:
+        """Summed leaf values plus base_margin for each row of X"""
+        n_rows, n_trees = len(X), len(self.feature)
+        trees = np.arange(n_trees)
+        node = np.zeros((n_rows, n_trees), dtype=np.intp)
+
+        for _ in range(self.depth):
+            feature = self.feature[trees, node]
+            if (feature < 0).all():
+                break
+            x = np.take_along_axis(X, np.maximum(feature, 0), axis=1)
+            node = np.where(
+                feature < 0,
+                node,
+                np.where(
+                    np.isnan(x),
+                    self.missing[trees, node],
+                    np.where(
+                        x < self.split_value[trees, node],
+                        self.yes[trees, node],
+                        self.no[trees, node],
+                    ),
+                ),
+            )
+        return self.base_margin + self.value[trees, node].sum(axis=1)
+
+    def probabilities(self, X: np.ndarray) -> np.ndarray:
+        return 1 / (1 + np.exp(-self.margins(np.asarray(X, dtype=float))))
+
+    def score(self, payload: dict) -> tuple[str, float]:
+        values = {i["name"]: i["value"] for i in payload["inputs"]}
+        X = np.array(
+            [[np.nan if values.get(f) is None else values[f] for f in self.features]],
+            dtype=float,
+        )
+        probability = float(self.probabilities(X)[0])
+        return self.classes[probability >= self.threshold], probability
+
+    def score_rows(self, rows: pd.DataFrame) -> pd.DataFrame:
+        X = rows[self.features]
+        if "id" in self.features:
+            # Sent to MAS as 1, see processing.row_payload
+            X = X.assign(id=1)
+        probability = self.probabilities(X.to_numpy(dtype=float))
+        classification = np.array(self.classes, dtype=object)[
+            (probability >= self.threshold).astype(int)
+        ]
+        return pd.DataFrame(
+            {"classification": classification, "probability": probability},
+            index=rows.index,
+        )
+
+
+def get_backend(name: str = "mas", model_file: str | Path = LOCAL_MODEL_FILE):
+    """Scoring backend by name, one of BACKENDS"""
+    if name == "mas":
+        return MASBackend()
+    if name == "local":
+        return LocalTreeBackend(model_file)
+    raise ValueError(f"Unknown scoring backend {name}, expected one of {BACKENDS}")
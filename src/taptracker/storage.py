@@ -0,0 +1,560 @@
+"""Date partitioned key press store, so reads and uploads only touch what they need
+
+A store is a directory of immutable binary.py segment files, one directory
+per local date, with an index of every segment:
+
+    key_presses.parts/
+        index.json
+        2026-01-01/000000000000-1f2e3d4c.tap
+        2026-01-01/000000000026-9a8b7c6d.tap
+        2026-01-02/...
+
+Every keystroke has a row number, counted from the first keystroke ever
+stored, and each segment holds a contiguous run of rows. The index records
+each segment's partition, first row, row count, time range and whether it has
+been uploaded, plus how many rows have been uploaded in total, so readers can
+skip straight to the segments covering a time range or the rows after one
+they have seen, and upload sends only the rows after its watermark.
+
+Each append writes a new small segment. Compaction merges runs of small
+segments into ones of about SEGMENT_TARGET_ROWS, keeping row order, and
+retention deletes segments older than RETENTION_DAYS. Both run in a
+background thread while tracking, see start_compactor.
+
+While tracking, keystrokes are first appended to a journal file in the
+store's root, journal-{first row}.tap, and moved into segments once it holds
+JOURNAL_SEAL_ROWS, see append_journal and seal_journal.
+
+Writers hold a lock file while changing the index, which is replaced
+atomically, so reports and uploads in other processes can read at any time.
+"""
+import json
+import os
+import threading
+import time
+import uuid as uuidlib
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+
+from . import binary
+from .params import (
+    COMPACT_INTERVAL,
+    COMPACT_MIN_SEGMENTS,
+    JOURNAL_SEAL_ROWS,
+    KEY_STORE,
+    RETENTION_DAYS,
+    RETENTION_REQUIRE_UPLOAD,
+    SEGMENT_TARGET_ROWS,
+    UUID,
+)
+
+SUFFIX = ".parts"
+INDEX_VERSION = 1
+LOCK_TIMEOUT = 30.0  # seconds to wait for another writer
+LOCK_STALE = 120.0  # seconds before a lock file is assumed left by a crash
+
+
+class KeyStore:
+    """Segments of key press records under root, see the module docstring
+
+    Use get_store to share one instance, and its thread lock, per directory.
+
+    Args:
+    ----
+        root: Store directory, created on first append
+    """
+
+    def __init__(self, root: str | Path = KEY_STORE):
+        self.root = Path(root)
+        self.index_file = self.root / "index.json"
+        self.lock_file = self.root / "index.lock"
+        self._lock = threading.Lock()
+        # Open journal file, see append_journal
+        self._journal = None
+        self._journal_rows = 0
+
+    def load_index(self) -> dict:
+        try:
+            index = json.loads(self.index_file.read_text())
+        except FileNotFoundError:
+            index = None
+        if index is None or index.get("version") != INDEX_VERSION:
+            index = {
+                "version": INDEX_VERSION,
+                "uuid": None,
+                "rows": 0,
+                "uploaded_rows": 0,
+                "segments": {},
+            }
+        return index
+
+    def _save_index(self, index: dict):
+        tmp = self.index_file.with_suffix(".json.tmp")
+        tmp.write_text(json.dumps(index))
+        os.replace(tmp, self.index_file)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the store's lock file, shared with writers in other processes"""
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while True:
+                try:
+                    fd = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                    break
+                except FileExistsError:
+                    try:
+                        age = time.time() - self.lock_file.stat().st_mtime
+                    except FileNotFoundError:
+                        continue
+                    if age > LOCK_STALE:
+                        self.lock_file.unlink(missing_ok=True)
+                        continue
+                    if time.monotonic() > deadline:
+                        raise TimeoutError(f"Timed out waiting for {self.lock_file}")
+                    time.sleep(0.01)
+            try:
+                yield
+            finally:
+                os.close(fd)
+                self.lock_file.unlink(missing_ok=True)
+
+    def __len__(self) -> int:
+        """Rows ever stored in segments, including any deleted by retention"""
+        return self.load_index()["rows"]
+
+    def _write_segment(
+        self, uuid: str, partition: str, first_row: int, data: bytes
+    ) -> str:
+        """Write packed records as a new segment file, and return its name"""
+        name = f"{partition}/{first_row:012d}-{uuidlib.uuid4().hex[:8]}{binary.SUFFIX}"
+        path = self.root / name
+        path.parent.mkdir(exist_ok=True)
+
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            binary.write_header(f, uuid)
+            f.write(data)
+        os.replace(tmp, path)
+        return name
+
+    def append(self, info: list):
+        """Store KeyInfo records, in a new segment for each date they span"""
+        if not info:
+            return
+        rows = binary.keystroke_rows(info)
+        with self._locked():
+            index = self.load_index()
+            if index["uuid"] is None:
+                index["uuid"] = info[0].id
+            self._add_segments(index, rows)
+            self._save_index(index)
+
+    def _add_segments(self, index: dict, rows: list[tuple]):
+        """Write binary.keystroke_rows rows as the next segments in index"""
+        times = [row[2] for row in rows]
+        first, last = date.fromtimestamp(min(times)), date.fromtimestamp(max(times))
+        rows_by_partition: dict[str, list[tuple]] = {}
+        if first == last:
+            rows_by_partition[first.isoformat()] = rows
+        else:
+            for row in rows:
+                partition = date.fromtimestamp(row[2]).isoformat()
+                rows_by_partition.setdefault(partition, []).append(row)
+
+        for partition, rows in rows_by_partition.items():
+            name = self._write_segment(
+                index["uuid"], partition, index["rows"], binary.pack_records(rows)
+            )
+            times = [row[2] for row in rows]
+            index["segments"][name] = {
+                "partition": partition,
+                "first_row": index["rows"],
+                "rows": len(rows),
+                "start": min(times),
+                "end": max(times),
+                "uploaded": False,
+            }
+            index["rows"] += len(rows)
+
+    def journals(self) -> list[tuple[int, Path]]:
+        """(first row, path) of journal files, oldest first"""
+        return sorted(
+            (int(path.stem.removeprefix("journal-")), path)
+            for path in self.root.glob(f"journal-*{binary.SUFFIX}")
+        )
+
+    def append_journal(self, rows: list[tuple]):
+        """Write binary.keystroke_rows rows to the journal
+
+        The journal is one binary key file that stays open, so an append is a
+        single write rather than a new segment and index. Its rows are
+        numbered on from the index, and read with the segments, until
+        seal_journal moves them into segments. While a journal is open, it
+        must be the only way rows are added to the store.
+        """
+        if self._journal is None:
+            if self.journals():
+                # Left by a crash, its rows come before any written now
+                self.seal_journal()
+            with self._locked():
+                index = self.load_index()
+                if index["uuid"] is None:
+                    index["uuid"] = UUID
+                    self._save_index(index)
+                path = self.root / f"journal-{index['rows']:012d}{binary.SUFFIX}"
+                self._journal = path.open("ab")
+                if path.stat().st_size == 0:
+                    binary.write_header(self._journal, index["uuid"])
+                self._journal_rows = 0
+        self._journal.write(binary.pack_records(rows))
+        self._journal.flush()
+        self._journal_rows += len(rows)
+        if self._journal_rows >= JOURNAL_SEAL_ROWS:
+            self.seal_journal()
+
+    def sync_journal(self):
+        """fsync the journal, so rows written to it survive power loss"""
+        if self._journal is not None:
+            os.fsync(self._journal.fileno())
+
+    def seal_journal(self) -> int:
+        """Move every journal's rows into segments, and delete the journals
+
+        Also recovers journals left by a crash, rows are only ever added to
+        the index once, and a torn final record is dropped.
+
+        Returns
+        -------
+            Number of rows moved into segments
+        """
+        import numpy as np
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+        sealed = 0
+        with self._locked():
+            index = self.load_index()
+            for first_row, path in self.journals():
+                uuid, records = binary.read_keystrokes(path)
+                # Rows before the index's count were sealed before a crash
+                records = np.array(records[max(index["rows"] - first_row, 0) :])
+                if len(records):
+                    if index["uuid"] is None:
+                        index["uuid"] = uuid
+                    self._add_segments(index, records.tolist())
+                    self._save_index(index)
+                    sealed += len(records)
+                self._unlink(path)
+        return sealed
+
+    @staticmethod
+    def segments(
+        index: dict,
+        start: float | None = None,
+        end: float | None = None,
+        from_row: int = 0,
+    ) -> list[tuple[str, dict]]:
+        """(name, entry) of segments with rows from from_row in [start, end)
+
+        start and end are unix seconds. Segments are in row order.
+        """
+        return sorted(
+            (
+                (name, entry)
+                for name, entry in index["segments"].items()
+                if entry["first_row"] + entry["rows"] > from_row
+                and (start is None or entry["end"] >= start)
+                and (end is None or entry["start"] < end)
+            ),
+            key=lambda item: item[1]["first_row"],
+        )
+
+    def read_keystrokes(
+        self,
+        start: float | None = None,
+        end: float | None = None,
+        from_row: int = 0,
+    ):
+        """Records with timestamps in [start, end) and row numbers from from_row
+
+        Only the segments that can hold such records are read, and any rows
+        in the journal.
+
+        Returns
+        -------
+            Tuple of the store's UUID and a structured array with
+            binary.record_dtype(), in row order
+        """
+        import numpy as np
+
+        # Journals are read before the index, so a journal sealed in between
+        # has its rows in the segments of the index instead
+        journals = []
+        for first_row, path in self.journals():
+            try:
+                journals.append((first_row, np.array(binary.read_keystrokes(path)[1])))
+            except (FileNotFoundError, ValueError):
+                continue
+
+        # A segment can be compacted or deleted between reading the index and
+        # opening it, then the new index has its replacement
+        for attempt in range(3):
+            index = self.load_index()
+            parts = []
+            try:
+                for name, entry in self.segments(index, start, end, from_row):
+                    _, records = binary.read_keystrokes(self.root / name)
+                    skip = max(from_row - entry["first_row"], 0)
+                    parts.append(np.array(records[skip : entry["rows"]]))
+                    del records
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+                continue
+            break
+
+        for first_row, records in journals:
+            skip = max(index["rows"], from_row) - first_row
+            if skip < len(records):
+                parts.append(records[max(skip, 0) :])
+
+        if parts:
+            records = np.concatenate(parts)
+        else:
+            records = np.empty(0, dtype=binary.record_dtype())
+        if start is not None:
+            records = records[records["timestamp"] >= start]
+        if end is not None:
+            records = records[records["timestamp"] < end]
+        return index["uuid"] or UUID, records
+
+    def mark_uploaded(self, rows: int):
+        """Record that every row before rows has been uploaded"""
+        with self._locked():
+            index = self.load_index()
+            index["uploaded_rows"] = max(index["uploaded_rows"], rows)
+            for entry in index["segments"].values():
+                if entry["first_row"] + entry["rows"] <= index["uploaded_rows"]:
+                    entry["uploaded"] = True
+            self._save_index(index)
+
+    def compact(
+        self,
+        target_rows: int = SEGMENT_TARGET_ROWS,
+        min_segments: int = COMPACT_MIN_SEGMENTS,
+    ) -> int:
+        """Merge runs of small segments in the same partition into larger ones
+
+        A run is consecutive segments, in row order, each smaller than
+        target_rows and all either uploaded or not. Runs are merged once they
+        reach target_rows or have min_segments segments.
+
+        Returns
+        -------
+            Number of segments removed
+        """
+        import numpy as np
+
+        removed = 0
+        with self._locked():
+            index = self.load_index()
+            for run in self._runs(index, target_rows):
+                rows = sum(entry["rows"] for _, entry in run)
+                if len(run) < 2 or (len(run) < min_segments and rows < target_rows):
+                    continue
+
+                data = b"".join(
+                    np.asarray(
+                        binary.read_keystrokes(self.root / name)[1][: entry["rows"]]
+                    ).tobytes()
+                    for name, entry in run
+                )
+                first = run[0][1]
+                name = self._write_segment(
+                    index["uuid"], first["partition"], first["first_row"], data
+                )
+
+                for old, _ in run:
+                    del index["segments"][old]
+                index["segments"][name] = {
+                    **first,
+                    "rows": rows,
+                    "start": min(entry["start"] for _, entry in run),
+                    "end": max(entry["end"] for _, entry in run),
+                }
+                self._save_index(index)
+                for old, _ in run:
+                    self._unlink(self.root / old)
+                removed += len(run) - 1
+        return removed
+
+    def _runs(self, index: dict, target_rows: int):
+        """Runs of small segments that could be merged, see compact"""
+        run, rows = [], 0
+        for name, entry in self.segments(index):
+            uploaded = entry["first_row"] + entry["rows"] <= index["uploaded_rows"]
+            partly_uploaded = (
+                not uploaded and entry["first_row"] < index["uploaded_rows"]
+            )
+            joins = (
+                run
+                and entry["partition"] == run[-1][1]["partition"]
+                and entry["first_row"] == run[-1][1]["first_row"] + run[-1][1]["rows"]
+                and uploaded == run[-1][1]["uploaded"]
+                and rows + entry["rows"] <= target_rows
+            )
+            if not joins:
+                if run:
+                    yield run
+                run, rows = [], 0
+            if entry["rows"] < target_rows and not partly_uploaded:
+                run.append((name, {**entry, "uploaded": uploaded}))
+                rows += entry["rows"]
+        if run:
+            yield run
+
+    def apply_retention(
+        self,
+        days: float | None = RETENTION_DAYS,
+        require_upload: bool = RETENTION_REQUIRE_UPLOAD,
+        now: float | None = None,
+    ) -> int:
+        """Delete segments whose newest keystroke is more than days old
+
+        Args:
+        ----
+            days: Age in days to keep, None to keep everything
+            require_upload: Keep segments that have not been uploaded
+            now: Unix seconds to measure age from, by default the current time
+
+        Returns
+        -------
+            Number of segments deleted
+        """
+        if days is None:
+            return 0
+        cutoff = (time.time() if now is None else now) - days * 24 * 60 * 60
+
+        with self._locked():
+            index = self.load_index()
+            expired = [
+                name
+                for name, entry in index["segments"].items()
+                if entry["end"] < cutoff and (entry["uploaded"] or not require_upload)
+            ]
+            if not expired:
+                return 0
+            for name in expired:
+                del index["segments"][name]
+            self._save_index(index)
+
+            for name in expired:
+                self._unlink(self.root / name)
+            partitions = {entry["partition"] for entry in index["segments"].values()}
+            for directory in self.root.iterdir():
+                if directory.is_dir() and directory.name not in partitions:
+                    self._remove_partition(directory)
+        return len(expired)
+
+    @staticmethod
+    def _unlink(path: Path):
+        # A reader in another process may still have the file open on Windows,
+        # it is no longer in the index so is removed with its partition later
+        try:
+            path.unlink(missing_ok=True)
+        except PermissionError:
+            pass
+
+    def _remove_partition(self, directory: Path):
+        for path in directory.iterdir():
+            self._unlink(path)
+        try:
+            directory.rmdir()
+        except OSError:
+            pass
+
+    def partitions(self) -> list[date]:
+        """Dates with stored key presses"""
+        index = self.load_index()
+        return sorted(
+            {date.fromisoformat(e["partition"]) for e in index["segments"].values()}
+        )
+
+    def start_compactor(self, interval: float = COMPACT_INTERVAL) -> "Compactor":
+        compactor = Compactor(self, interval)
+        compactor.start()
+        return compactor
+
+
+class Compactor(threading.Thread):
+    """Background thread that compacts a store and applies retention
+
+    Args:
+    ----
+        store: KeyStore to maintain
+        interval: Seconds between passes
+    """
+
+    def __init__(self, store: KeyStore, interval: float = COMPACT_INTERVAL):
+        super().__init__(name="taptracker-compactor", daemon=True)
+        self.store = store
+        self.interval = interval
+        self.passes = 0
+        self.errors = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        try:
+            self.store.compact()
+            self.store.apply_retention()
+        except (OSError, TimeoutError):
+            # e.g. the lock is held by a long upload, try again next pass
+            self.errors += 1
+        self.passes += 1
+
+    def stop(self, timeout: float | None = None):
+        """Stop after any pass in progress, then run a final pass"""
+        self._stopping.set()
+        self.join(timeout)
+        self.run_once()
+
+
+_stores: dict[Path, KeyStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(root: str | Path = KEY_STORE) -> KeyStore:
+    """The shared KeyStore for root"""
+    root = Path(root).resolve()
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = KeyStore(root)
+        return _stores[root]
+
+
+def is_records(key_file: str | Path) -> bool:
+    """Whether key_file is a binary key file or store, rather than CSV"""
+    return Path(key_file).suffix in (binary.SUFFIX, SUFFIX)
+
+
+def read_keystrokes(key_file: str | Path, from_row: int = 0):
+    """binary.read_keystrokes for either a binary key file or a store
+
+    Returns
+    -------
+        Tuple of the UUID and records from row from_row on
+    """
+    key_file = Path(key_file)
+    if key_file.suffix == SUFFIX:
+        return get_store(key_file).read_keystrokes(from_row=from_row)
+    uuid, records = binary.read_keystrokes(key_file)
+    return uuid, records[from_row:]
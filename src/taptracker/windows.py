@@ -0,0 +1,332 @@
+"""Typing features over time windows, for tracking trends across months of data
+
+Keystrokes are sorted by time once per ID, FlightTime and hand/direction are
+worked out over the whole history, then every window is described without
+going back to the raw frame:
+
+    time windows ("1h", "1D", any pandas frequency): keystrokes are split at
+        window boundaries of the sorted timestamps, and the moments and
+        percentiles of every window come from one grouped pass per
+        (group, column), with a single sort keyed by (window, value).
+    count windows (an int N): the last N keystrokes, moved on step keystrokes
+        at a time. Moments come from sums over blocks of step keystrokes that
+        slide along the history, so each keystroke is only summed once, and
+        percentiles from sorting batches of windows as rows of one 2D array.
+
+Unlike processing.feature_rows without a window, the first keystroke of a
+window keeps the FlightTime from the keystroke before it, only each ID's
+first keystroke is dropped. Count window moments are calculated from raw
+power sums, so match features.describe to about 1e-9 relative rather than
+exactly.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import binary, ingest, storage
+from .features import (
+    HIGHER_MOMENT_STATS,
+    MOMENT_STATS,
+    PERCENTILE_STATS,
+    PERCENTILES,
+    STATS,
+    FeatureEngine,
+    prepare,
+)
+
+QUANTILES = np.array(PERCENTILES) / 100
+# Values sorted at once for count window percentiles
+SORT_BATCH = 1 << 22
+
+
+def to_datetime64(seconds: np.ndarray) -> np.ndarray:
+    """Seconds since the epoch as naive datetime64[ns]"""
+    return np.round(seconds * 1e9).astype(np.int64).view("datetime64[ns]")
+
+
+def load_sorted(key_file: str | Path) -> dict[str, np.ndarray]:
+    """Keystrokes with known hands, sorted by ID then time
+
+    Returns
+    -------
+        Dict of aligned arrays: id, time (local seconds since the epoch), hand,
+        press_ts, release_ts and hold_time
+    """
+    key_file = Path(key_file)
+    if storage.is_records(key_file):
+        uuid, records = storage.read_keystrokes(key_file)
+        records = records[records["hand"] != binary.HAND_CODES["U"]]
+        data = {
+            "id": np.full(len(records), uuid, dtype=object),
+            "time": binary.local_seconds(records["timestamp"]),
+            "hand": np.asarray(records["hand"]),
+            "press_ts": np.asarray(records["press_ts"]),
+            "release_ts": np.asarray(records["release_ts"]),
+        }
+        data["hold_time"] = data["release_ts"] - data["press_ts"]
+    else:
+        df = ingest.read_csv(key_file, ("timestamp", *ingest.FEATURE_COLUMNS))
+        data = {
+            "id": df["id"].to_numpy(dtype=object),
+            "time": df["timestamp"].to_numpy(),
+            # Codes over binary.HANDS, as in binary records
+            "hand": df["hand"].cat.codes.to_numpy(),
+            "press_ts": df["press_ts"].to_numpy(dtype=float),
+            "release_ts": df["release_ts"].to_numpy(dtype=float),
+            "hold_time": df["hold_time"].to_numpy(dtype=float),
+        }
+
+    order = np.lexsort((data["time"], data["id"].astype(str)))
+    return {name: values[order] for name, values in data.items()}
+
+
+def describe_windows(
+    x: np.ndarray, window: np.ndarray, n_windows: int, wanted: frozenset[int]
+) -> np.ndarray:
+    """features.describe of x for every window at once
+
+    Args:
+    ----
+        x: Values, in order of their window
+        window: Non decreasing window number of each value
+        n_windows: Number of windows, some of which may have no values
+        wanted: Indices into STATS to calculate, the rest are left as NaN
+
+    Returns
+    -------
+        Array of shape (n_windows, len(STATS)), NaN for empty windows
+    """
+    out = np.full((n_windows, len(STATS)), np.nan)
+    n = np.bincount(window, minlength=n_windows)
+    has = n > 0
+    mean = np.bincount(window, x, n_windows)[has] / n[has]
+    out[has, 0] = mean
+
+    if wanted & MOMENT_STATS:
+        d = x - np.repeat(mean, n[has])
+        d2 = d * d
+        m2 = np.bincount(window, d2, n_windows)[has] / n[has]
+        out[has, 1] = np.sqrt(m2)
+        if wanted & HIGHER_MOMENT_STATS:
+            m3 = np.bincount(window, d2 * d, n_windows)[has] / n[has]
+            m4 = np.bincount(window, d2 * d2, n_windows)[has] / n[has]
+            out[has, 2:4] = _higher_moments(m2, m3, m4)
+
+    if wanted & PERCENTILE_STATS:
+        # Sort by value, then stably by window, cheaper than a lexsort
+        order = np.argsort(x)
+        x = x[order[np.argsort(window[order], kind="stable")]]
+        starts = np.cumsum(n) - n
+        out[has, 4:] = _percentiles(x, starts[has], n[has])
+    return out
+
+
+def _higher_moments(m2, m3, m4) -> np.ndarray:
+    """Kurtosis and skew columns from central moments, NaN where m2 is 0"""
+    result = np.full((len(m2), 2), np.nan)
+    positive = m2 > 0
+    m2 = m2[positive]
+    result[positive, 0] = m4[positive] / (m2 * m2) - 3
+    result[positive, 1] = m3[positive] / m2**1.5
+    return result
+
+
+def _percentiles(x_sorted: np.ndarray, starts: np.ndarray, n: np.ndarray):
+    """np.percentile of PERCENTILES for runs of x_sorted, each run sorted"""
+    ranks = QUANTILES * (n[:, None] - 1)
+    lower = np.floor(ranks).astype(np.intp)
+    upper = np.minimum(lower + 1, n[:, None] - 1)
+    low = x_sorted[starts[:, None] + lower]
+    high = x_sorted[starts[:, None] + upper]
+    return low + (high - low) * (ranks - lower)
+
+
+def time_windows(
+    engine: FeatureEngine, data: dict[str, np.ndarray], freq: str
+) -> tuple[np.ndarray, np.ndarray]:
+    """Features of one ID's sorted keystrokes for each window of freq
+
+    Returns
+    -------
+        Tuple of window starts and an array with a row of engine.columns for
+        each window holding at least one keystroke
+    """
+    columns, masks = prepare(
+        data["hand"], data["press_ts"], data["release_ts"], data["hold_time"]
+    )
+    starts = pd.DatetimeIndex(to_datetime64(data["time"][1:])).floor(freq).to_numpy()
+    new = np.empty(len(starts), dtype=bool)
+    new[:1] = True
+    new[1:] = starts[1:] != starts[:-1]
+    window = np.cumsum(new) - 1
+    n_windows = int(new.sum())
+
+    values = np.full((n_windows, len(engine.columns)), np.nan)
+    for (group, column), targets in engine.plan.items():
+        mask = masks[group]
+        stats = describe_windows(
+            columns[column][mask],
+            window[mask],
+            n_windows,
+            engine.wanted[group, column],
+        )
+        for out, stat in targets:
+            values[:, out] = stats[:, stat]
+    return starts[new], values
+
+
+def count_windows(
+    engine: FeatureEngine, data: dict[str, np.ndarray], size: int, step: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Features of one ID's last size keystrokes, every step keystrokes
+
+    Windows end on the latest keystroke and every step keystrokes before it,
+    and only full windows are described.
+
+    Returns
+    -------
+        Tuple of the time of each window's last keystroke and an array with a
+        row of engine.columns for each window
+    """
+    if size % step:
+        raise ValueError(f"Window size {size} must be a multiple of step {step}")
+
+    columns, masks = prepare(
+        data["hand"], data["press_ts"], data["release_ts"], data["hold_time"]
+    )
+    time = data["time"][1:]
+    total = len(time)
+    if total < size:
+        return np.empty(0, dtype="datetime64[ns]"), np.empty((0, len(engine.columns)))
+
+    # Blocks of step keystrokes, aligned so the last block ends on the last keystroke
+    first = (total - size) % step
+    bounds = np.arange(first, total + 1, step)
+    blocks_per_window = size // step
+    n_windows = len(bounds) - blocks_per_window
+    ends = to_datetime64(time[bounds[blocks_per_window:] - 1])
+
+    values = np.full((n_windows, len(engine.columns)), np.nan)
+    for (group, column), targets in engine.plan.items():
+        positions = np.flatnonzero(masks[group])
+        x = columns[column][positions]
+        edges = np.searchsorted(positions, bounds)
+        stats = _slide(x, edges, blocks_per_window, engine.wanted[group, column])
+        for out, stat in targets:
+            values[:, out] = stats[:, stat]
+    return ends, values
+
+
+def _slide(
+    x: np.ndarray, edges: np.ndarray, blocks: int, wanted: frozenset[int]
+) -> np.ndarray:
+    """STATS of x[edges[i]:edges[i + blocks]] for every window i"""
+    n_windows = len(edges) - blocks
+    out = np.full((n_windows, len(STATS)), np.nan)
+    x, edges = x[edges[0] : edges[-1]], edges - edges[0]
+    block = np.repeat(np.arange(len(edges) - 1), np.diff(edges))
+    kernel = np.ones(blocks)
+
+    def window_sums(weights):
+        per_block = np.bincount(block, weights, len(edges) - 1)
+        return np.convolve(per_block, kernel, "valid")
+
+    n = np.round(window_sums(None)).astype(np.intp)
+    has = n > 0
+    if not has.any():
+        return out
+
+    # Shift by the median so power sums of typical values don't cancel
+    shift = np.median(x)
+    y = x - shift
+    powers = range(1, 5 if wanted & MOMENT_STATS else 2)
+    sums = [window_sums(y**k)[has] / n[has] for k in powers]
+    mu = sums[0]
+    out[has, 0] = mu + shift
+    if wanted & MOMENT_STATS:
+        s2, s3, s4 = sums[1:]
+        m2 = np.maximum(s2 - mu * mu, 0)
+        out[has, 1] = np.sqrt(m2)
+        if wanted & HIGHER_MOMENT_STATS:
+            m3 = s3 - 3 * mu * s2 + 2 * mu**3
+            m4 = s4 - 4 * mu * s3 + 6 * mu * mu * s2 - 3 * mu**4
+            out[has, 2:4] = _higher_moments(m2, m3, m4)
+
+    if wanted & PERCENTILE_STATS:
+        # Each window is a row of a strided view of x, padded with inf past
+        # its end, and rows are copied and sorted a batch at a time
+        starts, lengths = edges[:n_windows], edges[blocks:] - edges[:n_windows]
+        width = lengths.max()
+        padded = np.concatenate((x, np.full(width, np.inf)))
+        view = sliding_window_view(padded, width)
+        batch = max(SORT_BATCH // width, 1)
+        for first in range(0, n_windows, batch):
+            part = slice(first, first + batch)
+            values, n = view[starts[part]], lengths[part]
+            values[np.arange(width) >= n[:, None]] = np.inf
+            values.sort(axis=1)
+            full = n > 0
+            out[part][full, 4:] = _percentiles(
+                values.ravel(), np.flatnonzero(full) * width, n[full]
+            )
+    return out
+
+
+def window_features(
+    key_file: str | Path,
+    window: str | int,
+    step: int | None = None,
+    input_cols: list[str] | None = None,
+) -> pd.DataFrame:
+    """Model inputs for each ID and window of key_file
+
+    Args:
+    ----
+        key_file: CSV or binary key press data, which may hold several IDs
+        window: pandas frequency, e.g. "1h" or "1D", for fixed time windows,
+            or a number of keystrokes for the last window keystrokes
+        step: With a number of keystrokes, how many keystrokes apart windows
+            end, by default a tenth of window if that divides it evenly,
+            otherwise window. Must divide window
+        input_cols: Model input columns, by default from model_get_inputs
+
+    Returns
+    -------
+        Frame indexed by ID and window, the start of time windows or the time
+        of the last keystroke of count windows, with the model input columns
+    """
+    if input_cols is None:
+        from .connections import model_get_inputs
+
+        input_cols = model_get_inputs()
+    engine = FeatureEngine.compiled(tuple(input_cols))
+    data = load_sorted(key_file)
+
+    ids = data["id"]
+    splits = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+    index, frames = [], []
+    for rows in np.split(np.arange(len(ids)), splits):
+        if len(rows) < 2:
+            continue
+        part = {name: values[rows] for name, values in data.items()}
+        if isinstance(window, int):
+            if step is None:
+                step = window // 10 if window >= 10 and not window % 10 else window
+            labels, values = count_windows(engine, part, window, step)
+        else:
+            labels, values = time_windows(engine, part, window)
+        if engine.id_position is not None:
+            values = values.astype(object)
+            values[:, engine.id_position] = ids[rows[0]]
+        index += [(ids[rows[0]], label) for label in labels]
+        frames.append(values)
+
+    return pd.DataFrame(
+        np.concatenate(frames) if frames else np.empty((0, len(engine.columns))),
+        columns=engine.columns,
+        index=pd.MultiIndex.from_tuples(index, names=["ID", "window"])
+        if index
+        else pd.MultiIndex.from_arrays([[], []], names=["ID", "window"]),
+    )
@@ -0,0 +1,45 @@
+"""Memory footprint of the KeyInfo records the keyboard hook creates
+
+The hook makes one per keystroke and buffered tracking holds thousands, so
+KeyInfo is slotted, see benchmarks/keyinfo.py for the full comparison
+"""
+import gc
+import time
+import tracemalloc
+
+import pytest
+
+from taptracker._taptracker import KeyInfo
+
+RECORDS = 10_000
+# The object with its four slots, and the two nanosecond readings, which are
+# too large for Python's cached small ints. Measured at 128 on CPython 3.11,
+# where the same class without __slots__ takes 168
+MAX_BYTES_PER_RECORD = 144
+
+
+def keystroke() -> KeyInfo:
+    info = KeyInfo(ord("a"), 1, time.perf_counter_ns())
+    info.release_ns = time.perf_counter_ns()
+    return info
+
+
+def test_keyinfo_is_slotted():
+    info = keystroke()
+    assert not hasattr(info, "__dict__")
+    with pytest.raises(AttributeError):
+        info.timestamp = 0.0
+
+
+def test_keyinfo_allocation_ceiling():
+    held = [None] * RECORDS
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(RECORDS):
+            held[i] = keystroke()
+        allocated = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    assert allocated / RECORDS <= MAX_BYTES_PER_RECORD